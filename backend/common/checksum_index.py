@@ -0,0 +1,232 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+# On-disk index of file checksums, shared by the tools which verify the
+# packages on the filesystem (spacewalk-repo-sync, satellite-sync,
+# spacewalk-data-fsck)
+#
+
+import os
+import sys
+import sqlite3
+import threading
+
+from spacewalk.common.checksum import getFileChecksum
+from spacewalk.common.rhnLog import log_debug, log_error
+
+INDEX_FILE = "/var/cache/rhn/checksum_index.db"
+# Seconds to wait for another process writing to the index
+LOCK_TIMEOUT = 60
+# Changes are written out every so many files
+FLUSH_INTERVAL = 500
+
+_schema = """
+    create table if not exists checksums (
+        path          text not null,
+        checksum_type text not null,
+        checksum      text not null,
+        inode         integer not null,
+        size          integer not null,
+        mtime         real not null,
+        primary key (path, checksum_type)
+    )
+"""
+
+
+def _stat_key(stat_info):
+    return (stat_info.st_ino, stat_info.st_size, stat_info.st_mtime)
+
+
+class ChecksumIndex:
+
+    """
+    Checksums of files, by absolute path and checksum type.
+
+    A checksum is valid as long as the file keeps its inode, size and mtime;
+    once any of them changes, the file is read again. The index is an SQLite
+    database in WAL mode, so any number of processes can read it while
+    another one writes. Changes are kept in memory and written out in short
+    transactions every FLUSH_INTERVAL files and on flush() or close().
+
+    An index which can't be opened is not fatal, checksums are then simply
+    computed every time.
+    """
+
+    def __init__(self, filename=INDEX_FILE, timeout=LOCK_TIMEOUT):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # path -> (stat key, {checksum_type: checksum}), or None if removed
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.dbh = None
+        try:
+            self.dbh = self._open(filename, timeout)
+        except (sqlite3.Error, OSError, IOError):
+            e = sys.exc_info()[1]
+            log_error("Unable to open checksum index %s: %s" % (filename, e))
+
+    @staticmethod
+    def _open(filename, timeout):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, int('0755', 8))
+        dbh = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+        # Paths are byte strings
+        dbh.text_factory = str
+        dbh.execute("pragma journal_mode = wal")
+        dbh.execute("pragma synchronous = normal")
+        dbh.execute(_schema)
+        dbh.commit()
+        return dbh
+
+    def get(self, path, checksum_type, stat_info=None):
+        """
+        Return the checksum of the file if known and still valid, else None.
+        """
+        try:
+            if stat_info is None:
+                stat_info = os.stat(path)
+        except OSError:
+            return None
+        self.lock.acquire()
+        try:
+            if path in self._pending:
+                entry = self._pending[path]
+                if entry is None or entry[0] != _stat_key(stat_info):
+                    return None
+                if checksum_type in entry[1]:
+                    return entry[1][checksum_type]
+            return self._select(path, checksum_type, stat_info)
+        finally:
+            self.lock.release()
+
+    def _select(self, path, checksum_type, stat_info):
+        if self.dbh is None:
+            return None
+        try:
+            row = self.dbh.execute("""
+                select checksum, inode, size, mtime
+                  from checksums
+                 where path = ? and checksum_type = ?
+            """, (path, checksum_type)).fetchone()
+        except sqlite3.Error:
+            e = sys.exc_info()[1]
+            log_debug(2, "Checksum index lookup failed", path, e)
+            return None
+        if row is None:
+            return None
+        if tuple(row[1:]) != _stat_key(stat_info):
+            # The file changed; forget all its checksums
+            if path not in self._pending:
+                self._pending[path] = None
+            return None
+        return row[0]
+
+    def set(self, path, checksums, stat_info=None):
+        """
+        Remember checksums, a dict of checksum type -> checksum, of the file
+        as it is now (or as it was when stat_info was taken).
+        """
+        try:
+            if stat_info is None:
+                stat_info = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return
+        key = _stat_key(stat_info)
+        self.lock.acquire()
+        try:
+            entry = self._pending.get(path)
+            if entry is not None and entry[0] == key:
+                entry[1].update(checksums)
+            else:
+                self._pending[path] = (key, dict(checksums))
+            if len(self._pending) >= FLUSH_INTERVAL:
+                self._flush()
+        finally:
+            self.lock.release()
+
+    def remove(self, path):
+        self.lock.acquire()
+        try:
+            self._pending[path] = None
+        finally:
+            self.lock.release()
+
+    def getFileChecksum(self, checksum_type, path):
+        """
+        Same as checksum.getFileChecksum, but reading the file only if its
+        checksum is not in the index.
+        """
+        stat_info = os.stat(path)
+        file_checksum = self.get(path, checksum_type, stat_info)
+        if file_checksum is not None:
+            self.hits += 1
+            return file_checksum
+        self.misses += 1
+        # Stat taken before reading, so a file changing meanwhile gets read
+        # again next time
+        file_checksum = getFileChecksum(checksum_type, filename=path)
+        self.set(path, {checksum_type: file_checksum}, stat_info)
+        return file_checksum
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self.lock.release()
+
+    def _flush(self):
+        # Called with the lock held
+        pending = self._pending
+        self._pending = {}
+        if self.dbh is None or not pending:
+            return
+        removed = []
+        # Checksums of other types stay as long as the file is the same
+        outdated = []
+        rows = []
+        for path, entry in pending.items():
+            if entry is None:
+                removed.append((path, ))
+                continue
+            (inode, size, mtime), checksums = entry
+            outdated.append((path, inode, size, mtime))
+            for checksum_type, checksum in checksums.items():
+                rows.append((path, checksum_type, checksum, inode, size, mtime))
+        try:
+            self.dbh.executemany("delete from checksums where path = ?", removed)
+            self.dbh.executemany("""
+                delete from checksums
+                 where path = ?
+                   and not (inode = ? and size = ? and mtime = ?)
+            """, outdated)
+            self.dbh.executemany("insert or replace into checksums values (?, ?, ?, ?, ?, ?)", rows)
+            self.dbh.commit()
+        except sqlite3.Error:
+            # Another process keeps the index locked; not worth failing for
+            e = sys.exc_info()[1]
+            log_error("Unable to update checksum index %s: %s" % (self.filename, e))
+            try:
+                self.dbh.rollback()
+            except sqlite3.Error:
+                pass
+
+    def close(self):
+        self.flush()
+        if self.dbh is not None:
+            self.dbh.close()
+            self.dbh = None
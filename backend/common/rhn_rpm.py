@@ -14,6 +14,7 @@
 #
 
 import os
+import re
 import sys
 import struct
 import tempfile
@@ -265,6 +266,17 @@ class RPM_Package(A_Package):
             self.payload_stream = output_stream
             self.payload_size = output_stream.tell() - output_start
 
+    def set_payload_checksum(self, checksum):
+        """
+        Take checksum (of checksum_type) of the whole package from the caller,
+        e.g. computed while downloading it, instead of reading the payload.
+        """
+        self.checksum = checksum
+        self.header_data.close()
+        self.input_stream.seek(0, 2)
+        self.payload_size = self.input_stream.tell()
+        self.payload_stream = self.input_stream
+
 
 def get_header_byte_range(package_file):
     """
@@ -422,6 +434,50 @@ def nvre_compare(t1, t2):
     return rpm.labelCompare(evr1, evr2)
 
 
+# rpmvercmp() compares version strings segment by segment; a segment is a
+# run of digits or of (ASCII) letters, anything else separates segments.
+# Versions of rpm supporting them compare '~' and '^' as segments of their own.
+_vercmp_segments = None
+
+
+def _get_vercmp_segments():
+    global _vercmp_segments
+    if _vercmp_segments is None:
+        specials = ''
+        for c in '~^':
+            if rpm.labelCompare(('0', '1' + c, '1'), ('0', '1', '1')) != 0:
+                specials = specials + c
+        pattern = "[0-9]+|[a-zA-Z]+"
+        if specials:
+            pattern = "[%s]|%s" % (re.escape(specials), pattern)
+        _vercmp_segments = re.compile(pattern)
+    return _vercmp_segments
+
+
+def _vercmp_key(version):
+    key = []
+    for segment in _get_vercmp_segments().findall(version):
+        if segment[0].isdigit():
+            # Leading zeros don't count
+            segment = int(segment)
+        key.append(segment)
+    return tuple(key)
+
+
+def nvre_key(t):
+    """ Returns a key for the package tuple t (name, version, release, epoch)
+        such that two packages have equal keys if and only if nvre_compare()
+        finds them identical. Unlike nvre_compare(), it can be used as a
+        dictionary key.
+    """
+    # The same conversions as in nvre_compare()
+    epoch = str(t[3])
+    if epoch == "":
+        # labelCompare() takes no epoch for epoch 0
+        epoch = "0"
+    return (t[0], _vercmp_key(epoch), _vercmp_key(str(t[1])), _vercmp_key(str(t[2])))
+
+
 def hdrLabelCompare(hdr1, hdr2):
     """ take two RPMs or headers and compare them for order """
 
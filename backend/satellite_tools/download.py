@@ -17,7 +17,7 @@ import os
 import sys
 import re
 import time
-from Queue import Queue, Empty
+from Queue import Queue, Empty, Full
 from threading import Thread, Lock
 try:
     #  python 2
@@ -28,7 +28,7 @@ except ImportError:
 from urllib import quote
 import pycurl
 from urlgrabber.grabber import URLGrabberOptions, PyCurlFileObject, URLGrabError
-from spacewalk.common.checksum import getFileChecksum
+from spacewalk.common.checksum import getFileChecksum, getHashlibInstance
 from spacewalk.common.rhnConfig import CFG, initCFG
 from spacewalk.satellite_tools.syncLib import log, log2
 
@@ -103,11 +103,31 @@ def get_proxies(proxy, user, password):
 
 
 class PyCurlFileObjectThread(PyCurlFileObject):
-    def __init__(self, url, filename, opts, curl_cache, parent):
+    def __init__(self, url, filename, opts, curl_cache, parent, checksum_type=None):
         self.curl_cache = curl_cache
         self.parent = parent
+        # Checksum of the data computed as it arrives, see hexdigest()
+        self.c_hash = None
+        if checksum_type and not opts.range:
+            self.c_hash = getHashlibInstance(normalize_checksum_type(checksum_type), False)
         PyCurlFileObject.__init__(self, url, filename, opts)
 
+    def _retrieve(self, buf):
+        ret = PyCurlFileObject._retrieve(self, buf)
+        if self.c_hash is not None:
+            if ret == len(buf):
+                self.c_hash.update(buf)
+            else:
+                # Not written as a whole, can't tell what the file holds
+                self.c_hash = None
+        return ret
+
+    def hexdigest(self):
+        """ Checksum of the downloaded file, or None if it is not known. """
+        if self.c_hash is None:
+            return None
+        return self.c_hash.hexdigest()
+
     def _do_open(self):
         self.curl_obj = self.curl_cache
         self.curl_obj.reset()
@@ -136,6 +156,13 @@ class PyCurlFileObjectThread(PyCurlFileObject):
         self.curl_obj.setopt(pycurl.FORBID_REUSE, 0) # pylint: disable=E1101
 
 
+def normalize_checksum_type(checksum_type):
+    # Repository metadata call sha1 'sha'
+    if checksum_type == 'sha':
+        return 'sha1'
+    return checksum_type
+
+
 class FailedDownloadError(Exception):
     pass
 
@@ -155,7 +182,10 @@ class DownloadThread(Thread):
             if local_path and os.path.isfile(local_path):
                 return getFileChecksum(checksum_type, filename=local_path) == checksum
             elif file_obj:
-                return getFileChecksum(checksum_type, file_obj=file_obj) == checksum
+                digest = file_obj.hexdigest()
+                if digest is None:
+                    digest = getFileChecksum(checksum_type, file_obj=file_obj)
+                return digest == checksum
         if local_path and os.path.isfile(local_path):
             return True
         elif file_obj:
@@ -189,11 +219,18 @@ class DownloadThread(Thread):
         else:
             self.mirror = 0
 
+    @staticmethod
+    def __set_verified(params):
+        # Let whoever processes the file know its checksum without reading it
+        if params['checksum_type'] and params['checksum']:
+            params['verified_checksums'] = {normalize_checksum_type(params['checksum_type']): params['checksum']}
+
     def __fetch_url(self, params):
         # Skip existing file if exists and matches checksum
         if not self.parent.force:
             if self.__is_file_done(local_path=params['target_file'], checksum_type=params['checksum_type'],
                                    checksum=params['checksum']):
+                self.__set_verified(params)
                 return True
 
         opts = URLGrabberOptions(ssl_ca_cert=params['ssl_ca_cert'], ssl_cert=params['ssl_client_cert'],
@@ -212,12 +249,14 @@ class DownloadThread(Thread):
                 url = "%s://%s%s/%s?%s" % (scheme,netloc,path,params['relative_path'],query.rstrip('/'))
             try:
                 try:
-                    fo = PyCurlFileObjectThread(url, params['target_file'], opts, self.curl, self.parent)
+                    fo = PyCurlFileObjectThread(url, params['target_file'], opts, self.curl, self.parent,
+                                                checksum_type=params['checksum_type'])
                     # Check target file
                     if not self.__is_file_done(file_obj=fo, checksum_type=params['checksum_type'],
                                                checksum=params['checksum']):
                         raise FailedDownloadError("Target file isn't valid. Checksum should be %s (%s)."
                                                   % (params['checksum'], params['checksum_type']))
+                    self.__set_verified(params)
                     break
                 except (FailedDownloadError, URLGrabError):
                     e = sys.exc_info()[1]
@@ -257,6 +296,7 @@ class DownloadThread(Thread):
             if self.parent.log_obj:
                 # log_obj must be thread-safe
                 self.parent.log_obj.log(success, os.path.basename(params['relative_path']))
+            self.parent.report_done(params, success)
             self.queue.task_done()
         self.curl.close()
 
@@ -276,6 +316,10 @@ class ThreadedDownloader:
         self.force = force
         self.lock = Lock()
         self.exception = None
+        self.cancelled = False
+        # Where finished downloads are reported to, see start()
+        self.done_queue = None
+        self.thread = None
         # WORKAROUND - BZ #1439758 - ensure first item in queue is performed alone to properly setup NSS
         self.first_in_queue_done = False
         self.first_in_queue_lock = Lock()
@@ -296,12 +340,15 @@ class ThreadedDownloader:
         return True
 
     def add(self, params):
+        """ Queue a download; return False if it was refused. """
         ssl_set = (params['ssl_ca_cert'], params['ssl_client_cert'], params['ssl_client_key'])
         if self._validate(ssl_set):
             if ssl_set not in self.queues:
                 self.queues[ssl_set] = Queue()
             queue = self.queues[ssl_set]
             queue.put(params)
+            return True
+        return False
 
     def run(self):
         size = 0
@@ -336,9 +383,55 @@ class ThreadedDownloader:
         if self.exception:
             raise self.exception  # pylint: disable=E0702
 
+    def start(self, done_queue):
+        """
+        Run the downloads in a background thread. The params of every
+        finished download are put into done_queue, along with whether it
+        succeeded, so the files can be processed while others still download.
+        Call join() once done.
+        """
+        self.done_queue = done_queue
+        self.thread = Thread(target=self._run_background)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run_background(self):
+        try:
+            self.run()
+        except (KeyboardInterrupt, Exception):  # pylint: disable=W0703
+            # Kept for join() to raise
+            self.fail_download(sys.exc_info()[1])
+
+    def is_running(self):
+        return self.thread is not None and self.thread.isAlive()
+
+    def join(self):
+        """ Wait for the background downloads; raise what made them fail. """
+        while self.is_running():
+            self.thread.join(1)
+        if self.exception and not self.cancelled:
+            raise self.exception  # pylint: disable=E0702
+
+    def cancel(self):
+        """ Stop the background downloads, e.g. when processing them failed. """
+        self.lock.acquire()
+        self.cancelled = True
+        self.lock.release()
+
+    def report_done(self, params, success):
+        if self.done_queue is None:
+            return
+        # The queue is bounded; don't wait on it forever if nobody reads it
+        while self.can_continue():
+            try:
+                self.done_queue.put((params, success), timeout=1)
+                return
+            except Full:
+                continue
+
     def can_continue(self):
         self.lock.acquire()
-        status = self.exception is None
+        status = self.exception is None and not self.cancelled
         self.lock.release()
         return status
 
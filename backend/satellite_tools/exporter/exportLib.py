@@ -474,9 +474,9 @@ class _ChannelDumper(BaseRowDumper):
                                'upper_limit': self.end_date})
         else:
             query = query_no_limits
-        h = rhnSQL.prepare(query)
+        h = rhnSQL.prepare(query, streaming=1)
         h.execute(**query_args)
-        return [x['id'] for x in h.fetchall_dict() or []]
+        return [x['id'] for x in h.iterate_dict()]
 
     _query_get_source_package_ids = rhnSQL.Statement("""
         select distinct ps.id, sr.name source_rpm,
@@ -15,7 +15,7 @@
 
 import re
 import rpm
-from spacewalk.common import rhn_pkg
+from spacewalk.common import rhn_pkg, rhn_rpm
 from spacewalk.common.rhnException import rhnFault
 from spacewalk.server import rhnPackageUpload
 
@@ -78,12 +78,20 @@ class ContentPackage:
             self.epoch = '0'
         return self.name + '-' + self.epoch + ':' + self.version + '-' + self.release + '.' + self.arch
 
-    def load_checksum_from_header(self):
+    def load_checksum_from_header(self, checksums=None):
+        """
+        checksums maps checksum types to checksums of the whole file which are
+        known already; the payload is not read if one of them is needed.
+        """
         if self.path is None:
             raise rhnFault(50, "Unable to load package", explain=0)
         self.a_pkg = rhn_pkg.package_from_filename(self.path)
         self.a_pkg.read_header()
-        self.a_pkg.payload_checksum()
+        if checksums and self.a_pkg.checksum_type in checksums and \
+                isinstance(self.a_pkg, rhn_rpm.RPM_Package):
+            self.a_pkg.set_payload_checksum(checksums[self.a_pkg.checksum_type])
+        else:
+            self.a_pkg.payload_checksum()
         self.a_pkg.input_stream.close()
 
     def upload_package(self, org_id, metadata_only=False):
@@ -23,14 +23,16 @@ import gzip
 import ConfigParser
 import gettext
 import errno
+from Queue import Queue, Empty
 
 from rhn.connections import idn_puny_to_unicode
 
 from spacewalk.server import rhnPackage, rhnSQL, rhnChannel
 from spacewalk.common.usix import raise_with_tb
-from spacewalk.common import fileutils, rhnLog, rhnCache, rhnMail
+from spacewalk.common import fileutils, rhnLog, rhnMail
 from spacewalk.common.rhnLib import isSUSE, utc
 from spacewalk.common.checksum import getFileChecksum
+from spacewalk.common.checksum_index import ChecksumIndex
 from spacewalk.common.rhnConfig import CFG, initCFG
 from spacewalk.common.rhnException import rhnFault
 from spacewalk.server.importlib import importLib, mpmSource, packageImport, errataCache
@@ -50,7 +52,6 @@ _ = translation.ugettext
 default_log_location = '/var/log/rhn/'
 relative_comps_dir = 'rhn/comps'
 relative_modules_dir = 'rhn/modules'
-checksum_cache_filename = 'reposync/checksum_cache'
 default_import_batch_size = 10
 
 errata_typemap = {
@@ -422,10 +423,8 @@ class RepoSync(object):
         self.all_packages = set()
         self.all_errata = set()
         self.check_ssl_dates = check_ssl_dates
-        # Init cache for computed checksums to not compute it on each reposync run again
-        self.checksum_cache = rhnCache.get(checksum_cache_filename)
-        if self.checksum_cache is None:
-            self.checksum_cache = {}
+        # Index of computed checksums to not compute it on each reposync run again
+        self.checksum_index = ChecksumIndex()
         self.import_batch_size = default_import_batch_size
 
     def set_import_batch_size(self, batch_size):
@@ -571,8 +570,10 @@ class RepoSync(object):
                         self.disassociate_erratum(erratum)
                         self.regen = True
 
-        # Update cache with package checksums
-        rhnCache.set(checksum_cache_filename, self.checksum_cache)
+        # Update index with package checksums
+        self.checksum_index.flush()
+        log(0, "  Package checksums computed: %d, known from index: %d" %
+            (self.checksum_index.misses, self.checksum_index.hits))
         if self.regen:
             taskomatic.add_to_repodata_queue_for_channel_package_subscription(
                 [self.channel_label], [], "server.app.yumreposync")
@@ -923,11 +924,13 @@ class RepoSync(object):
             log(0, "    Packages passed filter rules: %5d" % num_passed)
         channel_id = int(self.channel['id'])
 
-        for pack in packages:
-            db_pack = rhnPackage.get_info_for_package(
-                [pack.name, pack.version, pack.release, pack.epoch, pack.arch],
-                channel_id, self.org_id)
+        start_time = datetime.now()
+        db_packs = rhnPackage.get_info_for_packages(
+            [[pack.name, pack.version, pack.release, pack.epoch, pack.arch] for pack in packages],
+            channel_id, self.org_id)
+        log(0, "    Packages looked up in DB in:  %s" % str(datetime.now() - start_time))
 
+        for pack, db_pack in zip(packages, db_packs):
             to_download = True
             to_link = True
             # Package exists in DB
@@ -974,7 +977,11 @@ class RepoSync(object):
 
         downloader = ThreadedDownloader()
         to_download_count = 0
-        for what in to_process:
+        # to_process indexes of the queued downloads, by id of their params
+        queued = {}
+        # to_process indexes of the downloads the downloader refused
+        not_queued = []
+        for (index, what) in enumerate(to_process):
             pack, to_download, to_link = what
             if to_download:
                 target_file = os.path.join(plug.repo.pkgdir, os.path.basename(pack.unique_id.relativepath))
@@ -984,18 +991,22 @@ class RepoSync(object):
                 checksum = pack.checksum
                 plug.set_download_parameters(params, pack.unique_id.relativepath, target_file,
                                              checksum_type=checksum_type, checksum_value=checksum)
-                downloader.add(params)
+                if downloader.add(params):
+                    queued[id(params)] = (index, params)
+                else:
+                    not_queued.append(index)
                 to_download_count += 1
         if num_to_process != 0:
             log(0, "    New packages to download:     %5d" % to_download_count)
-            log2(0, 0, "  Downloading packages:")
+            log2(0, 0, "  Downloading and importing packages:")
         logger = TextLogger(None, to_download_count)
         downloader.set_log_obj(logger)
-        downloader.run()
 
+        # Packages are imported as soon as they are downloaded, while the
+        # downloads of the others continue in the background
         log2background(0, "Importing packages started.")
-        log(0, '')
-        log(0, '  Importing packages to DB:')
+        done_queue = Queue(2 * self.import_batch_size)
+        downloader.start(done_queue)
         progress_bar = ProgressBarLogger("               Importing packages:    ", to_download_count)
 
         # Prepare SQL statements
@@ -1008,113 +1019,136 @@ class RepoSync(object):
         upload_caller = "server.app.uploadPackage"
 
         import_count = 0
-        for (index, what) in enumerate(to_process):
-            pack, to_download, to_link = what
-            if not to_download:
-                continue
-            import_count += 1
-            stage_path = pack.path
-
-            # pylint: disable=W0703
-            try:
-                # check if package was downloaded
-                if not os.path.exists(stage_path):
-                    raise Exception
+        try:
+            for index, params in self._downloaded_packages(downloader, done_queue, queued, not_queued):
+                pack = to_process[index][0]
+                import_count += 1
+                stage_path = pack.path
 
-                pack.load_checksum_from_header()
+                # pylint: disable=W0703
+                try:
+                    # check if package was downloaded
+                    if params is None or not os.path.exists(stage_path):
+                        raise Exception
+
+                    # Checksums computed while downloading, if any
+                    verified_checksums = params and params.get('verified_checksums')
+                    pack.load_checksum_from_header(checksums=verified_checksums)
+
+                    if not self.metadata_only:
+                        rel_package_path = rhnPackageUpload.relative_path_from_header(pack.a_pkg.header, self.org_id,
+                                                                                      pack.a_pkg.checksum_type,
+                                                                                      pack.a_pkg.checksum)
+                    else:
+                        rel_package_path = None
 
-                if not self.metadata_only:
-                    rel_package_path = rhnPackageUpload.relative_path_from_header(pack.a_pkg.header, self.org_id,
-                                                                                  pack.a_pkg.checksum_type,
-                                                                                  pack.a_pkg.checksum)
-                else:
-                    rel_package_path = None
+                    if rel_package_path:
+                        # First write the package to the filesystem to final location
+                        # pylint: disable=W0703
+                        try:
+                            importLib.move_package(pack.a_pkg.payload_stream.name, basedir=CFG.MOUNT_POINT,
+                                                   relpath=rel_package_path,
+                                                   checksum_type=pack.a_pkg.checksum_type,
+                                                   checksum=pack.a_pkg.checksum, force=1)
+                        except OSError:
+                            e = sys.exc_info()[1]
+                            raise_with_tb(rhnFault(50, "Package upload failed: %s" % e), sys.exc_info()[2])
+                        except importLib.FileConflictError:
+                            raise_with_tb(rhnFault(50, "File already exists"), sys.exc_info()[2])
+                        except Exception:
+                            raise_with_tb(rhnFault(50, "File error"), sys.exc_info()[2])
+
+                        # Save uploaded package to cache with repository checksum type
+                        checksums = {pack.checksum_type: pack.checksum,
+                                     pack.a_pkg.checksum_type: pack.a_pkg.checksum}
+                        self.checksum_index.set(os.path.join(CFG.MOUNT_POINT, rel_package_path), checksums)
+
+                        # Remove any pending scheduled file deletion for this package
+                        h_delete_package_queue.execute(path=rel_package_path)
+
+                    pkg = mpmSource.create_package(pack.a_pkg.header, size=pack.a_pkg.payload_size,
+                                                   checksum_type=pack.a_pkg.checksum_type, checksum=pack.a_pkg.checksum,
+                                                   relpath=rel_package_path, org_id=self.org_id,
+                                                   header_start=pack.a_pkg.header_start,
+                                                   header_end=pack.a_pkg.header_end, channels=[])
+
+                    if pack.a_pkg.header.is_source:
+                        mpm_src_batch.append(pkg)
+                    else:
+                        mpm_bin_batch.append(pkg)
+                    # we do not want to keep a whole 'a_pkg' object for every package in memory,
+                    # because we need only checksum. see BZ 1397417
+                    pack.checksum = pack.a_pkg.checksum
+                    pack.checksum_type = pack.a_pkg.checksum_type
+                    pack.epoch = pack.a_pkg.header['epoch']
+                    pack.a_pkg = None
 
-                if rel_package_path:
-                    # Save uploaded package to cache with repository checksum type
-                    self.checksum_cache[rel_package_path] = {pack.checksum_type: pack.checksum}
+                    self.all_packages.add((pack.checksum_type, pack.checksum))
 
-                    # First write the package to the filesystem to final location
-                    # pylint: disable=W0703
-                    try:
-                        importLib.move_package(pack.a_pkg.payload_stream.name, basedir=CFG.MOUNT_POINT,
-                                               relpath=rel_package_path,
-                                               checksum_type=pack.a_pkg.checksum_type,
-                                               checksum=pack.a_pkg.checksum, force=1)
-                    except OSError:
-                        e = sys.exc_info()[1]
-                        raise_with_tb(rhnFault(50, "Package upload failed: %s" % e), sys.exc_info()[2])
-                    except importLib.FileConflictError:
-                        raise_with_tb(rhnFault(50, "File already exists"), sys.exc_info()[2])
-                    except Exception:
-                        raise_with_tb(rhnFault(50, "File error"), sys.exc_info()[2])
-
-                    # Remove any pending scheduled file deletion for this package
-                    h_delete_package_queue.execute(path=rel_package_path)
-
-                pkg = mpmSource.create_package(pack.a_pkg.header, size=pack.a_pkg.payload_size,
-                                               checksum_type=pack.a_pkg.checksum_type, checksum=pack.a_pkg.checksum,
-                                               relpath=rel_package_path, org_id=self.org_id,
-                                               header_start=pack.a_pkg.header_start,
-                                               header_end=pack.a_pkg.header_end, channels=[])
-
-                if pack.a_pkg.header.is_source:
-                    mpm_src_batch.append(pkg)
-                else:
-                    mpm_bin_batch.append(pkg)
-                # we do not want to keep a whole 'a_pkg' object for every package in memory,
-                # because we need only checksum. see BZ 1397417
-                pack.checksum = pack.a_pkg.checksum
-                pack.checksum_type = pack.a_pkg.checksum_type
-                pack.epoch = pack.a_pkg.header['epoch']
-                pack.a_pkg = None
-
-                self.all_packages.add((pack.checksum_type, pack.checksum))
-
-                # Downloaded pkg checksum matches with pkg already in channel, no need to disassociate from channel
-                if (pack.checksum_type, pack.checksum) in to_disassociate:
-                    to_disassociate[(pack.checksum_type, pack.checksum)] = False
-                    # Set to_link to False, no need to link again
-                    to_process[index] = (pack, True, False)
-
-                # importing packages by batch or if the current packages is the last
-                if mpm_bin_batch and (import_count == to_download_count
-                                      or len(mpm_bin_batch) % self.import_batch_size == 0):
-                    importer = packageImport.PackageImport(mpm_bin_batch, backend, caller=upload_caller)
-                    importer.setUploadForce(1)
-                    importer.run()
-                    rhnSQL.commit()
-                    del importer.batch
-                    affected_channels.extend(importer.affected_channels)
-                    del mpm_bin_batch
-                    mpm_bin_batch = importLib.Collection()
-
-                if mpm_src_batch and (import_count == to_download_count
-                                      or len(mpm_src_batch) % self.import_batch_size == 0):
-                    src_importer = packageImport.SourcePackageImport(mpm_src_batch, backend, caller=upload_caller)
-                    src_importer.setUploadForce(1)
-                    src_importer.run()
-                    rhnSQL.commit()
-                    del mpm_src_batch
-                    mpm_src_batch = importLib.Collection()
-
-                progress_bar.log(True, None)
-            except KeyboardInterrupt:
-                raise
-            except rhnSQL.SQLError:
-                raise
-            except Exception:
-                failed_packages += 1
-                e = str(sys.exc_info()[1])
-                if e:
-                    log2(0, 1, e, stream=sys.stderr)
-                if self.fail:
+                    # Downloaded pkg checksum matches with pkg already in channel, no need to disassociate from channel
+                    if (pack.checksum_type, pack.checksum) in to_disassociate:
+                        to_disassociate[(pack.checksum_type, pack.checksum)] = False
+                        # Set to_link to False, no need to link again
+                        to_process[index] = (pack, True, False)
+
+                    # importing packages by batch or if the current packages is the last
+                    if mpm_bin_batch and (import_count == to_download_count
+                                          or len(mpm_bin_batch) % self.import_batch_size == 0):
+                        importer = packageImport.PackageImport(mpm_bin_batch, backend, caller=upload_caller)
+                        importer.setUploadForce(1)
+                        importer.run()
+                        rhnSQL.commit()
+                        del importer.batch
+                        affected_channels.extend(importer.affected_channels)
+                        del mpm_bin_batch
+                        mpm_bin_batch = importLib.Collection()
+
+                    if mpm_src_batch and (import_count == to_download_count
+                                          or len(mpm_src_batch) % self.import_batch_size == 0):
+                        src_importer = packageImport.SourcePackageImport(mpm_src_batch, backend, caller=upload_caller)
+                        src_importer.setUploadForce(1)
+                        src_importer.run()
+                        rhnSQL.commit()
+                        del mpm_src_batch
+                        mpm_src_batch = importLib.Collection()
+
+                    progress_bar.log(True, None)
+                except KeyboardInterrupt:
+                    raise
+                except rhnSQL.SQLError:
                     raise
-                to_process[index] = (pack, False, False)
-                progress_bar.log(False, None)
-            finally:
-                if is_non_local_repo and stage_path and os.path.exists(stage_path):
-                    os.remove(stage_path)
+                except Exception:
+                    failed_packages += 1
+                    e = str(sys.exc_info()[1])
+                    if e:
+                        log2(0, 1, e, stream=sys.stderr)
+                    if self.fail:
+                        raise
+                    to_process[index] = (pack, False, False)
+                    progress_bar.log(False, None)
+                finally:
+                    if is_non_local_repo and stage_path and os.path.exists(stage_path):
+                        os.remove(stage_path)
+        except:
+            # Do not leave the downloads running
+            downloader.cancel()
+            raise
+
+        # Import what is left when the last packages failed to download
+        if mpm_bin_batch:
+            importer = packageImport.PackageImport(mpm_bin_batch, backend, caller=upload_caller)
+            importer.setUploadForce(1)
+            importer.run()
+            rhnSQL.commit()
+            affected_channels.extend(importer.affected_channels)
+        if mpm_src_batch:
+            src_importer = packageImport.SourcePackageImport(mpm_src_batch, backend, caller=upload_caller)
+            src_importer.setUploadForce(1)
+            src_importer.run()
+            rhnSQL.commit()
+
+        # Raises what stopped the downloads, if anything
+        downloader.join()
 
         if affected_channels:
             errataCache.schedule_errata_cache_update(affected_channels)
@@ -1139,6 +1173,35 @@ class RepoSync(object):
             self.regen = True
         return failed_packages
 
+    @staticmethod
+    def _downloaded_packages(downloader, done_queue, queued, not_queued):
+        """
+        Yield the to_process indexes of the packages along with their download
+        params, in the order their downloads finish. queued maps the id of the
+        download params to (index, params); not_queued are the indexes of the
+        downloads which were refused and are yielded first, without params,
+        so they get counted as failed. So are the downloads which never
+        finished because the downloader stopped early.
+        """
+        for index in not_queued:
+            yield index, None
+        while queued:
+            try:
+                params = done_queue.get(timeout=1)[0]
+            except Empty:
+                if downloader.is_running():
+                    continue
+                # Stopped; whatever it finished last is in the queue by now
+                try:
+                    params = done_queue.get_nowait()[0]
+                except Empty:
+                    break
+            index = queued.pop(id(params), (None, None))[0]
+            if index is not None:
+                yield index, params
+        for index in sorted([x[0] for x in queued.values()]):
+            yield index, None
+
     def show_packages(self, plug, source_id):
 
         if (not self.filters) and source_id:
@@ -1198,19 +1261,9 @@ class RepoSync(object):
 
     def match_package_checksum(self, relpath, abspath, checksum_type, checksum):
         if os.path.exists(abspath):
-            if relpath not in self.checksum_cache:
-                self.checksum_cache[relpath] = {}
-            cached_checksums = self.checksum_cache[relpath]
-            if checksum_type not in cached_checksums:
-                checksum_disk = getFileChecksum(checksum_type, filename=abspath)
-                cached_checksums[checksum_type] = checksum_disk
-            else:
-                checksum_disk = cached_checksums[checksum_type]
+            checksum_disk = self.checksum_index.getFileChecksum(checksum_type, abspath)
             if checksum_disk == checksum:
                 return 1
-        elif relpath in self.checksum_cache:
-            # Remove path from cache if not exists
-            del self.checksum_cache[relpath]
         return 0
 
     def associate_package(self, pack):
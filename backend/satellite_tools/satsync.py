@@ -25,6 +25,7 @@ import stat
 import time
 import exceptions
 import fnmatch
+import multiprocessing
 try:
     #  python 2
     import Queue
@@ -45,7 +46,7 @@ from spacewalk.common import rhnMail, rhnLib
 from spacewalk.common.rhnLog import initLOG
 from spacewalk.common.rhnConfig import CFG, initCFG, PRODUCT_NAME
 from spacewalk.common.rhnTB import exitWithTraceback, fetchTraceback
-from spacewalk.common.checksum import getFileChecksum
+from spacewalk.common.checksum_index import ChecksumIndex
 from spacewalk.server import rhnSQL
 from spacewalk.server.rhnSQL import SQLError, SQLSchemaError, SQLConnectError
 from spacewalk.server.rhnLib import get_package_path
@@ -69,11 +70,13 @@ from spacewalk.server.importlib.errataCache import schedule_errata_cache_update
 from spacewalk.server.importlib.importLib import InvalidChannelFamilyError
 from spacewalk.server.importlib.importLib import MissingParentChannelError
 from spacewalk.server.importlib.importLib import get_nevra, get_nevra_dict
+from spacewalk.server.importlib.importLib import set_lookup_lock
 
 import satCerts
 import req_channels
 import messages
 import sync_handlers
+import syncCache
 import constants
 
 translation = gettext.translation('spacewalk-backend-server', fallback=True)
@@ -267,6 +270,8 @@ class Runner:
         else:
             log(1, _('Repeated failures'))
 
+        self.syncer.checksum_index.flush()
+
         timeEnd = time.time()
         delta_str = self._get_elapsed_time(timeEnd - timeStart)
 
@@ -370,10 +375,10 @@ class Runner:
     #     self.syncer.import_packages(sources=1)
 
     def _step_errata(self):
-        self.syncer.import_errata()
+        errata_channels = self.syncer.import_errata()
         # Now that errata have been populated, schedule an errata cache
-        # refresh
-        schedule_errata_cache_update(self._affected_channels)
+        # refresh of the channels they or the packages went to, all at once
+        schedule_errata_cache_update((self._affected_channels or []) + errata_channels)
 
     def _step_kickstarts(self):
         self.syncer.import_kickstarts()
@@ -445,6 +450,9 @@ class Syncer:
 
         self.reporegen = set()
 
+        # Checksums of the files on the filesystem, shared with other tools
+        self.checksum_index = ChecksumIndex()
+
         # self._*_full hold list of all ids for appropriate channel while
         # non-full self._* contain every id only once (in first channel it appeared)
         self._channel_packages = {}
@@ -453,6 +461,8 @@ class Syncer:
 
         self._missing_channel_packages = None
         self._missing_fs_packages = None
+        # Seconds spent diffing the packages of a channel, by step
+        self._diff_timing = {}
 
         self._failed_fs_packages = Queue.Queue()
         self._extinct_packages = Queue.Queue()
@@ -882,23 +892,99 @@ class Syncer:
            and p.checksum_id = c.id
     """
 
+    # Packages to diff, for _query_compare_packages_bulk
+    _query_create_package_diff_table = """
+        create temporary table if not exists tmp_satsync_package_diff (
+            package_id  varchar(128),
+            name        varchar(256),
+            epoch       varchar(16),
+            version     varchar(512),
+            release     varchar(512),
+            arch        varchar(64),
+            org_id      numeric
+        )
+    """
+
+    # Same as _query_compare_packages, for all the packages in
+    # tmp_satsync_package_diff at once; NEVRAs which are not in the database
+    # yet simply don't match, instead of being inserted by the lookup_*
+    # functions
+    _query_compare_packages_bulk = """
+        select d.package_id, p.id, c.checksum_type, c.checksum, p.path, p.package_size,
+               TO_CHAR(p.last_modified, 'YYYYMMDDHH24MISS') last_modified
+          from tmp_satsync_package_diff d
+          join rhnPackageName pn
+            on pn.name = d.name
+          join rhnPackageEVR pe
+            on pe.version = d.version
+           and pe.release = d.release
+           and ((pe.epoch is null and d.epoch is null) or pe.epoch = d.epoch)
+          join rhnPackageArch pa
+            on pa.label = d.arch
+          join rhnPackage p
+            on p.name_id = pn.id
+           and p.evr_id = pe.id
+           and p.package_arch_id = pa.id
+           and (p.org_id = d.org_id or
+               (p.org_id is null and d.org_id is null))
+          join rhnChecksumView c
+            on p.checksum_id = c.id
+    """
+
+    def _compare_packages(self, packages):
+        """Returns the rows of rhnPackage (with their checksums) matching the
+        NEVRA and org of each package, as a hash keyed on package id"""
+        result = {}
+        if CFG.DB_BACKEND != 'postgresql':
+            h = rhnSQL.prepare(self._query_compare_packages)
+            for pid, package in packages:
+                nevra = get_nevra_dict(package)
+                nevra['org_id'] = package['org_id']
+                h.execute(**nevra)
+                result[pid] = h.fetchall_dict() or []
+            return result
+
+        rhnSQL.prepare(self._query_create_package_diff_table).execute()
+        rhnSQL.prepare("delete from tmp_satsync_package_diff").execute()
+        params = {'package_id': [], 'org_id': []}
+        for pid, package in packages:
+            params['package_id'].append(pid)
+            params['org_id'].append(package['org_id'])
+            for k, v in get_nevra_dict(package).items():
+                params.setdefault(k, []).append(v)
+        h = rhnSQL.prepare("""
+            insert into tmp_satsync_package_diff
+                   (package_id, name, epoch, version, release, arch, org_id)
+            values (:package_id, :name, :epoch, :version, :release, :arch, :org_id)
+        """)
+        h.execute_bulk(params)
+        # Have the planner know how many packages there are
+        rhnSQL.prepare("analyze tmp_satsync_package_diff").execute()
+
+        h = rhnSQL.prepare(self._query_compare_packages_bulk)
+        h.execute()
+        for row in (h.fetchall_dict() or []):
+            result.setdefault(row['package_id'], []).append(row)
+        return result
+
     def _diff_packages_process(self, chunk, channel_label):
         package_collection = sync_handlers.ShortPackageCollection()
 
-        h = rhnSQL.prepare(self._query_compare_packages)
-        for pid in chunk:
-            package = package_collection.get_package(pid)
+        start = time.time()
+        packages = list(zip(chunk, package_collection.get_packages(chunk)))
+        for pid, package in packages:
             assert package is not None
-            l_timestamp = rhnLib.timestamp(package['last_modified'])
-
             if package['org_id'] is not None:
                 package['org_id'] = OPTIONS.orgid or DEFAULT_ORG
-            nevra = get_nevra_dict(package)
-            nevra['org_id'] = package['org_id']
+        cache_done = time.time()
+
+        db_rows = self._compare_packages(packages)
+        db_done = time.time()
 
-            h.execute(**nevra)
+        for pid, package in packages:
+            l_timestamp = rhnLib.timestamp(package['last_modified'])
             row = None
-            for r in (h.fetchall_dict() or []):
+            for r in db_rows.get(pid, []):
                 # let's check which checksum we have in database
                 if (r['checksum_type'] in package['checksums']
                         and package['checksums'][r['checksum_type']] == r['checksum']):
@@ -910,24 +996,45 @@ class Syncer:
                                   self._missing_fs_packages[channel_label],
                                   check_rpms=self.check_rpms)
 
+        timing = self._diff_timing
+        timing['cache'] = timing.get('cache', 0) + cache_done - start
+        timing['database'] = timing.get('database', 0) + db_done - cache_done
+        timing['filesystem'] = timing.get('filesystem', 0) + time.time() - db_done
+
     # XXX the "is null" condition will have to change in multiorg satellites
     def _diff_packages(self):
         self._missing_channel_packages = {}
         self._missing_fs_packages = {}
 
-        sorted_channels = sorted(list(self._channel_packages.items()), key=lambda x: x[0])  # sort by channel_label
-        for channel_label, upids in sorted_channels:
-            log(1, _("Diffing package metadata (what's missing locally?): %s") %
-                channel_label)
-            self._missing_channel_packages[channel_label] = []
-            self._missing_fs_packages[channel_label] = []
-            self._process_batch(channel_label, upids[:], None,
-                                self._diff_packages_process,
-                                _('Diffing:    '),
-                                [channel_label])
+        # Every package is only in the first channel it is found in, so the
+        # channels can be diffed at the same time
+        results = self._process_channels(sorted(self._channel_packages.keys()),
+                                         self._diff_channel_packages)
+        for channel_label, (missing_channel, missing_fs) in results.items():
+            self._missing_channel_packages[channel_label] = missing_channel
+            self._missing_fs_packages[channel_label] = missing_fs
 
         self._verify_missing_channel_packages(self._missing_channel_packages)
 
+    def _diff_channel_packages(self, channel_label):
+        upids = self._channel_packages[channel_label]
+        log(1, _("Diffing package metadata (what's missing locally?): %s") %
+            channel_label)
+        self._missing_channel_packages[channel_label] = []
+        self._missing_fs_packages[channel_label] = []
+        self._diff_timing = {}
+        self._process_batch(channel_label, upids[:], None,
+                            self._diff_packages_process,
+                            _('Diffing:    '),
+                            [channel_label])
+        log2disk(1, _("Diffed %s packages of %s: %.1fs reading the package cache, "
+                      "%.1fs querying the database, %.1fs checking the filesystem")
+                 % (len(upids), channel_label, self._diff_timing.get('cache', 0),
+                    self._diff_timing.get('database', 0),
+                    self._diff_timing.get('filesystem', 0)))
+        return (self._missing_channel_packages[channel_label],
+                self._missing_fs_packages[channel_label])
+
     def _verify_missing_channel_packages(self, missing_channel_packages, sources=0):
         """Verify if all the missing packages are actually available somehow.
         In an incremental approach, one may request packages that are actually
@@ -947,11 +1054,11 @@ class Syncer:
         return get_package_path(nevra, org_id, prepend=CFG.PREPENDED_DIR,
                                 source=source, checksum_type=checksum_type, checksum=checksum)
 
-    @staticmethod
-    def _verify_file(path, mtime, size, checksum_type, checksum):
+    def _verify_file(self, path, mtime, size, checksum_type, checksum):
         """
         Verifies if the file is on the filesystem and matches the mtime and checksum.
-        Computing the checksum is costly, that's why we rely on mtime comparisons.
+        Computing the checksum is costly, that's why we rely on mtime comparisons
+        and on the checksum index.
         Returns errcode:
             0   - file is ok, it has either the specified mtime and size
                           or checksum matches (then function sets mtime)
@@ -974,12 +1081,13 @@ class Syncer:
             return 0
 
         # Have to check checksum
-        l_checksum = getFileChecksum(checksum_type, filename=abs_path)
+        l_checksum = self.checksum_index.getFileChecksum(checksum_type, abs_path)
         if l_checksum != checksum:
             return 2
 
         # Set the mtime
         os.utime(abs_path, (mtime, mtime))
+        self.checksum_index.set(abs_path, {checksum_type: l_checksum})
         return 0
 
     def _process_package(self, package_id, package, l_timestamp, row,
@@ -1061,13 +1169,16 @@ class Syncer:
                 # Nothing to see here
                 continue
 
-            for pid in pids:
-                # XXX Catch errors
-                if (not package_collection.has_package(pid)
-                        or package_collection.get_package(pid)['last_modified']
-                        != short_package_collection.get_package(pid)['last_modified']):
-                    # not in the cache
-                    mp.append(pid)
+            for i in range(0, len(pids), self._batch_size):
+                chunk = pids[i:i + self._batch_size]
+                packages = package_collection.get_packages(chunk)
+                short_packages = short_package_collection.get_packages(chunk)
+                for pid, package, short_package in zip(chunk, packages, short_packages):
+                    # XXX Catch errors
+                    if (package is None
+                            or package['last_modified'] != short_package['last_modified']):
+                        # not in the cache
+                        mp.append(pid)
 
         return missing_packages
 
@@ -1546,6 +1657,90 @@ class Syncer:
             pb.printIncrement()
         pb.printComplete()
 
+    def _process_channels(self, channels, function):
+        """Calls function(channel) for every channel, and returns what it
+        returned in a hash keyed on channel.
+
+        With --jobs, that many worker processes take the channels one after
+        another, each with database connections of its own. What function
+        did is committed when it returns; it must not depend on the other
+        channels being processed, and what it returns must be picklable."""
+        jobs = min(OPTIONS.jobs or 1, len(channels))
+        if jobs <= 1:
+            results = {}
+            for channel in channels:
+                results[channel] = function(channel)
+            return results
+
+        # The workers only see what is committed and written out
+        rhnSQL.commit()
+        self.checksum_index.flush()
+        syncCache.flush()
+
+        todo = multiprocessing.Queue()
+        done = multiprocessing.Queue()
+        for channel in channels:
+            todo.put(channel)
+        lookup_lock = multiprocessing.Lock()
+        workers = []
+        for _i in range(jobs):
+            todo.put(None)
+            worker = multiprocessing.Process(target=self._channel_worker,
+                                             args=(todo, done, function, lookup_lock))
+            worker.start()
+            workers.append(worker)
+
+        results = {}
+        errors = []
+        all_exited = False
+        while len(results) + len(errors) < len(channels):
+            try:
+                channel, result, error = done.get(True, 1)
+            except Queue.Empty:
+                if all_exited:
+                    errors.append(_("worker processes exited without processing all the channels"))
+                    break
+                # Whatever the workers sent before exiting is read once more
+                all_exited = not [w for w in workers if w.is_alive()]
+                continue
+            if error is None:
+                results[channel] = result
+            else:
+                errors.append("%s: %s" % (channel, error))
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise RhnSyncException(_("ERROR: processing the channels failed:\n%s")
+                                   % "\n".join(errors))
+        return results
+
+    def _channel_worker(self, todo, done, function, lookup_lock):
+        """Worker process of _process_channels"""
+        # The connections inherited from the parent are left alone
+        rhnSQL.forgetDB()
+        rhnSQL.initDB()
+        rhnSQL.clear_log_id()
+        rhnSQL.set_log_auth_login('SETUP')
+        set_lookup_lock(lookup_lock)
+        inherited_index = self.checksum_index
+        self.checksum_index = ChecksumIndex(inherited_index.filename)
+        try:
+            while 1:
+                channel = todo.get()
+                if channel is None:
+                    break
+                try:
+                    result = function(channel)
+                    rhnSQL.commit()
+                except Exception:  # pylint: disable=W0703
+                    rhnSQL.rollback()
+                    done.put((channel, None, fetchTraceback()))
+                    continue
+                done.put((channel, result, None))
+        finally:
+            self.checksum_index.close()
+            syncCache.flush()
+
     def _process_batch(self, channel, batch, log_msg,
                        process_function,
                        prompt=_('Downloading:'),
@@ -1581,13 +1776,14 @@ class Syncer:
             log(1, ["", _("Importing package metadata")])
             missing_channel_items = self._missing_channel_packages
 
-        sorted_channels = sorted(list(missing_channel_items.items()), key=lambda x: x[0])  # sort by channel
-        for channel, packages in sorted_channels:
-            self._process_batch(channel, packages[:],
+        def import_channel(channel):
+            self._process_batch(channel, missing_channel_items[channel][:],
                                 messages.package_importing,
                                 self._import_packages_process,
                                 _('Importing:  '),
                                 [sources])
+        # No package is in more than one channel
+        self._process_channels(sorted(missing_channel_items.keys()), import_channel)
         return self._link_channel_packages()
 
     def _link_channel_packages(self):
@@ -1596,8 +1792,8 @@ class Syncer:
         _package_collection = sync_handlers.PackageCollection()
         uq_packages = {}
         for chn, package_ids in self._channel_packages_full.items():
-            for pid in package_ids:
-                package = short_package_collection.get_package(pid)
+            for pid, package in zip(package_ids,
+                                    short_package_collection.get_packages(package_ids)):
                 if not package:
                     continue
                 assert package is not None
@@ -1647,24 +1843,32 @@ class Syncer:
             package_collection = sync_handlers.SourcePackageCollection()
         else:
             package_collection = sync_handlers.PackageCollection()
-        batch = []
-        for pid in chunk:
-            package = package_collection.get_package(pid)
+        batch = package_collection.get_packages(chunk)
+        short_packages = short_package_collection.get_packages(chunk)
+        for package, short_package in zip(batch, short_packages):
             if (package is None or package['last_modified']
-                    != short_package_collection.get_package(pid)
-                    ['last_modified']):
+                    != short_package['last_modified']):
                 # not in the cache
                 raise Exception(_("Package Not Found in Cache, Clear the Cache to \
                                  Regenerate it."))
-            batch.append(package)
         return batch
 
     def import_errata(self):
+        """Imports the errata of the channels, and returns the labels of the
+        channels they were added to or changed in"""
         log(1, ["", _("Importing channel errata")])
         errata_collection = sync_handlers.ErrataCollection()
-        # sort by channel_label
-        sorted_channels = sorted(list(self._missing_channel_errata.items()), key=lambda x: x[0])
-        for chn, errata in sorted_channels:
+        # An erratum is imported to all its channels at once: only do it
+        # with the first channel it is found in, so that the channels can be
+        # processed at the same time
+        channel_errata = {}
+        already_seen_ids = set()
+        for chn, errata in sorted(self._missing_channel_errata.items()):
+            channel_errata[chn] = [e for e in errata if e[0] not in already_seen_ids]
+            already_seen_ids.update([e[0] for e in errata])
+
+        def import_channel(chn):
+            errata = channel_errata[chn]
             log(2, _("Importing %s errata for channel %s.") % (len(errata), chn))
             batch = []
             for eid, timestamp, _advisory_name in errata:
@@ -1675,8 +1879,19 @@ class Syncer:
                     self._fix_erratum(erratum)
                     batch.append(erratum)
 
-            self._process_batch(chn, batch, messages.errata_importing,
-                                sync_handlers.import_errata)
+            affected_channels = set()
+
+            def import_chunk(chunk):
+                importer = sync_handlers.import_errata(chunk)
+                affected_channels.update(importer.affected_channels)
+            self._process_batch(chn, batch, messages.errata_importing, import_chunk)
+            return sorted(affected_channels)
+
+        results = self._process_channels(sorted(channel_errata.keys()), import_channel)
+        affected_channels = set()
+        for channels in results.values():
+            affected_channels.update(channels)
+        return sorted(affected_channels)
 
     @staticmethod
     def _fix_erratum(erratum):
@@ -2145,6 +2360,8 @@ def processCommandline():
                help=_('alternative http proxy password')),
         Option('--iss-parent',          action='store',
                help=_('parent satellite to import content from')),
+        Option('-j', '--jobs',          action='store', type='int', default=1,
+               help=_('process that many channels at the same time, in as many processes')),
         Option('-l', '--list-channels', action='store_true',
                help=_('list all available channels and exit')),
         Option('--list-error-codes',    action='store_true',
@@ -2380,6 +2597,9 @@ def processCommandline():
             usix.raise_with_tb(ValueError(_("ERROR: --batch-size must have a value within the range: 1..50")),
                                sys.exc_info()[2])
 
+    if OPTIONS.jobs < 1:
+        raise ValueError(_("ERROR: --jobs must be at least 1"))
+
     OPTIONS.mount_point = fileutils.cleanupAbsPath(OPTIONS.mount_point)
     OPTIONS.systemid = fileutils.cleanupAbsPath(OPTIONS.systemid)
 
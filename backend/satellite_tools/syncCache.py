@@ -18,40 +18,313 @@
 
 # system imports:
 import os
+import sys
+import time
+import zlib
+import atexit
+import sqlite3
+import threading
+try:
+    #  python 2
+    import cPickle
+except ImportError:
+    #  python3
+    import pickle as cPickle
 
 # rhn imports:
 from spacewalk.common import rhnCache
 from spacewalk.common.rhnConfig import CFG, initCFG
-from spacewalk.common.rhnLib import hash_object_id
+from spacewalk.common.rhnLib import hash_object_id, timestamp
+from spacewalk.common.rhnLog import log_error
 
 # NOTE: this is a python 2.2-ism
 __all__ = []
 
+# Name of the SQLite store, relative to CFG.SYNC_CACHE_DIR
+STORE_FILE = "satsync/cache.db"
+# Seconds to wait for another process writing to the store
+LOCK_TIMEOUT = 60
+# Changes are written out every so many objects
+FLUSH_INTERVAL = 1000
+# Most keys looked up in one query (SQLite allows 999 parameters)
+QUERY_CHUNK = 500
+
+
+def _timestamp(modified):
+    if not modified:
+        return None
+    return int(timestamp(modified))
+
+
+class FileStore:
+
+    """ One file per object (a pickle, possibly gzipped), kept by rhnCache. """
+
+    def __init__(self, cachedir):
+        # Kind of kludgy - this may have weird side-effects if called from
+        # within the server code
+        rhnCache.CACHEDIR = cachedir
+
+    @staticmethod
+    def get(key, modified=None, compressed=0):
+        return rhnCache.get(key, modified=modified, raw=0, compressed=compressed)
+
+    def get_many(self, keys, modified=None, compressed=0):
+        return dict([(key, self.get(key, modified, compressed)) for key in keys])
+
+    @staticmethod
+    def set(key, value, modified=None, compressed=0):
+        return rhnCache.set(key, value, modified=modified, raw=0, compressed=compressed)
+
+    def set_many(self, items, compressed=0):
+        for key, value, modified in items:
+            self.set(key, value, modified, compressed)
+
+    @staticmethod
+    def has_key(key, modified=None):
+        return rhnCache.has_key(key, modified=modified)
+
+    def flush(self):
+        pass
+
+
+class SQLiteStore:
+
+    """
+    All the objects in a single SQLite database, keyed on the same names
+    FileStore uses. Every object has a timestamp, the way the files have their
+    mtime: an object looked up with a timestamp is only found if it was stored
+    with the same one.
+
+    Objects set are kept in memory and written out in one transaction every
+    FLUSH_INTERVAL objects, on flush() and when the process exits.
+    """
+
+    _schema = """
+        create table if not exists cache (
+            key       text primary key,
+            modified  integer not null,
+            value     blob not null
+        )
+    """
+
+    def __init__(self, filename, timeout=LOCK_TIMEOUT):
+        self.filename = filename
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # key -> (modified, pickled value)
+        self._pending = {}
+        # Connections of the parent process, after a fork
+        self._inherited = []
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname, int('0755', 8))
+        self.dbh = self._connect()
+        self.dbh.execute(self._schema)
+        self.dbh.commit()
+        atexit.register(self.close)
+
+    def _connect(self):
+        self._pid = os.getpid()
+        dbh = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+        dbh.text_factory = str
+        dbh.execute("pragma journal_mode = wal")
+        dbh.execute("pragma synchronous = normal")
+        return dbh
+
+    def _check_fork(self):
+        # Called with the lock held. An SQLite connection can't be used by
+        # both processes after a fork, nor closed by the child: it gets a new
+        # one, and keeps the inherited one referenced
+        if self._pid == os.getpid() or self.dbh is None:
+            return
+        self._inherited.append(self.dbh)
+        self.dbh = self._connect()
+
+    @staticmethod
+    def _dumps(value, compressed):
+        pickled = cPickle.dumps(value, -1)
+        if compressed:
+            pickled = zlib.compress(pickled, 5)
+        return pickled
+
+    @staticmethod
+    def _loads(pickled, compressed):
+        try:
+            if compressed:
+                pickled = zlib.decompress(pickled)
+            return cPickle.loads(pickled)
+        except (zlib.error, cPickle.UnpicklingError):
+            return None
+
+    def _lookup(self, keys):
+        # Called with the lock held; returns key -> (modified, pickled value)
+        self._check_fork()
+        result = {}
+        missing = []
+        for key in keys:
+            if key in self._pending:
+                result[key] = self._pending[key]
+            else:
+                missing.append(key)
+        for i in range(0, len(missing), QUERY_CHUNK):
+            chunk = missing[i:i + QUERY_CHUNK]
+            rows = self.dbh.execute(
+                "select key, modified, value from cache where key in (%s)" %
+                ", ".join(["?"] * len(chunk)), chunk)
+            for key, modified, value in rows:
+                result[key] = (modified, value)
+        return result
+
+    def get(self, key, modified=None, compressed=0):
+        return self.get_many([key], modified, compressed)[key]
+
+    def get_many(self, keys, modified=None, compressed=0):
+        """ Returns a hash of the values of the keys, None for the missing ones """
+        modified = _timestamp(modified)
+        self.lock.acquire()
+        try:
+            entries = self._lookup(keys)
+        finally:
+            self.lock.release()
+        result = {}
+        for key in keys:
+            result[key] = None
+            if key not in entries:
+                continue
+            entry_modified, pickled = entries[key]
+            if modified is not None and entry_modified != modified:
+                continue
+            result[key] = self._loads(bytes(pickled), compressed)
+        return result
+
+    def set(self, key, value, modified=None, compressed=0):
+        self.set_many([(key, value, modified)], compressed)
+
+    def set_many(self, items, compressed=0):
+        """ Stores a list of (key, value, timestamp) """
+        now = int(time.time())
+        entries = []
+        for key, value, modified in items:
+            entries.append((key, (_timestamp(modified) or now, self._dumps(value, compressed))))
+        self.lock.acquire()
+        try:
+            self._pending.update(entries)
+            if len(self._pending) >= FLUSH_INTERVAL:
+                self._flush()
+        finally:
+            self.lock.release()
+
+    def has_key(self, key, modified=None):
+        modified = _timestamp(modified)
+        self.lock.acquire()
+        try:
+            entry = self._lookup([key]).get(key)
+        finally:
+            self.lock.release()
+        return entry is not None and (modified is None or entry[0] == modified)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self.lock.release()
+
+    def _flush(self):
+        # Called with the lock held
+        if self.dbh is None or not self._pending:
+            return
+        self._check_fork()
+        rows = [(key, modified, sqlite3.Binary(value))
+                for key, (modified, value) in self._pending.items()]
+        self.dbh.executemany("insert or replace into cache values (?, ?, ?)", rows)
+        self.dbh.commit()
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        if self.dbh is not None:
+            self.dbh.close()
+            self.dbh = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """ Returns the store of the cache backend configured with
+        sync_cache_backend: "sqlite", as set in the shipped
+        rhn_server_satellite.conf, or "file", used if the option is unset """
+    backend = "file"
+    if CFG.has_key('sync_cache_backend') and CFG.SYNC_CACHE_BACKEND:
+        backend = CFG.SYNC_CACHE_BACKEND
+    cachedir = CFG.SYNC_CACHE_DIR
+    _stores_lock.acquire()
+    try:
+        if (backend, cachedir) not in _stores:
+            store = None
+            if backend == "sqlite":
+                filename = os.path.join(cachedir, STORE_FILE)
+                try:
+                    store = SQLiteStore(filename)
+                except (sqlite3.Error, OSError, IOError):
+                    e = sys.exc_info()[1]
+                    log_error("Unable to open sync cache %s, using files instead: %s" % (filename, e))
+            elif backend != "file":
+                log_error("Unknown sync_cache_backend %s, using files" % backend)
+            if store is None:
+                store = FileStore(cachedir)
+            _stores[(backend, cachedir)] = store
+        return _stores[(backend, cachedir)]
+    finally:
+        _stores_lock.release()
+
+
+def flush():
+    """ Writes out what the stores keep in memory, as done at exit; worker
+        processes, which leave without running the exit handlers, have to """
+    _stores_lock.acquire()
+    try:
+        stores = list(_stores.values())
+    finally:
+        _stores_lock.release()
+    for store in stores:
+        store.flush()
+
 
 class BaseCache:
     _compressed = 1
 
     def __init__(self):
-        # Kind of kludgy - this may have weird side-effects if called from
-        # within the server code
-        rhnCache.CACHEDIR = CFG.SYNC_CACHE_DIR
+        self._store = get_store()
 
     def cache_get(self, object_id, timestamp=None):
         # Get the key
         key = self._get_key(object_id)
-        return rhnCache.get(key, modified=timestamp, raw=0,
-                            compressed=self._compressed)
+        return self._store.get(key, modified=timestamp, compressed=self._compressed)
+
+    def cache_get_many(self, object_ids, timestamp=None):
+        """ Returns a hash of the objects, None for the ones not in the cache """
+        keys = [(object_id, self._get_key(object_id)) for object_id in object_ids]
+        values = self._store.get_many([key for _object_id, key in keys],
+                                      modified=timestamp, compressed=self._compressed)
+        return dict([(object_id, values[key]) for object_id, key in keys])
 
     def cache_set(self, object_id, value, timestamp=None):
         # Get the key
         key = self._get_key(object_id)
-        return rhnCache.set(key, value, modified=timestamp, raw=0,
-                            compressed=self._compressed)
+        return self._store.set(key, value, modified=timestamp,
+                               compressed=self._compressed)
 
     def cache_has_key(self, object_id, timestamp=None):
         # Get the key
         key = self._get_key(object_id)
-        return rhnCache.has_key(key, modified=timestamp)
+        return self._store.has_key(key, modified=timestamp)
+
+    def flush(self):
+        self._store.flush()
 
     def _get_key(self, object_id):
         raise NotImplementedError()
@@ -285,6 +285,12 @@ class ShortPackageCollection:
         """Return the package with the specified id from the collection"""
         return self._cache.cache_get(package_id)
 
+    def get_packages(self, package_ids):
+        """Return the packages with the specified ids from the collection, in
+        the same order; None for the ones not in the collection"""
+        packages = self._cache.cache_get_many(package_ids)
+        return [packages[package_id] for package_id in package_ids]
+
     def has_package(self, package_id):
         """Returns true if the package exists in the collection"""
         return self._cache.cache_has_key(package_id)
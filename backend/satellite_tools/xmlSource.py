@@ -17,6 +17,7 @@
 
 import sys
 import re
+from xml.parsers import expat
 from xml.sax import make_parser, SAXParseException, ContentHandler, \
     ErrorHandler
 
@@ -39,6 +40,16 @@ RHEL234_REGEX = re.compile("rhel-[^-]*-[aew]s-(4|3|2.1)")
 # The way the parser works: get a handler with getHandler() and call process()
 # with an XML stream.
 
+# Parsers a handler can use:
+# sax: xml.sax; the items are created out of a tree of Nodes once the
+#   element of the item ends
+# expat: pyexpat, with no SAX layer in between and no decoding of the data
+#   into unicode; the items nested in an item are created as soon as their
+#   elements end, rather than out of the tree of Nodes of the whole item
+PARSERS = ('sax', 'expat')
+# Size of the character data expat collects before passing it on
+EXPAT_BUFFER_SIZE = 65536
+
 # Our parser exceptions
 
 
@@ -103,6 +114,18 @@ class Node:
         return "[<Node element: name=%s>]" % self.name
 
 
+def get_parser():
+    """ Returns the XML parser to use, configured with sync_xml_parser:
+        "sax" (the default) or "expat" """
+    parser = 'sax'
+    if CFG.is_initialized() and CFG.has_key('sync_xml_parser') and CFG.SYNC_XML_PARSER:
+        parser = CFG.SYNC_XML_PARSER
+    if parser not in PARSERS:
+        log_debug(-1, "Unknown sync_xml_parser %s, using sax" % parser)
+        parser = 'sax'
+    return parser
+
+
 # Base class we use as a SAX parsing handler
 class BaseDispatchHandler(ContentHandler, ErrorHandler):
 
@@ -116,12 +139,19 @@ class BaseDispatchHandler(ContentHandler, ErrorHandler):
     __stream = None
     container_dispatch = {}
 
-    def __init__(self):
+    def __init__(self, parser=None):
         ContentHandler.__init__(self)
         self.rootAttributes = None
-        self.__parser = make_parser()
-        # Init the parser's handlers
-        self.restoreParser()
+        if parser is None:
+            parser = get_parser()
+        if parser not in PARSERS:
+            raise ParseException("Unknown XML parser %s" % parser)
+        self.parser = parser
+        self.__parser = None
+        if parser == 'sax':
+            self.__parser = make_parser()
+            # Init the parser's handlers
+            self.restoreParser()
         # No container at this time
         self.__container = None
         # Reset all the containers, to make sure previous runs don't leave
@@ -131,6 +161,8 @@ class BaseDispatchHandler(ContentHandler, ErrorHandler):
 
     def restoreParser(self):
         # Restore the parser's handlers to self
+        if self.__parser is None:
+            return
         self.__parser.setContentHandler(self)
         self.__parser.setErrorHandler(self)
 
@@ -144,7 +176,10 @@ class BaseDispatchHandler(ContentHandler, ErrorHandler):
         if stream is not None:
             self.setStream(stream)
         try:
-            self.__parser.parse(self.__stream)
+            if self.parser == 'expat':
+                self._expat_parse(self.__stream)
+            else:
+                self.__parser.parse(self.__stream)
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception:  # pylint: disable=E0012, W0703
@@ -153,10 +188,28 @@ class BaseDispatchHandler(ContentHandler, ErrorHandler):
                 stream.close()
             sys.exit(1)
 
+    def _expat_parse(self, stream):
+        parser = expat.ParserCreate()
+        if usix.PY2:
+            # Hand over UTF-8 encoded strings, as the items expect them
+            parser.returns_unicode = 0
+        parser.buffer_text = 1
+        parser.buffer_size = EXPAT_BUFFER_SIZE
+        parser.StartElementHandler = self._startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self._characters
+        try:
+            parser.ParseFile(stream)
+        except expat.ExpatError:
+            e = sys.exc_info()[1]
+            log_debug(-1, "ERROR (FATAL): parse error encountered - line: %s, col: %s, msg: %s"
+                      % (e.lineno, e.offset, expat.ErrorString(e.code)))
+            raise
+
     def reset(self):
         self.close()
         # Re-init
-        self.__init__()
+        self.__init__(self.parser)
 
     def close(self):
         # WARNING: better call this function when you're done, or you'll end
@@ -205,26 +258,32 @@ class BaseDispatchHandler(ContentHandler, ErrorHandler):
     # def endDocument(self):
 
     def startElement(self, name, attrs):
+        self._startElement(name, _dict_to_utf8(attrs))
+
+    def _startElement(self, name, attrs):
         log_debug(6, name)
-        utf8_attrs = _dict_to_utf8(attrs)
         if self.rootAttributes is None:
             # First time around
             if self.rootElement != name:
                 raise Exception("Mismatching elements; root='%s', "
                                 "received='%s'" % (self.rootElement, name))
-            self.rootAttributes = utf8_attrs
+            self.rootAttributes = attrs
             self._check_version()
             return
 
         if self.__container is None:
             # This means it's parsing a container element
             self.__container = self.get_container(name)
+            self.__container.streaming = (self.parser == 'expat')
 
-        self.__container.startElement(name, utf8_attrs)
+        self.__container.startElement(name, attrs)
 
     def characters(self, content):
+        self._characters(_stringify(content))
+
+    def _characters(self, content):
         if self.__container:
-            self.__container.characters(_stringify(content))
+            self.__container.characters(content)
 
     def endElement(self, name):
         log_debug(6, name)
@@ -300,6 +359,9 @@ class SatelliteDispatchHandler(BaseDispatchHandler):
 
 # Element handler
 
+# How the attributes of an element are stored in the item, per item class
+_attributeMaps = {}
+
 
 class BaseItem:
     item_name = None
@@ -319,17 +381,30 @@ class BaseItem:
 
     def populateFromAttributes(self, obj, sourceDict):
         # Populates dict with items from sourceDict
+        attributeMap = _attributeMaps.setdefault(self.__class__, {})
         for key, value in sourceDict.items():
-            if key not in self.tagMap:
-                if key not in obj:
-                    # Unsupported key
-                    continue
-            else:
-                # Have to map this key
-                key = self.tagMap[key]
-
+            if key not in attributeMap:
+                attributeMap[key] = self._mapAttribute(obj, key)
+            mapping = attributeMap[key]
+            if mapping is None:
+                # Unsupported key
+                continue
+            key, objtype = mapping
+            if objtype is not None and objtype is not usix.StringType:
+                value = _normalizeAttribute(objtype, value)
             # Finally, update the key
-            obj[key] = _normalizeAttribute(obj.attributeTypes.get(key), value)
+            obj[key] = value
+
+    def _mapAttribute(self, obj, key):
+        # Returns the key and type the attribute `key' is stored with, None if
+        # it is not supported; the same for every object of the item class
+        if key not in self.tagMap:
+            if key not in obj:
+                return None
+        else:
+            # Have to map this key
+            key = self.tagMap[key]
+        return key, obj.attributeTypes.get(key)
 
     def populateFromElements(self, obj, elements):
         # Populates obj with `elements' as subelements
@@ -396,12 +471,32 @@ def addItem(classobj):
 
 def _createItem(element):
     # Creates an Item object from the specified element
+    if isinstance(element, importLib.Item):
+        # Already created while streaming
+        return element
     if element.name not in __itemDispatcher:
         # No item processor
         return None
     item = __itemDispatcher[element.name]()
     return item.populate(element.attributes, element.subelements)
 
+
+def _getItemProcessor(name):
+    # Returns the item processor for elements named `name', None if there is
+    # no such thing
+    if name not in __itemDispatcher:
+        return None
+    return __itemDispatcher[name]()
+
+
+def _hasItemSubelements(item, name):
+    # Whether the subelements of the element `name' of an item are items too
+    name = item.tagMap.get(name, name)
+    objtype = item.item_class.attributeTypes.get(name)
+    if not isinstance(objtype, usix.ListType):
+        return 0
+    return objtype[0] not in (usix.StringType, usix.IntType, importLib.DateType)
+
 #
 # ITEMS:
 #
@@ -911,6 +1006,11 @@ addItem(KickstartFileItem)
 #
 
 
+# While streaming, marks the elements whose subelements are items; the
+# subelements of an item are its fields instead
+_ITEMS = object()
+
+
 class ContainerHandler:
     container_name = None
 
@@ -922,6 +1022,13 @@ class ContainerHandler:
         self.objStack = []
         # Collects the elements in a batch
         self.batch = []
+        # Set by the dispatch handler: create the items when their elements
+        # end, rather than keeping a tree of Nodes for the whole item
+        self.streaming = 0
+        # While streaming, the item stack; each item is an array
+        # [item processor for the element or None, what the subelements are:
+        #  _ITEMS, the fields of an item processor, or None]
+        self.itemStack = []
 
     def reset(self):
         # Make sure the batch is preserved
@@ -939,6 +1046,20 @@ class ContainerHandler:
             raise Exception('This object should not have been used')
         self.tagStack.append(Node(element, attrs))
         self.objStack.append([])
+        if self.streaming:
+            self.itemStack.append(self._streamingContext(element))
+
+    def _streamingContext(self, element):
+        if not self.itemStack:
+            # The container element; the items follow
+            return [None, _ITEMS]
+        parent = self.itemStack[-1][1]
+        if parent is _ITEMS:
+            item = _getItemProcessor(element)
+            return [item, item]
+        if parent is not None and _hasItemSubelements(parent, element):
+            return [None, _ITEMS]
+        return [None, None]
 
     def characters(self, data):
         log_debug(6, data)
@@ -963,9 +1084,17 @@ class ContainerHandler:
             raise ParseException(
                 "incorrect XML data: closing tag %s, opening tag %s" % (
                     element, name))
-        # Append the content of the object to the tag object
-        for obj in self.objStack[-1]:
-            tagobj.addSubelement(obj)
+        item = None
+        if self.streaming:
+            item = self.itemStack[-1][0]
+            del self.itemStack[-1]
+        if item is not None:
+            # Create the item right away, out of the content
+            tagobj = item.populate(tagobj.attributes, self.objStack[-1])
+        else:
+            # Append the content of the object to the tag object
+            for obj in self.objStack[-1]:
+                tagobj.addSubelement(obj)
 
         # Remove the subelements from the stack
         del self.objStack[-1]
@@ -282,6 +282,20 @@ class Queue(rhnHandler):
                       order by a.earliest_action, a.prerequisite nulls first, a.id
     """)
 
+    def _has_pending_actions(self):
+        """ Cheap check, on the rhnServerAction index alone, whether there are
+            any queued or picked up actions for this server at all. """
+        h = rhnSQL.prepare(self._query_pending_actions)
+        h.execute(server_id=self.server_id)
+        return h.fetchone_dict() is not None
+
+    _query_pending_actions = rhnSQL.Statement("""
+        select 1
+          from rhnServerAction
+         where server_id = :server_id
+           and status in (0, 1) -- Queued or picked up
+    """)
+
     # Probably we need to figure out if we really need to split these two.
     def get(self, system_id, version=1, status={}):
         # Authenticate the system certificate
@@ -289,6 +303,9 @@ class Queue(rhnHandler):
             self.update_checkin = 0
         else:
             self.update_checkin = 1
+        # The checkin is written out later, together with the checkins of
+        # other systems
+        self.queue_checkin = 1
         self.auth_system(system_id)
         log_debug(1, self.server_id, version,
                   "checkins %s" % ["disabled", "enabled"][self.update_checkin])
@@ -296,7 +313,14 @@ class Queue(rhnHandler):
             self.__update_status(status)
 
         # Update the capabilities list
-        rhnCapability.update_client_capabilities(self.server_id)
+        rhnCapability.update_client_capabilities(
+            self.server_id, self.server.server['capabilities_digest'])
+
+        if not self._has_pending_actions():
+            # Most of the polls; nothing to invalidate or pick up either
+            log_debug(3, "No pending actions", self.server_id)
+            rhnSQL.commit()
+            return ""
 
         # Invalidate failed actions
         self._invalidate_failed_prereq_actions()
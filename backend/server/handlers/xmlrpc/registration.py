@@ -114,6 +114,7 @@ class Registration(rhnHandler):
         self.functions.append("remaining_subscriptions")  # obsoleted
         self.functions.append("reserve_user")           # obsoleted
         self.functions.append("send_serial")
+        self.functions.append("sync_packages")
         self.functions.append("upgrade_version")
         self.functions.append("update_contact_info")    # obsoleted
         self.functions.append("update_packages")
@@ -893,9 +894,12 @@ class Registration(rhnHandler):
 
         return 0
 
-    def update_packages(self, system_id, packages):
+    def update_packages(self, system_id, packages, digest=None):
         """ This function will update the package list associated with a server
             to be exactly the list of packages passed on the argument list
+
+            Clients using sync_packages() send the digest of the list along,
+            to base their next deltas on.
         """
         log_debug(5, system_id, packages)
         if CFG.DISABLE_PACKAGES:
@@ -908,9 +912,46 @@ class Registration(rhnHandler):
         server.dispose_packages()
         for package in packages:
             server.add_package(package)
-        server.save_packages()
+        server.save_packages(digest=digest)
         return 0
 
+    def sync_packages(self, system_id, profile):
+        """ Applies a delta to the package profile of a server, but only if
+            the server has the profile the client based the delta on.
+            profile is a dict with:
+                base: the digest of the profile the delta is based on
+                digest: the digest of the profile with the delta applied
+                added, deleted: lists of packages
+
+            Returns 1 if the delta got applied, 0 if the profile the server
+            has is a different one; the client then has to send the whole
+            profile to update_packages().
+        """
+        log_debug(5, system_id, profile)
+        if CFG.DISABLE_PACKAGES:
+            return 1
+        if type(profile) != type({}) or not profile.get('base') \
+                or not profile.get('digest'):
+            log_error("Invalid argument", type(profile))
+            raise rhnFault(21)
+        added_packages = self._normalize_packages(system_id, profile.get('added', []))
+        deleted_packages = self._normalize_packages(system_id, profile.get('deleted', []))
+
+        server = self.auth_system(system_id)
+        if server.server['package_profile_digest'] != profile['base']:
+            log_debug(1, self.server_id, "package profile changed, full upload needed")
+            return 0
+        log_debug(1, self.server_id, "added: %d, deleted: %d" % (
+            len(added_packages), len(deleted_packages)))
+        # Deletes first; a package reinstalled is in both lists, with
+        # different install times
+        for package in deleted_packages:
+            server.delete_package(package)
+        for package in added_packages:
+            server.add_package(package)
+        server.save_packages(digest=profile['digest'])
+        return 1
+
     def _normalize_packages(self, system_id, packages, allow_none=0):
         """ the function checks if list of packages is well formated
             and also converts packages from old list of lists
@@ -1020,23 +1061,12 @@ class Registration(rhnHandler):
         """ Recreate the server HW profile """
         log_debug(5, system_id, hwlist)
         server = self.auth_system(system_id)
-        sid = server.getid()
         # clear out the existing list first
         # the only difference between add_hw_profile and refresh_hw_profile
-        # make sure primary network interface does not get reset
-        h = rhnSQL.prepare("""
-            select name from rhnservernetinterface where server_id = :server_id AND is_primary ='Y'
-        """)
-        h.execute(server_id=sid)
-        row = h.fetchone_dict()
+        # Devices which did not change are left alone when saving, and network
+        # interfaces are updated in place, so the primary one stays primary
         server.delete_hardware()
         self.__add_hw_profile_no_auth(server, hwlist)
-        if row:
-            h = rhnSQL.prepare("""
-                update rhnservernetinterface set is_primary = 'Y' where server_id = :server_id AND name = :name
-            """)
-            h.execute(server_id=sid, name=row['name'])
-            rhnSQL.commit()
         return 0
 
     def welcome_message(self, lang=None):
@@ -84,7 +84,8 @@ class Up2date(rhnHandler):
         # log the entry
         log_debug(1, self.server_id)
         # Update the capabilities list
-        rhnCapability.update_client_capabilities(self.server_id)
+        rhnCapability.update_client_capabilities(
+            self.server_id, self.server.server['capabilities_digest'])
         # Fetch the channels this client is subscribed to
         channels = rhnChannel.getSubscribedChannels(self.server_id)
 
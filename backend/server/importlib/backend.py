@@ -24,7 +24,8 @@ from spacewalk.common.usix import raise_with_tb
 from spacewalk.common import rhn_rpm
 from spacewalk.common.rhnConfig import CFG
 from spacewalk.common.rhnException import rhnFault
-from spacewalk.server import rhnSQL, rhnChannel, taskomatic
+from spacewalk.common.rhnLog import log_debug
+from spacewalk.server import rhnSQL, taskomatic
 from importLib import Diff, Package, IncompletePackage, Erratum, \
     AlreadyUploadedError, InvalidPackageError, TransactionError, \
     InvalidSeverityError, SourcePackage
@@ -62,6 +63,13 @@ class Backend:
     # TODO: Some reason why we're passing a module in here? Seems to
     # always be rhnSQL anyhow...
 
+    # Number of values looked up with a single "in (...)" query
+    lookupChunkSize = 500
+
+    # How lockChannels locks the rhnChannel rows; inserting rows referencing
+    # a channel does not lock it on Oracle
+    channelLockMode = "for update"
+
     def __init__(self, dbmodule):
         self.dbmodule = dbmodule
         self.sequences = {}
@@ -112,10 +120,7 @@ class Backend:
                 changelogHash[(name, time, text)] = row['id']
                 continue
 
-            id = self.sequences['rhnPackageChangeLogData'].next()
-            changelogHash[(name, time, text)] = id
-
-            toinsert[0].append(id)
+            toinsert[0].append((name, time, text))
             toinsert[1].append(val['name'])
             toinsert[2].append(val['time'])
             toinsert[3].append(val['text'])
@@ -124,36 +129,46 @@ class Backend:
             # Nothing to do
             return
 
+        # Generate the ids in one go
+        ids = self.sequences['rhnPackageChangeLogData'].next_block(len(toinsert[0]))
+        for key, id in zip(toinsert[0], ids):
+            changelogHash[key] = id
+        toinsert[0] = ids
+
         sql = "insert into rhnPackageChangeLogData (id, name, time, text) values (:id, :name, :time, :text)"
         h = self.dbmodule.prepare(sql)
         h.executemany(id=toinsert[0], name=toinsert[1], time=toinsert[2], text=toinsert[3])
 
     def processCVEs(self, cveHash):
-        # First figure out which CVE's are already inserted
-        sql = "select id from rhnCVE where name = :name"
-        h = self.dbmodule.prepare(sql)
-        toinsert = [[], []]
-
-        for cve_name in cveHash.keys():
-            h.execute(name=cve_name)
-            row = h.fetchone_dict()
+        # First figure out which CVE's are already inserted, a chunk of names
+        # at a time
+        names = list(cveHash.keys())
+        found = {}
+        for i in range(0, len(names), self.lookupChunkSize):
+            placeholders, params = bind_list('name', names[i:i + self.lookupChunkSize])
+            h = self.dbmodule.prepare(
+                "select id, name from rhnCVE where name in (%s)" % placeholders)
+            h.execute(**params)
+            for row in h.fetchall_dict() or []:
+                found[row['name']] = row['id']
 
-            if row:
-                cveHash[cve_name] = row['id']
+        toinsert = [[], []]
+        for cve_name in names:
+            if cve_name in found:
+                cveHash[cve_name] = found[cve_name]
                 continue
 
-            # Generate an id
-            id = self.sequences['rhnCVE'].next()
-
-            cveHash[cve_name] = id
-
-            toinsert[0].append(id)
             toinsert[1].append(cve_name)
 
-        if not toinsert[0]:
+        if not toinsert[1]:
             # Nothing to do
             return
 
+        # Generate the ids in one go
+        toinsert[0] = self.sequences['rhnCVE'].next_block(len(toinsert[1]))
+        for cve_name, id in zip(toinsert[1], toinsert[0]):
+            cveHash[cve_name] = id
+
         sql = "insert into rhnCVE (id, name) values (:id, :name)"
         h = self.dbmodule.prepare(sql)
         h.executemany(id=toinsert[0], name=toinsert[1])
@@ -588,23 +603,36 @@ class Backend:
             if not isinstance(package, IncompletePackage):
                 raise TypeError("Expected an IncompletePackage instance, found %s" %
                                 str(type(package)))
-        for package in packages:
-            # here we need to figure out which checksum we have in the database
-            not_found = None
-            for type, chksum in package['checksums'].items():
+        lookup = TableLookup(self.tables['rhnPackage'], self.dbmodule)
+        # here we need to figure out which checksum we have in the database;
+        # all the packages are looked up by their first checksum, the ones
+        # not found by their second one and so on
+        pending = [(package, list(package['checksums'].items()))
+                   for package in packages if not package.ignored]
+        while pending:
+            batch = []
+            for package, chksums in pending:
+                if not chksums:
+                    continue
+                type, chksum = chksums.pop(0)
                 package['checksum_type'] = type
                 package['checksum'] = chksum
                 package['checksum_id'] = checksums[(type, chksum)]
-                try:
-                    self.__lookupObjectCollection([package], 'rhnPackage')
-                    not_found = None
-                    break
-                except InvalidPackageError:
-                    e = sys.exc_info()[1]
-                    not_found = (e, sys.exc_info()[2])
-            if not_found and not ignore_missing:
-                # package is not in database at all
-                raise_with_tb(not_found[0], not_found[1])
+                batch.append((package, chksums))
+            lookup.prefetch([package for package, chksums in batch])
+            pending = []
+            for package, chksums in batch:
+                row = lookup.fetch(package)
+                if row:
+                    package.id = row['id']
+                elif chksums:
+                    pending.append((package, chksums))
+                elif not ignore_missing:
+                    # package is not in database at all
+                    raise InvalidPackageError(package, "Could not find object %s in table %s"
+                                              % (package, 'rhnPackage'))
+        log_debug(3, "rhnPackage: looked up %s packages in %s queries"
+                  % (lookup.objectCount, lookup.queryCount))
 
     def lookupChannelFamilies(self, hash):
         if not hash:
@@ -635,9 +663,7 @@ class Backend:
         for label, name in hash.items():
             row = t[label]
             if not row:
-                row_id = seq.next()
-                result[label] = row_id
-                to_insert.append((label, name, row_id))
+                to_insert.append((label, name))
                 continue
             row_id = row['id']
             result[label] = row_id
@@ -647,12 +673,12 @@ class Backend:
             # Entry found in the table - nothing more to do
 
         if to_insert:
-            # Have to insert rows
-            row_ids = []
+            # Have to insert rows; generate the ids in one go
+            row_ids = seq.next_block(len(to_insert))
             labels = []
             names = []
-            for label, name, row_id in to_insert:
-                row_ids.append(row_id)
+            for (label, name), row_id in zip(to_insert, row_ids):
+                result[label] = row_id
                 labels.append(label)
                 names.append(name)
 
@@ -747,6 +773,12 @@ class Backend:
             if not isinstance(package, Package):
                 raise TypeError("Expected a Package instance")
 
+        # The packages are processed one by one, but looked up all at once
+        lookup = TableLookup(self.tables['rhnPackage'], self.dbmodule)
+        lookup.prefetch([package for package in packages if not package.ignored])
+
+        for package in packages:
+
             tableList = copy.deepcopy(childTables)
 
             # older sat packages wont have these fields
@@ -758,7 +790,9 @@ class Backend:
             self.__processObjectCollection__([package, ], 'rhnPackage', tableList,
                                              uploadForce=uploadForce, forceVerify=forceVerify,
                                              ignoreUploaded=ignoreUploaded, severityLimit=1,
-                                             transactional=transactional)
+                                             transactional=transactional, lookup=lookup)
+        log_debug(3, "rhnPackage: looked up %s packages in %s queries"
+                  % (lookup.objectCount, lookup.queryCount))
 
     def processErrata(self, errata):
         # Insert/update the packages
@@ -781,6 +815,9 @@ class Backend:
                                               transactional=1)
 
     def update_channels_affected_by_errata(self, dml):
+        # Updates the channels of the errata processErrata() changed and
+        # queues their repodata for regeneration; returns the labels of those
+        # channels
 
         # identify errata that were affected
         affected_errata_ids = {}
@@ -791,42 +828,42 @@ class Backend:
                     field = 'id'
                 elif 'errata_id' in values_hash:
                     field = 'errata_id'
+                else:
+                    continue
 
                 # Now we know in which field to look for changes
                 for erratum_id in values_hash[field]:
                     affected_errata_ids[erratum_id] = None
 
-        # Get affected channels
-        affected_channel_ids = {}
-        h = self.dbmodule.prepare("""
-            select channel_id
-              from rhnChannelErrata
-             where errata_id = :errata_id
-        """)
-        for errata_id in affected_errata_ids.keys():
-            h.execute(errata_id=errata_id)
-
-            channel_ids = h.fetchall_dict() or []
-            channel_ids = [x['channel_id'] for x in channel_ids]
-            for channel_id in channel_ids:
-                affected_channel_ids[channel_id] = errata_id
+        # Get affected channels, with their label and one of the errata,
+        # for all the errata of a chunk at once
+        affected_channels = {}
+        errata_ids = list(affected_errata_ids.keys())
+        for i in range(0, len(errata_ids), self.lookupChunkSize):
+            placeholders, params = bind_list(
+                'errata_id', errata_ids[i:i + self.lookupChunkSize])
+            h = self.dbmodule.prepare("""
+                select ce.channel_id, c.label, e.advisory
+                  from rhnChannelErrata ce, rhnChannel c, rhnErrata e
+                 where ce.errata_id in (%s)
+                   and ce.channel_id = c.id
+                   and ce.errata_id = e.id
+            """ % placeholders)
+            h.execute(**params)
+            for row in h.fetchall_dict() or []:
+                affected_channels[row['channel_id']] = (row['label'], row['advisory'])
 
         # Now update the channels
+        channel_ids = self.lockChannels(affected_channels.keys())
         update_channel = self.dbmodule.Procedure('rhn_channel.update_channel')
         invalidate_ss = 0
 
-        for channel_id in affected_channel_ids.keys():
+        for channel_id in channel_ids:
+            label, advisory = affected_channels[channel_id]
             update_channel(channel_id, invalidate_ss)
-            h = self.dbmodule.prepare("""
-                select advisory from rhnErrata where id = :errata_id
-            """)
-            h.execute(errata_id=affected_channel_ids[channel_id])
-            advisory = h.fetchone()[0]
+            taskomatic.add_to_repodata_queue(label, "errata", advisory)
 
-            channel = rhnChannel.Channel()
-            channel.load_by_id(channel_id)
-            taskomatic.add_to_repodata_queue(channel.get_label(), "errata",
-                                             advisory)
+        return sorted([label for label, advisory in affected_channels.values()])
 
     def processKickstartTrees(self, ks_trees):
         childTables = [
@@ -1305,12 +1342,35 @@ class Backend:
         # This function returns the channels that were affected
         return affected_channels
 
+    def lockChannels(self, channel_ids):
+        # Locks the rhnChannel rows the caller is about to update, always in
+        # the order of their ids, so that processes updating the same
+        # channels at the same time wait for each other instead of
+        # deadlocking; returns the ids in that order. The lock must not
+        # conflict with the ones foreign keys take on rhnChannel for the
+        # rows already inserted in this transaction, see channelLockMode
+        channel_ids = sorted(channel_ids)
+        for i in range(0, len(channel_ids), self.lookupChunkSize):
+            placeholders, params = bind_list('channel_id', channel_ids[i:i + self.lookupChunkSize])
+            h = self.dbmodule.prepare("""
+                select id
+                  from rhnChannel
+                 where id in (%s)
+                 order by id
+                   %s
+            """ % (placeholders, self.channelLockMode))
+            h.execute(**params)
+            h.fetchall_dict()
+        return channel_ids
+
     def update_newest_package_cache(self, caller, affected_channels, name_ids=[]):
         # affected_channels is a hash keyed on the channel id, and with a
         # tuple (added_package_list, deleted_package_list) as values
+        channel_ids = self.lockChannels(affected_channels.keys())
         refresh_newest_package = self.dbmodule.Procedure('rhn_channel.refresh_newest_package')
         update_channel = self.dbmodule.Procedure('rhn_channel.update_channel')
-        for channel_id, (added_packages_list, deleted_packages_list) in affected_channels.items():
+        for channel_id in channel_ids:
+            added_packages_list, deleted_packages_list = affected_channels[channel_id]
             try:
                 if name_ids:
                     for id in name_ids:
@@ -1360,14 +1420,6 @@ class Backend:
             # saving id
             hash[k] = h.fetchone_dict().popitem()[1]
 
-    def __buildQueries(self, childTables):
-        childTableLookups = {}
-        queryTempl = "select * from %s where %s = :id"
-        for childTableName in childTables:
-            childTableLookups[childTableName] = self.dbmodule.prepare(
-                queryTempl % (childTableName, childTables[childTableName]))
-        return childTableLookups
-
     def __processObjectCollection(self, objColl, parentTable, childTables=[],
                                   colname=None, **kwargs):
         # Returns the DML object that was processed
@@ -1409,6 +1461,9 @@ class Backend:
             'severityLimit': 0,
             # All-or-nothing
             'transactional': 0,
+            # The TableLookup for parentTable, possibly with the objects
+            # prefetched already
+            'lookup': None,
         }
 
         for k, v in kwargs.items():
@@ -1441,9 +1496,10 @@ class Backend:
         brokenTransaction = 0
 
         # Lookup object
-        lookup = TableLookup(parentTableObj, self.dbmodule)
-        # XXX
-        childTableLookups = self.__buildQueries(childTables)
+        lookup = kwparams['lookup']
+        if lookup is None:
+            lookup = TableLookup(parentTableObj, self.dbmodule)
+        lookup.prefetch([object for object in objColl if not object.ignored])
         # For each valid object in the collection, look it up
         #   if it doesn't exist, insert all the associated information
         #   if it already exists:
@@ -1457,46 +1513,15 @@ class Backend:
         #       one if not explicitly specified). The "global" severity is the
         #       max of all severities.
         #   New objects will have a diff level of -1
+        newObjects = []
         for object in objColl:
             if object.ignored:
                 # Skip it
                 continue
-            h = lookup.query(object)
-            row = h.fetchone_dict()
+            row = lookup.fetch(object)
             if not row:
                 # Object does not exist
-                id = self.sequences[parentTable].next()
-                object.id = id
-                extObject = {'id': id}
-                _buildExternalValue(extObject, object, parentTableObj)
-                addHash(dml.insert[parentTable], extObject)
-
-                # Insert child table information
-                for tname in childTables:
-                    tbl = self.tables[tname]
-                    # Get the list of objects for this package
-                    entry_list = object[tbl.getAttribute()]
-                    if entry_list is None:
-                        continue
-                    for entry in entry_list:
-                        extObject = {childTables[tname]: id}
-                        seq_col = tbl.sequenceColumn
-                        if seq_col:
-                            # This table has to insert values in a sequenced
-                            # column; since it's a child table and the entry
-                            # in the master table is not created yet, there
-                            # shouldn't be a problem with uniqueness
-                            # constraints
-                            new_id = self.sequences[tbl.name].next()
-                            extObject[seq_col] = new_id
-                            # Make sure we initialize the object's sequenced
-                            # column as well
-                            entry[seq_col] = new_id
-                        _buildExternalValue(extObject, entry, tbl)
-                        addHash(dml.insert[tname], extObject)
-                object.diff_result = Diff()
-                # New object
-                object.diff_result.level = -1
+                newObjects.append(object)
                 continue
 
             # Already uploaded
@@ -1508,7 +1533,45 @@ class Backend:
             # And save the object and the row for later processing
             uploadedObjects[row['id']] = [object, row]
 
+        # Get the ids of all the new rows in a few round trips
+        self.__preallocateIds(newObjects, parentTable, childTables)
+
+        for object in newObjects:
+            id = self.sequences[parentTable].next()
+            object.id = id
+            extObject = {'id': id}
+            _buildExternalValue(extObject, object, parentTableObj)
+            addHash(dml.insert[parentTable], extObject)
+
+            # Insert child table information
+            for tname in childTables:
+                tbl = self.tables[tname]
+                # Get the list of objects for this package
+                entry_list = object[tbl.getAttribute()]
+                if entry_list is None:
+                    continue
+                for entry in entry_list:
+                    extObject = {childTables[tname]: id}
+                    seq_col = tbl.sequenceColumn
+                    if seq_col:
+                        # This table has to insert values in a sequenced
+                        # column; since it's a child table and the entry
+                        # in the master table is not created yet, there
+                        # shouldn't be a problem with uniqueness
+                        # constraints
+                        new_id = self.sequences[tbl.name].next()
+                        extObject[seq_col] = new_id
+                        # Make sure we initialize the object's sequenced
+                        # column as well
+                        entry[seq_col] = new_id
+                    _buildExternalValue(extObject, entry, tbl)
+                    addHash(dml.insert[tname], extObject)
+            object.diff_result = Diff()
+            # New object
+            object.diff_result.level = -1
+
         # Deal with already-uploaded objects
+        toVerify = []
         for objid, (object, row) in uploadedObjects.items():
             # Build the external value
             extObject = {'id': row['id']}
@@ -1525,36 +1588,62 @@ class Backend:
                     # Same object, or not different enough
                     # not enough karma either
                     continue
+            toVerify.append((objid, object, extObject, diffval))
+
+        # Compare the child tables, fetching the entries of a chunk of objects
+        # with a query per table
+        for i in range(0, len(toVerify), self.lookupChunkSize):
+            chunk = toVerify[i:i + self.lookupChunkSize]
+            childTablesInfo = self.__getChildTablesInfo(
+                [objid for objid, object, extObject, diffval in chunk], childTables)
+
+            for objid, object, extObject, diffval in chunk:
+                localDML = self.__processUploaded(objid, object, childTables,
+                                                  childTablesInfo[objid])
+
+                if uploadForce < object.diff.level:
+                    # Not enough karma
+                    if object.diff.level > severityLimit:
+                        # Broken transaction - object is too different
+                        brokenTransaction = 1
+                    continue
 
-            localDML = self.__processUploaded(objid, object, childTables,
-                                              childTableLookups)
-
-            if uploadForce < object.diff.level:
-                # Not enough karma
-                if object.diff.level > severityLimit:
-                    # Broken transaction - object is too different
-                    brokenTransaction = 1
-                continue
-
-            # Clean up the object diff since we pushed the package
-            object.diff = None
+                # Clean up the object diff since we pushed the package
+                object.diff = None
 
-            if diffval:
-                # Different parent object
-                localDML['update'][parentTable] = [extObject]
+                if diffval:
+                    # Different parent object
+                    localDML['update'][parentTable] = [extObject]
 
-            # And transfer the local DML to the global one
-            for k, tablehash in localDML.items():
-                dmlhash = getattr(dml, k)
-                for tname, vallist in tablehash.items():
-                    for val in vallist:
-                        addHash(dmlhash[tname], val)
+                # And transfer the local DML to the global one
+                for k, tablehash in localDML.items():
+                    dmlhash = getattr(dml, k)
+                    for tname, vallist in tablehash.items():
+                        for val in vallist:
+                            addHash(dmlhash[tname], val)
 
         if transactional and brokenTransaction:
             raise TransactionError("Error uploading package source batch")
         return self.__doDML(dml)
 
-    def __processUploaded(self, objid, object, childTables, childTableLookups):
+    def __preallocateIds(self, objects, parentTable, childTables):
+        # Fetch the sequence values needed to insert objects and the entries
+        # of their sequenced child tables, one round trip per sequence
+        if not objects:
+            return
+        self.sequences[parentTable].preallocate(len(objects))
+        for tname in childTables:
+            tbl = self.tables[tname]
+            if not tbl.sequenceColumn:
+                continue
+            attr = tbl.getAttribute()
+            count = 0
+            for object in objects:
+                if object[attr] is not None:
+                    count = count + len(object[attr])
+            self.sequences[tbl.name].preallocate(count)
+
+    def __processUploaded(self, objid, object, childTables, childTablesInfo):
         # Store the DML operations locally
         localDML = {
             'insert': {},
@@ -1562,10 +1651,6 @@ class Backend:
             'delete': {},
         }
 
-        # Grab the rest of the information
-        childTablesInfo = self.__getChildTablesInfo(objid, list(childTables.keys()),
-                                                    childTableLookups)
-
         # Start computing deltas
         for childTableName in childTables:
             # Init the local hashes
@@ -1585,6 +1670,8 @@ class Backend:
             childSeverityHash = childTableObj.getSeverityHash()
             if entrylist is None:
                 continue
+            # New entries of a sequenced table, to get their ids in one go
+            newEntries = []
             for ent in entrylist:
                 # Build the primary key
                 key = []
@@ -1608,10 +1695,8 @@ class Backend:
                 # Look this value up
                 if key not in dbside:
                     if childTableObj.sequenceColumn:
-                        # Initialize the sequence column too
-                        sc = childTableObj.sequenceColumn
-                        nextid = self.sequences[childTableName].next()
-                        val[sc] = ent[sc] = nextid
+                        # The sequence column is initialized below
+                        newEntries.append((val, ent))
                     # This entry has to be inserted
                     object.diff.append((parentattr, val, None))
                     # XXX change to a default value
@@ -1639,6 +1724,12 @@ class Backend:
                 localDML['update'][childTableName].append(val)
                 del dbside[key]
 
+            if newEntries:
+                sc = childTableObj.sequenceColumn
+                ids = self.sequences[childTableName].next_block(len(newEntries))
+                for (val, ent), nextid in zip(newEntries, ids):
+                    val[sc] = ent[sc] = nextid
+
             if childTableName == 'rhnErrataPackage':
                 continue
 
@@ -1681,8 +1772,13 @@ class Backend:
             # Nothing to do
             return
 
+        # The insert consumes the lists it is given; leave those of the DML
+        # object alone, the callers look at what was inserted
+        values = {}
+        for k, v in hash.items():
+            values[k] = v[:]
         insertObj = TableInsert(tab, self.dbmodule)
-        insertObj.query(hash)
+        insertObj.query(values)
         return
 
     def __doDelete(self, hash, tables):
@@ -1727,12 +1823,12 @@ class Backend:
     def __lookupObjectCollection(self, objColl, tableName, ignore_missing=0):
         # Looks the object up in tableName, and fills in its id
         lookup = TableLookup(self.tables[tableName], self.dbmodule)
+        lookup.prefetch([object for object in objColl if not object.ignored])
         for object in objColl:
             if object.ignored:
                 # Skip it
                 continue
-            h = lookup.query(object)
-            row = h.fetchone_dict()
+            row = lookup.fetch(object)
             if not row:
                 if ignore_missing:
                     # Ignore the missing objects
@@ -1742,19 +1838,28 @@ class Backend:
                 raise InvalidPackageError(object, "Could not find object %s in table %s" % (object, tableName))
             object.id = row['id']
 
-    def __getChildTablesInfo(self, id, tables, queries):
-        # Returns a hash with the information about package id from tables
+    def __getChildTablesInfo(self, ids, childTables):
+        # Returns a hash keyed on the object ids, with the information about
+        # each object from the child tables
         result = {}
-        for tname in tables:
+        for id in ids:
+            result[id] = {}
+            for tname in childTables:
+                result[id][tname] = {}
+        if not ids:
+            return result
+        placeholders, params = bind_list('id', ids)
+        for tname, colname in childTables.items():
             tableobj = self.tables[tname]
             fields = tableobj.getFields()
-            q = queries[tname]
-            q.execute(id=id)
-            hash = {}
+            q = self.dbmodule.prepare("select * from %s where %s in (%s)" % (
+                tname, colname, placeholders))
+            q.execute(**params)
             while 1:
                 row = q.fetchone_dict()
                 if not row:
                     break
+                hash = result[row[colname]][tname]
                 pks = tableobj.getPK()
                 key = []
                 for f in pks:
@@ -1768,8 +1873,6 @@ class Backend:
                     value = sanitizeValue(value, datatype)
                     val[f] = value
                 hash[tuple(key)] = val
-
-            result[tname] = hash
         return result
 
     def __populateTable(self, table_name, data, delete_extra=1):
@@ -1828,21 +1931,26 @@ class Backend:
             key = build_key(entry, uq_fields)
             valhash[key] = entry
 
-        query = "select %s from %s where %s = :%s" % (
-            string.join(all_fields, ", "),
-            table_name,
-            first_uq_col, first_uq_col,
-        )
-        h = self.dbmodule.prepare(query)
+        # Fetch the rows of a chunk of values of the first unique column at
+        # once
         updates = []
         deletes = []
-        for val, valhash in uq_col_values.items():
-            params = {first_uq_col: val}
+        uq_vals = list(uq_col_values.keys())
+        for i in range(0, len(uq_vals), self.lookupChunkSize):
+            placeholders, params = bind_list(
+                first_uq_col, uq_vals[i:i + self.lookupChunkSize])
+            query = "select %s from %s where %s in (%s)" % (
+                string.join(all_fields, ", "),
+                table_name,
+                first_uq_col, placeholders,
+            )
+            h = self.dbmodule.prepare(query)
             h.execute(**params)
             while 1:
                 row = h.fetchone_dict()
                 if not row:
                     break
+                valhash = uq_col_values[row[first_uq_col]]
                 key = build_key(row, uq_fields)
                 if key not in valhash:
                     # Need to delete this one
@@ -1859,6 +1967,7 @@ class Backend:
                     continue
                 # Need to update
                 updates.append(entry)
+                del valhash[key]
 
         inserts = []
         list(map(inserts.extend, [list(x.values()) for x in list(uq_col_values.values())]))
@@ -1883,9 +1992,9 @@ class Backend:
             h.executemany(**params)
         if updates:
             params = transpose(updates, all_fields)
-            query = "update % set %s where %s" % (
+            query = "update %s set %s where %s" % (
                 table_name,
-                string.join(["%s = :s" + (x, x) for x in fields],
+                string.join(["%s = :%s" % (x, x) for x in fields],
                             ', '),
                 string.join(["%s = :%s" % (x, x) for x in uq_fields],
                             ' and '),
@@ -1918,6 +2027,18 @@ def transpose(arrhash, fields):
     return params
 
 
+def bind_list(name, values):
+    # Returns the placeholders and the parameters to bind a list of values in
+    # an "in (...)" clause: ":name_0, :name_1, ..."
+    params = {}
+    placeholders = []
+    for i in range(len(values)):
+        param = "%s_%d" % (name, i)
+        params[param] = values[i]
+        placeholders.append(":" + param)
+    return string.join(placeholders, ', '), params
+
+
 def hash2tuple(hash, fields):
     # Converts the hash into a tuple, with the fields ordered as presented in
     # the fields list
@@ -248,13 +248,92 @@ class BaseTableLookup:
 
 class TableLookup(BaseTableLookup):
 
+    # Number of objects prefetch() looks up with a single query
+    chunkSize = 500
+
     def __init__(self, table, dbmodule):
         BaseTableLookup.__init__(self, table, dbmodule)
         self.queryTemplate = "select * from %s where %s"
+        # Rows looked up by prefetch(), keyed on the primary key values
+        self.prefetched = {}
+        # Statistics: objects looked up and queries it took
+        self.objectCount = 0
+        self.queryCount = 0
 
     def _buildQuery(self, key):
         return self.queryTemplate % (self.table.name, self.whereclauses[key])
 
+    def query(self, values):
+        self.queryCount = self.queryCount + 1
+        return BaseTableLookup.query(self, values)
+
+    def _pkValue(self, value):
+        # The primary key values, the way they compare in the database
+        ret = []
+        for col in self.pks:
+            val = value[col]
+            if self.table.isNullable(col) and val in [None, '']:
+                val = None
+            elif isinstance(val, UnicodeType):
+                val = val.encode('utf-8')
+            elif val is not None:
+                val = str(val)
+            ret.append(val)
+        return tuple(ret)
+
+    def prefetch(self, values):
+        # Looks up a list of objects in as few queries as possible; fetch()
+        # then serves the rows from memory. A prefetched row is served only
+        # once, so looking an object up again goes to the database and sees
+        # whatever was inserted meanwhile.
+        groups = {}
+        for value in values:
+            pk = self._pkValue(value)
+            if pk in self.prefetched:
+                continue
+            self.prefetched[pk] = None
+            key, hash = self._selectQueryKey(value)
+            if key not in groups:
+                groups[key] = []
+            groups[key].append((pk, hash))
+        for key, entries in groups.items():
+            for i in range(0, len(entries), self.chunkSize):
+                self._prefetchChunk(key, entries[i:i + self.chunkSize])
+
+    def _prefetchChunk(self, key, entries):
+        pks = {}
+        clauses = []
+        params = {}
+        for i in range(len(entries)):
+            pk, hash = entries[i]
+            pks[pk] = None
+            clause = []
+            for col in self.pks:
+                if col not in hash:
+                    clause.append("%s is null" % col)
+                    continue
+                param = "%s_%d" % (col, i)
+                clause.append("%s = :%s" % (col, param))
+                params[param] = hash[col]
+            clauses.append("(%s)" % string.join(clause, ' and '))
+        statement = self.dbmodule.prepare(self.queryTemplate % (
+            self.table.name, string.join(clauses, ' or ')))
+        statement.execute(**params)
+        self.queryCount = self.queryCount + 1
+        for row in statement.fetchall_dict() or []:
+            pk = self._pkValue(row)
+            # Same as fetchone_dict(), the first row wins
+            if pk in pks and self.prefetched.get(pk) is None:
+                self.prefetched[pk] = row
+
+    def fetch(self, value):
+        # Same as query(value).fetchone_dict()
+        self.objectCount = self.objectCount + 1
+        pk = self._pkValue(value)
+        if pk in self.prefetched:
+            return self.prefetched.pop(pk)
+        return self.query(value).fetchone_dict()
+
 
 class TableUpdate(BaseTableLookup):
 
@@ -622,6 +622,11 @@ class PostgresqlBackend(OracleBackend):
     avoid the few bits that are.
     """
 
+    # Inserting a row referencing a channel takes a key share lock on it,
+    # which "for update" would wait for; the rhnChannel updates only need
+    # to exclude each other
+    channelLockMode = "for no key update"
+
     def setSessionTimeZoneToLocalTimeZone(self):
         sth = self.dbmodule.prepare("set session time zone '%s'"
                                     % timezone_utils.get_utc_offset())
@@ -23,6 +23,8 @@ def schedule_errata_cache_update(channels):
     # If no channels were supplied, exit here to shortcut parsing the query
     if not channels:
         return
+    # One task per channel, however many times it was affected
+    channels = sorted(set(channels))
     h = rhnSQL.prepare("""
         insert into rhnTaskQueue
        (org_id, task_name, task_data, priority, earliest)
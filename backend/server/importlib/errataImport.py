@@ -31,6 +31,10 @@ class ErrataImport(GenericPackageImport):
         self.cve = {}
         self.queue_timeout = queue_timeout
         self.file_types = {}
+        # Severity ids, keyed on the security impact
+        self.severities = {}
+        # Labels of the channels the errata were added to or changed in
+        self.affected_channels = []
 
     def preprocess(self):
         # Processes the package batch to a form more suitable for database
@@ -210,7 +214,7 @@ class ErrataImport(GenericPackageImport):
     def submit(self):
         try:
             dml = self.backend.processErrata(self.batch)
-            self.backend.update_channels_affected_by_errata(dml)
+            self.affected_channels = self.backend.update_channels_affected_by_errata(dml)
             self._fix_files()
             self.backend.queue_errata(self.batch, self.queue_timeout)
         except:
@@ -312,7 +316,10 @@ class ErrataImport(GenericPackageImport):
         # If RHBA/RHEA severity is irrelevant and posibly
         # not included or it could not be hosted
         if 'security_impact' in erratum:
-            erratum['severity_id'] = self.backend.lookupErrataSeverityId(erratum)
+            impact = erratum['security_impact']
+            if impact not in self.severities:
+                self.severities[impact] = self.backend.lookupErrataSeverityId(erratum)
+            erratum['severity_id'] = self.severities[impact]
 
     def _fix_erratum_oval_info(self, erratum):
         """
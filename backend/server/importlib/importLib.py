@@ -625,6 +625,23 @@ class Error(Information):
     }
 
 
+# Held while filling up the lookup tables, see set_lookup_lock()
+_lookup_lock = None
+
+
+def set_lookup_lock(lock):
+    """
+    Have the importers hold lock (a multiprocessing.Lock shared by processes
+    importing at the same time) while they look up, and insert if missing,
+    the rows shared by all the objects: package names, EVRs, checksums,
+    capabilities, changelogs... Otherwise two processes may insert the same
+    row, one of them then failing on the unique constraint. What was
+    inserted is committed before the lock is released.
+    """
+    global _lookup_lock
+    _lookup_lock = lock
+
+
 # Base import class
 class Import:
 
@@ -664,7 +681,15 @@ class Import:
 
     def run(self):
         self.preprocess()
-        self.fix()
+        if _lookup_lock is None:
+            self.fix()
+        else:
+            _lookup_lock.acquire()
+            try:
+                self.fix()
+                self.backend.commit()
+            finally:
+                _lookup_lock.release()
         self.submit()
 
     def cleanup(self):
@@ -215,6 +215,8 @@ class PackageImport(ChannelPackageSubscription):
         self.groups = {}
         self.sourceRPMs = {}
         self.changelog_data = {}
+        # The gpg key ids the packages are signed with -> rhnPackageKey id
+        self.package_keys = {}
 
     def _rpm_knows(self, tag):
         # See if the installed version of RPM understands a given tag
@@ -234,6 +236,7 @@ class PackageImport(ChannelPackageSubscription):
         # Change copyright to license
         # XXX
         package['copyright'] = self._fix_encoding(package['license'])
+        self._preprocess_signature(package)
 
         for tag in ('recommends', 'suggests', 'supplements', 'enhances', 'breaks', 'predepends'):
             if not self._rpm_knows(tag) or tag not in package or type(package[tag]) != type([]):
@@ -304,6 +307,9 @@ class PackageImport(ChannelPackageSubscription):
 
         self.backend.lookupSourceRPMs(self.sourceRPMs)
         self.backend.lookupPackageGroups(self.groups)
+        # New keys are inserted here, along with the other shared rows
+        for key_id in self.package_keys.keys():
+            self.package_keys[key_id] = server_packages.lookup_package_key(key_id)
         # Postprocess the gathered information
         self.__postprocess()
 
@@ -389,15 +395,23 @@ class PackageImport(ChannelPackageSubscription):
         if object.ignored:
             object.id = object.first_package.id
 
+    def _preprocess_signature(self, package):
+        # Gets the key the package is signed with, for fix() to look it up
+        package.key_id = None
+        # skip missing files and mpm packages
+        if package['path'] and not isinstance(package, mpmBinaryPackage):
+            full_path = os.path.join(CFG.MOUNT_POINT, package['path'])
+            if os.path.exists(full_path):
+                header = rhn_pkg.get_package_header(filename=full_path)
+                package.key_id = server_packages.get_package_key_id(header)
+                if package.key_id:
+                    self.package_keys[package.key_id] = None
+
     def _import_signatures(self):
         for package in self.batch:
-            # skip missing files and mpm packages
-            if package['path'] and not isinstance(package, mpmBinaryPackage):
-                full_path = os.path.join(CFG.MOUNT_POINT, package['path'])
-                if os.path.exists(full_path):
-                    header = rhn_pkg.get_package_header(filename=full_path)
-                    server_packages.processPackageKeyAssociations(header,
-                                                                  package['checksum_type'], package['checksum'])
+            if getattr(package, 'key_id', None):
+                server_packages.associate_package_key(self.package_keys[package.key_id],
+                                                      package['checksum_type'], package['checksum'])
 
     def _fix_encoding(self, text):
         if text is None:
@@ -28,7 +28,7 @@ class Channel:
         self.name = None
         self.checksum_type = None
 
-        self.num_packages = 0
+        self.package_ids = []
         self.packages = []
         self.errata = []
         self.updateinfo = None
@@ -36,6 +36,12 @@ class Channel:
         self.modules = None
 
 
+# Parts of a Package which can be loaded on their own, see store.PackageStore
+PACKAGE_DETAILS = "details"
+PACKAGE_FILES = "files"
+PACKAGE_CHANGELOG = "changelog"
+
+
 class Package:
 
     """ A pure data object representing an RHN Package. """
@@ -68,6 +74,7 @@ class Package:
 
         self.files = []
 
+        # Lists of (name, flag, epoch, version, release) tuples
         self.provides = []
         self.requires = []
         self.conflicts = []
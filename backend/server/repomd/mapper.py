@@ -19,6 +19,7 @@
 import os.path
 import re
 import time
+from itertools import islice
 
 from spacewalk.common import rhnCache
 from spacewalk.common.rhnConfig import CFG
@@ -26,10 +27,41 @@ from spacewalk.common.usix import UnicodeType
 from spacewalk.server import rhnSQL
 
 import domain
+import store
 
 
 CACHE_PREFIX = "/var/cache/rhn/"
 
+# Number of packages SqlBulkPackageMapper loads per round trip
+PACKAGE_CHUNK_SIZE = 500
+
+# Number of distinct dependencies a DependencyPool keeps
+DEPENDENCY_POOL_SIZE = 100000
+
+
+class ChannelPackageIds:
+
+    """
+    The ids of the packages in a channel, streamed from the db every time
+    they are iterated over.
+    """
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+
+    def __iter__(self):
+        h = rhnSQL.prepare("""
+        select
+            package_id
+        from
+            rhnChannelPackage
+        where
+            channel_id = :channel_id
+        """, streaming=1)
+        h.execute(channel_id=self.channel_id)
+        for row in h.iterate():
+            yield row[0]
+
 
 class ChannelMapper:
 
@@ -52,15 +84,6 @@ class ChannelMapper:
           and c.checksum_type_id = ct.id
         """)
 
-        self.channel_sql = rhnSQL.prepare("""
-        select
-            package_id
-        from
-            rhnChannelPackage
-        where
-            channel_id = :channel_id
-        """)
-
         self.last_modified_sql = rhnSQL.prepare("""
         select
             to_char(last_modified, 'YYYYMMDDHH24MISS') as last_modified
@@ -128,11 +151,8 @@ class ChannelMapper:
         channel.name = details[1]
         channel.checksum_type = details[2]
 
-        self.channel_sql.execute(channel_id=channel_id)
-        package_ids = self.channel_sql.fetchall()
-
-        channel.num_packages = len(package_ids)
-        channel.packages = self._package_generator(package_ids)
+        channel.package_ids = ChannelPackageIds(channel_id)
+        channel.packages = self._package_generator(channel.package_ids)
 
         channel.errata = self._erratum_generator(channel_id)
 
@@ -156,8 +176,14 @@ class ChannelMapper:
         return channel
 
     def _package_generator(self, package_ids):
+        if hasattr(self.pkg_mapper, 'get_packages'):
+            # Load the packages in chunks rather than one by one
+            for pkg in self.pkg_mapper.get_packages(package_ids):
+                yield pkg
+            return
+
         for package_id in package_ids:
-            pkg = self.pkg_mapper.get_package(package_id[0])
+            pkg = self.pkg_mapper.get_package(package_id)
             yield pkg
 
     def _erratum_generator(self, channel_id):
@@ -174,13 +200,7 @@ class CachedPackageMapper:
     """ Data Mapper for Packages to an on-disc cache. """
 
     def __init__(self, mapper):
-        cache = rhnCache.Cache()
-
-        # For more speed, we won't compress.
-        # cache = rhnCache.CompressedCache(cache)
-
-        cache = rhnCache.ObjectCache(cache)
-        self.cache = rhnCache.NullCache(cache)
+        self.store = store.PackageStore()
         self.mapper = mapper
 
     def get_package(self, package_id):
@@ -192,27 +212,92 @@ class CachedPackageMapper:
         """
         package_id = str(package_id)
 
-        last_modified = str(self.mapper.last_modified(package_id))
-        last_modified = last_modified.replace(" ", "")
-        last_modified = last_modified.replace(":", "")
-        last_modified = last_modified.replace("-", "")
+        last_modified = _cache_timestamp(self.mapper.last_modified(package_id))
 
-        cache_key = "repomd-packages/" + package_id
-        if self.cache.has_key(cache_key, last_modified):
-            package = self.cache.get(cache_key)
-        else:
+        package = self.store.get(package_id, last_modified)
+        if package is None:
             package = self.mapper.get_package(package_id)
-            self.cache.set(cache_key, package, last_modified)
+            self.store.set(package, last_modified)
 
         return package
 
+    def last_modified_bulk(self, package_ids):
+        """ Return a dict mapping package ids to their last_modified date. """
+        return self.mapper.last_modified_bulk(package_ids)
+
+    def prune(self):
+        """ Drop the packages deleted from the db from the cache, now and then. """
+        if hasattr(self.mapper, 'last_modified_bulk'):
+            self.store.prune(lambda x: self.mapper.last_modified_bulk(x).keys())
+
+    def get_packages(self, package_ids, sections=None):
+        """
+        Load the packages with ids package_ids, in the given order.
+
+        Packages found in the cache are loaded from there, with only the
+        given sections filled in. The rest is loaded in chunks from the
+        provided mapper. If the provided mapper can not load packages in
+        chunks, fall back to get_package.
+        """
+        if not hasattr(self.mapper, 'get_packages'):
+            for package_id in package_ids:
+                yield self.get_package(package_id)
+            return
+
+        if sections is None:
+            sections = store.PACKAGE_SECTIONS
+
+        for chunk in _chunks(package_ids, self.mapper.chunk_size):
+            last_modified = self.mapper.last_modified_bulk(chunk)
+            timestamps = dict([(str(x), _cache_timestamp(last_modified.get(int(x))))
+                               for x in chunk])
+
+            packages = self.store.get_many(list(timestamps.items()), sections)
+            missing = [str(x) for x in chunk if str(x) not in packages]
+
+            loaded = []
+            for package in self.mapper.get_packages(missing):
+                loaded.append((package, timestamps[package.id]))
+                packages[package.id] = package
+            self.store.set_many(loaded)
+
+            for package_id in chunk:
+                package = packages.get(str(package_id))
+                if package is not None:
+                    yield package
+
+
+class DependencyPool:
+
+    """
+    Parses prco rows into dependencies, sharing the equal ones.
+
+    A dependency is a (name, flag, epoch, version, release) tuple. Many
+    packages provide or require the very same things, so every distinct
+    dependency is parsed only once and the resulting tuple is shared
+    between all packages which have it. The pool is emptied once it holds
+    max_size dependencies, to keep its own memory bounded.
+    """
+
+    def __init__(self, max_size=DEPENDENCY_POOL_SIZE):
+        self.max_size = max_size
+        self._deps = {}
+
+    def get(self, sense, name, version):
+        key = (sense, name, version)
+        dep = self._deps.get(key)
+        if dep is None:
+            if len(self._deps) >= self.max_size:
+                self._deps.clear()
+            dep = self._deps[key] = _parse_dependency(sense, name, version)
+        return dep
+
 
 class SqlPackageMapper:
 
     """ Data Mapper for Packages to the RHN db. """
 
-    def __init__(self):
-        self.details_sql = rhnSQL.prepare("""
+    _query_details = """
         select
             pn.name,
             pevr.version,
@@ -235,7 +320,8 @@ class SqlPackageMapper:
             p.path,
             sr.name source_rpm,
             p.last_modified,
-            c.checksum_type
+            c.checksum_type,
+            p.id
         from
             rhnPackage p,
             rhnPackageName pn,
@@ -245,165 +331,188 @@ class SqlPackageMapper:
             rhnSourceRPM sr,
             rhnChecksumView c
         where
-            p.id = :package_id
+            p.id %(package_ids)s
         and p.name_id = pn.id
         and p.evr_id = pevr.id
         and p.package_arch_id = pa.id
         and p.package_group = pg.id
         and p.source_rpm_id = sr.id
         and p.checksum_id = c.id
-        """)
+        """
 
-        self.filelist_sql = rhnSQL.prepare("""
+    _query_filelist = """
         select
-            pc.name
+            pc.name,
+            pf.package_id
         from
             rhnPackageCapability pc,
             rhnPackageFile pf
         where
-            pf.package_id = :package_id
+            pf.package_id %(package_ids)s
         and pf.capability_id = pc.id
-        """)
+        """
 
-        self.prco_sql = rhnSQL.prepare("""
+    _query_prco = """
         select
            'provides',
            pp.sense,
            pc.name,
-           pc.version
+           pc.version,
+           pp.package_id
         from
            rhnPackageCapability pc,
            rhnPackageProvides pp
         where
-           pp.package_id = :package_id
+           pp.package_id %(package_ids)s
            and pp.capability_id = pc.id
         union all
         select
            'requires',
            pr.sense,
            pc.name,
-           pc.version
+           pc.version,
+           pr.package_id
         from
            rhnPackageCapability pc,
            rhnPackageRequires pr
         where
-           pr.package_id = :package_id
+           pr.package_id %(package_ids)s
            and pr.capability_id = pc.id
         union all
         select
            'recommends',
            prec.sense,
            pc.name,
-           pc.version
+           pc.version,
+           prec.package_id
         from
            rhnPackageCapability pc,
            rhnPackageRecommends prec
         where
-           prec.package_id = :package_id
+           prec.package_id %(package_ids)s
            and prec.capability_id = pc.id
         union all
         select
            'supplements',
            supp.sense,
            pc.name,
-           pc.version
+           pc.version,
+           supp.package_id
         from
            rhnPackageCapability pc,
            rhnPackageSupplements supp
         where
-           supp.package_id = :package_id
+           supp.package_id %(package_ids)s
            and supp.capability_id = pc.id
         union all
         select
            'enhances',
            enh.sense,
            pc.name,
-           pc.version
+           pc.version,
+           enh.package_id
         from
            rhnPackageCapability pc,
            rhnPackageEnhances enh
         where
-           enh.package_id = :package_id
+           enh.package_id %(package_ids)s
            and enh.capability_id = pc.id
         union all
         select
            'suggests',
            sugg.sense,
            pc.name,
-           pc.version
+           pc.version,
+           sugg.package_id
         from
            rhnPackageCapability pc,
            rhnPackageSuggests sugg
         where
-           sugg.package_id = :package_id
+           sugg.package_id %(package_ids)s
            and sugg.capability_id = pc.id
         union all
         select
            'conflicts',
            pcon.sense,
            pc.name,
-           pc.version
+           pc.version,
+           pcon.package_id
         from
            rhnPackageCapability pc,
            rhnPackageConflicts pcon
         where
-           pcon.package_id = :package_id
+           pcon.package_id %(package_ids)s
            and pcon.capability_id = pc.id
         union all
         select
            'obsoletes',
            po.sense,
            pc.name,
-           pc.version
+           pc.version,
+           po.package_id
         from
            rhnPackageCapability pc,
            rhnPackageObsoletes po
         where
-           po.package_id = :package_id
+           po.package_id %(package_ids)s
            and po.capability_id = pc.id
         union all
         select
            'breaks',
            brks.sense,
            pc.name,
-           pc.version
+           pc.version,
+           brks.package_id
         from
            rhnPackageCapability pc,
            rhnPackageBreaks brks
         where
-           brks.package_id = :package_id
+           brks.package_id %(package_ids)s
            and brks.capability_id = pc.id
         union all
         select
            'predepends',
            pdep.sense,
            pc.name,
-           pc.version
+           pc.version,
+           pdep.package_id
         from
            rhnPackageCapability pc,
            rhnPackagePredepends pdep
         where
-           pdep.package_id = :package_id
+           pdep.package_id %(package_ids)s
            and pdep.capability_id = pc.id
-        """)
+        """
 
-        self.last_modified_sql = rhnSQL.prepare("""
+    _query_last_modified = """
         select
-            to_char(last_modified, 'YYYYMMDDHH24MISS') as last_modified
+            to_char(last_modified, 'YYYYMMDDHH24MISS') as last_modified,
+            id
         from
             rhnPackage
-        where id = :package_id
-        """)
+        where id %(package_ids)s
+        """
 
-        self.other_sql = rhnSQL.prepare("""
+    _query_other = """
         select
             name,
             text,
-            time
+            time,
+            package_id
         from
             rhnPackageChangelog
-        where package_id = :package_id
-        """)
+        where package_id %(package_ids)s
+        """
+
+    def __init__(self):
+        single = {'package_ids': '= :package_id'}
+        self.details_sql = rhnSQL.prepare(self._query_details % single)
+        self.filelist_sql = rhnSQL.prepare(self._query_filelist % single)
+        self.prco_sql = rhnSQL.prepare(self._query_prco % single)
+        self.last_modified_sql = rhnSQL.prepare(self._query_last_modified % single)
+        self.other_sql = rhnSQL.prepare(self._query_other % single)
+
+        self.dependency_pool = DependencyPool()
 
     def last_modified(self, package_id):
         """ Get the last_modified date on the package with id package_id. """
@@ -435,7 +544,10 @@ class SqlPackageMapper:
         """ Load the packages basic details (summary, description, etc). """
         self.details_sql.execute(package_id=package.id)
         pkg = self.details_sql.fetchone()
+        self._set_package_details(package, pkg)
 
+    def _set_package_details(self, package, pkg):
+        """ Fill the package from a row of the details query. """
         package.name = pkg[0]
         package.version = pkg[1]
         package.release = pkg[2]
@@ -468,73 +580,34 @@ class SqlPackageMapper:
         deps = self.prco_sql.fetchall() or []
 
         for item in deps:
-            version = item[3] or ""
-            relation = ""
-            release = None
-            epoch = 0
-            if version:
-                sense = item[1] or 0
-                relation = SqlPackageMapper.__get_relation(sense)
-
-                vertup = version.split('-')
-                if len(vertup) > 1:
-                    version = vertup[0]
-                    release = vertup[1]
-
-                vertup = version.split(':')
-                if len(vertup) > 1:
-                    epoch = vertup[0]
-                    version = vertup[1]
-
-            dep = {'name': string_to_unicode(item[2]), 'flag': relation,
-                   'version': version, 'release': release, 'epoch': epoch}
-
-            if item[0] == "provides":
-                package.provides.append(dep)
-            elif item[0] == "requires":
-                package.requires.append(dep)
-            elif item[0] == "conflicts":
-                package.conflicts.append(dep)
-            elif item[0] == "obsoletes":
-                package.obsoletes.append(dep)
-            elif item[0] == "recommends":
-                package.recommends.append(dep)
-            elif item[0] == "supplements":
-                package.supplements.append(dep)
-            elif item[0] == "enhances":
-                package.enhances.append(dep)
-            elif item[0] == "suggests":
-                package.suggests.append(dep)
-            elif item[0] == "breaks":
-                package.breaks.append(dep)
-            elif item[0] == "predepends":
-                package.predepends.append(dep)
-            else:
-                assert False, "Unknown PRCO type: %s" % item[0]
-
-#    @staticmethod
-    def __get_relation(sense):
-        """ Convert the binary sense into a string. """
-
-        # Flip the bits for easy comparison
-        sense = sense & 0xf
-
-        if sense == 2:
-            relation = "LT"
-        elif sense == 4:
-            relation = "GT"
-        elif sense == 8:
-            relation = "EQ"
-        elif sense == 10:
-            relation = "LE"
-        elif sense == 12:
-            relation = "GE"
+            self._add_package_dep(package, item)
+
+    def _add_package_dep(self, package, item):
+        """ Add a single row of the prco query to the package. """
+        dep = self.dependency_pool.get(item[1], item[2], item[3])
+
+        if item[0] == "provides":
+            package.provides.append(dep)
+        elif item[0] == "requires":
+            package.requires.append(dep)
+        elif item[0] == "conflicts":
+            package.conflicts.append(dep)
+        elif item[0] == "obsoletes":
+            package.obsoletes.append(dep)
+        elif item[0] == "recommends":
+            package.recommends.append(dep)
+        elif item[0] == "supplements":
+            package.supplements.append(dep)
+        elif item[0] == "enhances":
+            package.enhances.append(dep)
+        elif item[0] == "suggests":
+            package.suggests.append(dep)
+        elif item[0] == "breaks":
+            package.breaks.append(dep)
+        elif item[0] == "predepends":
+            package.predepends.append(dep)
         else:
-            assert False, "Unknown relation sense: %s" % sense
-
-        return relation
-
-    __get_relation = staticmethod(__get_relation)
+            assert False, "Unknown PRCO type: %s" % item[0]
 
     def _fill_package_filelist(self, package):
         """ Load the package's list of files. """
@@ -551,12 +624,89 @@ class SqlPackageMapper:
         log_data = self.other_sql.fetchall() or []
 
         for data in log_data:
+            self._add_package_changelog(package, data)
+
+    def _add_package_changelog(self, package, data):
+        """ Add a single row of the changelog query to the package. """
+        date = oratimestamp_to_sinceepoch(data[2])
+
+        chglog = {'author': string_to_unicode(data[0]), 'date': date,
+                  'text': string_to_unicode(data[1])}
+        package.changelog.append(chglog)
+
+
+class SqlBulkPackageMapper(SqlPackageMapper):
+
+    """
+    Data Mapper for Packages to the RHN db, loading packages in chunks.
 
-            date = oratimestamp_to_sinceepoch(data[2])
+    Rather than running several queries per package, the details,
+    dependencies, files and changelogs of up to chunk_size packages are
+    loaded with a single query each.
+    """
 
-            chglog = {'author': string_to_unicode(data[0]), 'date': date,
-                      'text': string_to_unicode(data[1])}
-            package.changelog.append(chglog)
+    def __init__(self, chunk_size=PACKAGE_CHUNK_SIZE):
+        SqlPackageMapper.__init__(self)
+        self.chunk_size = chunk_size
+
+    def last_modified_bulk(self, package_ids):
+        """ Return a dict mapping package ids to their last_modified date. """
+        ret = {}
+        for chunk in _chunks(package_ids, self.chunk_size):
+            for row in self._execute_bulk(self._query_last_modified, chunk):
+                ret[int(row[1])] = row[0]
+        return ret
+
+    def get_packages(self, package_ids, sections=None):
+        """
+        Get the packages with ids package_ids, in the given order.
+
+        Only the given sections (see domain.PACKAGE_DETAILS etc.) are
+        loaded; by default all of them.
+        """
+        if sections is None:
+            sections = store.PACKAGE_SECTIONS
+        for chunk in _chunks(package_ids, self.chunk_size):
+            for package in self._get_packages_chunk(chunk, sections):
+                yield package
+
+    def _get_packages_chunk(self, package_ids, sections):
+        packages = {}
+        for package_id in package_ids:
+            packages[int(package_id)] = domain.Package(package_id)
+
+        loaded = set()
+        for row in self._execute_bulk(self._query_details, package_ids):
+            self._set_package_details(packages[int(row[22])], row)
+            loaded.add(int(row[22]))
+
+        for row in self._execute_bulk(self._query_prco, package_ids):
+            self._add_package_dep(packages[int(row[4])], row)
+
+        if domain.PACKAGE_FILES in sections:
+            for row in self._execute_bulk(self._query_filelist, package_ids):
+                packages[int(row[1])].files.append(string_to_unicode(row[0]))
+
+        if domain.PACKAGE_CHANGELOG in sections:
+            for row in self._execute_bulk(self._query_other, package_ids):
+                self._add_package_changelog(packages[int(row[3])], row)
+
+        # Packages that vanished in the meantime have no details row
+        return [packages[int(x)] for x in package_ids if int(x) in loaded]
+
+    @staticmethod
+    def _execute_bulk(query, package_ids):
+        """ Run query for the package_ids and return all its rows. """
+        params = {}
+        bind_params = []
+        for i, package_id in enumerate(package_ids):
+            params['p_%d' % i] = package_id
+            bind_params.append(':p_%d' % i)
+        bind_params = ', '.join(bind_params)
+
+        h = rhnSQL.prepare(query % {'package_ids': 'in (%s)' % bind_params})
+        h.execute(**params)
+        return h.fetchall() or []
 
 
 class CachedErratumMapper:
@@ -757,7 +907,7 @@ def get_channel_mapper():
 
 def get_package_mapper():
     """ Factory Method-ish function to load a Package Mapper. """
-    package_mapper = SqlPackageMapper()
+    package_mapper = SqlBulkPackageMapper()
     package_mapper = CachedPackageMapper(package_mapper)
 
     return package_mapper
@@ -771,6 +921,68 @@ def get_erratum_mapper(package_mapper):
     return erratum_mapper
 
 
+def _chunks(items, chunk_size):
+    """ Split the iterable items into lists of at most chunk_size elements. """
+    items = iter(items)
+    chunk = list(islice(items, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, chunk_size))
+
+
+def _cache_timestamp(last_modified):
+    """ Normalize a last_modified value into a YYYYMMDDHHMISS string. """
+    last_modified = str(last_modified)
+    last_modified = last_modified.replace(" ", "")
+    last_modified = last_modified.replace(":", "")
+    last_modified = last_modified.replace("-", "")
+    return last_modified
+
+
+def _parse_dependency(sense, name, version):
+    """ Return the (name, flag, epoch, version, release) tuple of a prco row. """
+    version = version or ""
+    relation = ""
+    release = None
+    epoch = 0
+    if version:
+        relation = _get_relation(sense or 0)
+
+        vertup = version.split('-')
+        if len(vertup) > 1:
+            version = vertup[0]
+            release = vertup[1]
+
+        vertup = version.split(':')
+        if len(vertup) > 1:
+            epoch = vertup[0]
+            version = vertup[1]
+
+    return (string_to_unicode(name), relation, epoch, version, release)
+
+
+def _get_relation(sense):
+    """ Convert the binary sense into a string. """
+
+    # Flip the bits for easy comparison
+    sense = sense & 0xf
+
+    if sense == 2:
+        relation = "LT"
+    elif sense == 4:
+        relation = "GT"
+    elif sense == 8:
+        relation = "EQ"
+    elif sense == 10:
+        relation = "LE"
+    elif sense == 12:
+        relation = "GE"
+    else:
+        assert False, "Unknown relation sense: %s" % sense
+
+    return relation
+
+
 def oratimestamp_to_sinceepoch(ts):
     return time.mktime((ts.year, ts.month, ts.day, ts.hour, ts.minute,
                         ts.second, 0, 0, -1))
@@ -16,33 +16,51 @@
 #   Classes for generating repository metadata from RHN info.
 #
 
+import sys
 import time
 try:
     #  python 2
     import StringIO
+    from Queue import Queue, Empty
 except ImportError:
     #  python3
     import io as StringIO
+    from queue import Queue, Empty
 import shutil
 import os.path
+import tempfile
+from itertools import islice
+from threading import Thread
 
 from gzip import GzipFile
 from gzip import write32u
 
-from spacewalk.common.usix import LongType
+from spacewalk.common.usix import LongType, raise_with_tb
 from spacewalk.common import checksum
 from spacewalk.common import rhnCache
 from spacewalk.common.rhnLog import log_debug
 from spacewalk.common.rhnConfig import CFG
 
 import mapper
+import store
 import view
 from domain import RepoMD
-from spacewalk.server import rhnChannel
+from spacewalk.server import rhnChannel, rhnSQL
 
 # One meg
 CHUNK_SIZE = 1048576
 
+# Number of package chunks a repodata generation stage may get ahead of
+# the next one
+PIPELINE_QUEUE_SIZE = 4
+
+# Put into a pipeline queue after the last item
+PIPELINE_END = object()
+
+# Put into a pipeline queue instead of PIPELINE_END when an earlier stage
+# failed
+PIPELINE_ABORT = object()
+
 comps_mapping = {
     'rhel-x86_64-client-5': 'rhn/kickstart/ks-rhel-x86_64-client-5/Client/repodata/comps-rhel5-client-core.xml',
     'rhel-x86_64-client-vt-5': 'rhn/kickstart/ks-rhel-x86_64-client-5/VT/repodata/comps-rhel5-vt.xml',
@@ -75,9 +93,11 @@ class Repository(object):
         self.updateinfo_prefix = "repomd_updateinfo.xml"
 
         self._channel = None
+        self._package_mapper = None
 
         cache = rhnCache.Cache()
         self.cache = rhnCache.NullCache(cache)
+        self.fragment_store = store.PackageStore()
 
     def get_primary_xml_file(self):
         """ Return a file-like object of the primarl.xml for this channel. """
@@ -140,6 +160,13 @@ class Repository(object):
     def get_cache_view(self, cache_prefix, view_class):
         cache_entry = self.get_cache_entry_name(cache_prefix)
         ret = self.cache.set_file(cache_entry, self.last_modified)
+
+        # Compress while writing, rather than re-reading the file afterwards
+        # in CompressedRepository
+        gz_cache_entry = self.get_cache_entry_name(cache_prefix + ".gz")
+        gz_ret = self.cache.set_file(gz_cache_entry, self.last_modified)
+        ret = CompressingFile(ret, gz_ret)
+
         viewobj = view_class(self.channel, ret)
         return viewobj
 
@@ -187,25 +214,296 @@ class Repository(object):
         return self.get_repomd_file(self.channel.modules, 'get_modules_file')
 
     def generate_files(self, views):
-        for view in views:
-            view.write_start()
-
-        for package in self.channel.packages:
-            for view in views:
-                view.write_package(package)
+        if hasattr(self.package_mapper, 'last_modified_bulk'):
+            self._generate_pipelined(views)
+            if hasattr(self.package_mapper, 'prune'):
+                self.package_mapper.prune()
+        else:
+            spools = [FragmentSpool(view) for view in views]
+            try:
+                for package in self.channel.packages:
+                    for spool in spools:
+                        spool.write_package(package)
+                for spool in spools:
+                    spool.write_view()
+            finally:
+                for spool in spools:
+                    spool.close()
 
         for view in views:
-            view.write_end()
             view.fileobj.close()
 
+    def _generate_pipelined(self, views):
+        """
+        Write the packages to views in a pipeline of three stages.
+
+        A PackageFetcher thread loads packages (or their stored fragments)
+        from the db, this thread renders them, and a FragmentWriter thread
+        per view writes and compresses the fragments.
+        """
+        fragment_names = [viewobj.fragment_name for viewobj in views]
+        fetcher = PackageFetcher(self._package_items(views))
+        writers = [FragmentWriter(viewobj) for viewobj in views]
+
+        fetcher.start()
+        for writer in writers:
+            writer.start()
+
+        end = PIPELINE_ABORT
+        try:
+            items = fetcher.queue.get()
+            while items is not PIPELINE_END:
+                rendered = [self._render_package(views, x) for x in items]
+                # Keep what was rendered for the next time the package is needed
+                self.fragment_store.set_fragments(
+                    [(x[0], x[1], dict(zip(fragment_names, y)))
+                     for x, y in zip(items, rendered) if x[2] is None])
+                for i, writer in enumerate(writers):
+                    writer.queue.put([x[i] for x in rendered])
+                items = fetcher.queue.get()
+            fetcher.finish()
+            end = PIPELINE_END
+        finally:
+            fetcher.abort()
+            for writer in writers:
+                writer.queue.put(end)
+
+        for writer in writers:
+            writer.finish()
+
+    def _render_package(self, views, item):
+        """ Return the fragments of views for an item of _package_items. """
+        fragments, package = item[2:]
+        if fragments is None:
+            fragments = [view.get_fragment(package) for view in views]
+        return fragments
+
+    def _package_items(self, views):
+        """
+        Yield lists of (package_id, last_modified, fragments, package) for
+        the packages of the channel, one list per chunk, in channel order.
+
+        Fragments of packages which did not change since they were last
+        rendered come from the fragment store and package is None; only the
+        other packages are loaded from the db, with fragments set to None.
+        """
+        # Load only the parts of the packages the views need
+        sections = []
+        for viewobj in views:
+            sections.extend([x for x in viewobj.package_sections if x not in sections])
+        fragment_names = [viewobj.fragment_name for viewobj in views]
+
+        package_ids = iter(self.channel.package_ids)
+        chunk = list(islice(package_ids, mapper.PACKAGE_CHUNK_SIZE))
+        while chunk:
+            last_modified = self.package_mapper.last_modified_bulk(chunk)
+            # Packages missing from last_modified are gone meanwhile
+            present = [x for x in [int(y) for y in chunk] if x in last_modified]
+
+            fragments = self.fragment_store.get_fragments(
+                [(x, last_modified[x]) for x in present], fragment_names)
+            missing = [x for x in present if x not in fragments]
+
+            log_debug(4, "Rendering %d of %d packages" % (len(missing), len(chunk)),
+                      self.channel_id)
+            packages = {}
+            for package in self.package_mapper.get_packages(missing, sections):
+                packages[int(package.id)] = package
+
+            items = []
+            for package_id in chunk:
+                package_id = int(package_id)
+                if package_id in fragments:
+                    items.append((package_id, last_modified[package_id],
+                                  fragments[package_id], None))
+                elif package_id in packages:
+                    items.append((package_id, last_modified[package_id], None,
+                                  packages[package_id]))
+            yield items
+            chunk = list(islice(package_ids, mapper.PACKAGE_CHUNK_SIZE))
+
     def __get_channel(self):
         """ Late binding for the channel. """
         if self._channel is None:
             channel_mapper = mapper.get_channel_mapper()
             self._channel = channel_mapper.get_channel(self.channel_id)
+            self._package_mapper = channel_mapper.pkg_mapper
         return self._channel
 
+    def __get_package_mapper(self):
+        """ The package mapper the channel was loaded with. """
+        if self._package_mapper is None:
+            self.__get_channel()
+        return self._package_mapper
+
     channel = property(__get_channel)
+    package_mapper = property(__get_package_mapper)
+
+
+class PipelineStage(Thread):
+
+    """
+    A stage of the repodata generation pipeline, running in its own thread.
+
+    Stages hand over chunks of packages through bounded queues, so no stage
+    gets more than PIPELINE_QUEUE_SIZE chunks ahead of the next one. An exception
+    raised by the stage is re-raised by finish().
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.queue = Queue(PIPELINE_QUEUE_SIZE)
+        self.error = None
+
+    def run(self):
+        try:
+            self.process()
+        except:  # pylint: disable=W0702
+            self.error = sys.exc_info()
+
+    def process(self):
+        raise NotImplementedError
+
+    def finish(self):
+        self.join()
+        if self.error is not None:
+            raise_with_tb(self.error[1], self.error[2])
+
+
+class PackageFetcher(PipelineStage):
+
+    """
+    Pipeline stage putting the items of a generator into its queue.
+
+    The generator runs the db queries in this thread. With pooled
+    connections the thread gets a connection of its own, given back once
+    it is done, so it reads in a transaction separate from, and possibly
+    seeing a newer snapshot than, the one the channel was loaded in.
+    """
+
+    def __init__(self, items):
+        PipelineStage.__init__(self)
+        self.items = items
+        self.aborted = False
+
+    def process(self):
+        try:
+            for item in self.items:
+                if self.aborted:
+                    break
+                self.queue.put(item)
+        finally:
+            try:
+                rhnSQL.release()
+            finally:
+                self.queue.put(PIPELINE_END)
+
+    def abort(self):
+        """ Stop fetching, e.g. because the consumer failed. """
+        self.aborted = True
+        # Make room in case the thread waits on a full queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+
+
+class FragmentWriter(PipelineStage):
+
+    """
+    Pipeline stage writing the lists of fragments in its queue to a view.
+
+    The view is written once PIPELINE_END comes through; until then the
+    fragments go to a FragmentSpool.
+    """
+
+    def __init__(self, viewobj):
+        PipelineStage.__init__(self)
+        self.spool = FragmentSpool(viewobj)
+
+    def run(self):
+        PipelineStage.run(self)
+        if self.error is not None:
+            # Keep consuming so the producer never waits on a full queue
+            fragments = self.queue.get()
+            while fragments is not PIPELINE_END and fragments is not PIPELINE_ABORT:
+                fragments = self.queue.get()
+
+    def process(self):
+        try:
+            fragments = self.queue.get()
+            while fragments is not PIPELINE_END and fragments is not PIPELINE_ABORT:
+                for fragment in fragments:
+                    self.spool.write_fragment(fragment)
+                fragments = self.queue.get()
+            if fragments is PIPELINE_END:
+                self.spool.write_view()
+        finally:
+            self.spool.close()
+
+
+class FragmentSpool:
+
+    """
+    Temporary file collecting the package fragments of a view.
+
+    The header of primary.xml etc. names the number of packages, which is
+    only known once all of them are rendered: packages may be removed from
+    the channel while its repodata is generated. So the fragments are
+    counted as they are spooled, and copied to the view after its header
+    by write_view().
+    """
+
+    def __init__(self, viewobj):
+        self.view = viewobj
+        self.fileobj = tempfile.TemporaryFile(mode="w+")
+        self.num_packages = 0
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+        self.num_packages += 1
+
+    def write_package(self, package):
+        self.write_fragment(self.view.get_fragment(package))
+
+    def write_view(self):
+        """ Write the view's header, the spooled fragments and its end. """
+        self.view.write_start(self.num_packages)
+        self.fileobj.seek(0)
+        chunk = self.fileobj.read(CHUNK_SIZE)
+        while chunk:
+            self.view.write_fragment(chunk)
+            chunk = self.fileobj.read(CHUNK_SIZE)
+        self.view.write_end()
+
+    def close(self):
+        self.fileobj.close()
+
+
+class CompressingFile:
+
+    """
+    File-like object writing everything to a file and, gzip compressed, to
+    a second file.
+
+    The compressed file is the same as CompressedRepository would produce.
+    """
+
+    def __init__(self, fileobj, gz_fileobj):
+        self.fileobj = fileobj
+        self.gz_fileobj = gz_fileobj
+        self.gzip_file = NoTimeStampGzipFile(mode="wb", fileobj=gz_fileobj)
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.gzip_file.write(data)
+
+    def close(self):
+        self.gzip_file.close()
+        self.gz_fileobj.close()
+        self.fileobj.close()
 
 
 class CompressedRepository:
@@ -0,0 +1,458 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+#   Packed on-disc store for repomd packages.
+#
+
+import fcntl
+import marshal
+import mmap
+import os
+import threading
+import time
+
+from spacewalk.common import rhnCache
+from spacewalk.common.fileutils import makedirs
+
+import domain
+from domain import PACKAGE_DETAILS, PACKAGE_FILES, PACKAGE_CHANGELOG
+
+PACKAGE_SECTIONS = (PACKAGE_DETAILS, PACKAGE_FILES, PACKAGE_CHANGELOG)
+
+# Packages are spread over this many buckets by id
+NUM_BUCKETS = 64
+
+# A bucket's data file is compacted once it holds more than this many bytes
+# of replaced records, and more of them than live ones
+MIN_GARBAGE = 4 * 1048576
+
+# Packages deleted from the db are dropped from the store at most this often
+PRUNE_INTERVAL = 24 * 3600
+
+# fcntl locks do not exclude the threads of a process from each other, so
+# writers also take a thread lock per bucket, shared by all PackageStores
+_bucket_locks = {}
+_bucket_locks_lock = threading.Lock()
+
+_DETAILS_ATTRIBUTES = (
+    'name', 'version', 'release', 'epoch', 'arch',
+    'checksum', 'checksum_type', 'summary', 'description', 'vendor',
+    'build_time', 'package_size', 'payload_size', 'installed_size',
+    'header_start', 'header_end', 'package_group', 'build_host',
+    'copyright', 'filename', 'source_rpm',
+    'provides', 'requires', 'conflicts', 'obsoletes', 'supplements',
+    'enhances', 'suggests', 'recommends',
+)
+
+
+def _pack(package, section):
+    """ Return the marshallable value of a section of the package. """
+    if section == PACKAGE_DETAILS:
+        return tuple([getattr(package, x) for x in _DETAILS_ATTRIBUTES])
+    elif section == PACKAGE_FILES:
+        return package.files
+    elif section == PACKAGE_CHANGELOG:
+        return package.changelog
+    assert False, "Unknown package section: %s" % section
+
+
+def _unpack(package, section, value):
+    """ Fill a section of the package from the value _pack returned. """
+    if section == PACKAGE_DETAILS:
+        for attribute, attribute_value in zip(_DETAILS_ATTRIBUTES, value):
+            setattr(package, attribute, attribute_value)
+    elif section == PACKAGE_FILES:
+        package.files = value
+    elif section == PACKAGE_CHANGELOG:
+        package.changelog = value
+    else:
+        assert False, "Unknown package section: %s" % section
+
+
+def _fragment_section(fragment_name):
+    """ Return the section a package's fragment_name XML fragment is kept in. """
+    return "fragment-%s" % fragment_name
+
+
+def _bucket_lock(lock_path):
+    """ Return the thread lock of the bucket with the lock file lock_path. """
+    _bucket_locks_lock.acquire()
+    try:
+        if lock_path not in _bucket_locks:
+            _bucket_locks[lock_path] = threading.Lock()
+        return _bucket_locks[lock_path]
+    finally:
+        _bucket_locks_lock.release()
+
+
+class PackageStore:
+
+    """
+    On-disc store of domain.Package objects, packed into a few files.
+
+    Packages are spread over buckets by id. A bucket consists of an
+    append-only data file holding the marshalled sections of its packages
+    and an index mapping each package id to its last_modified date and the
+    position of every section in the data file. Sections are loaded one by
+    one, so e.g. generating primary.xml never reads changelogs.
+
+    Besides the package itself, the XML fragments the repomd views render
+    for it are kept as sections of their own, see get_fragments.
+
+    Readers memory-map the data file and take no locks. Writers lock the
+    bucket, append to the data file and atomically replace the index.
+    """
+
+    def __init__(self, path=None, num_buckets=NUM_BUCKETS):
+        if path is None:
+            path = os.path.join(rhnCache.CACHEDIR, "repomd-package-store")
+        self.path = path
+        self.num_buckets = num_buckets
+        self._buckets = {}
+
+    def _bucket(self, package_id):
+        return self._get_bucket(int(package_id) % self.num_buckets)
+
+    def _get_bucket(self, number):
+        if number not in self._buckets:
+            self._buckets[number] = _Bucket(self.path, number)
+        return self._buckets[number]
+
+    def get(self, package_id, last_modified, sections=PACKAGE_SECTIONS):
+        """ Return the package, or None if it is not stored or stale. """
+        return self.get_many([(package_id, last_modified)], sections).get(package_id)
+
+    def get_many(self, packages, sections=PACKAGE_SECTIONS):
+        """
+        Load a list of (package_id, last_modified) tuples.
+
+        Return a dict mapping the ids of the packages found to the packages,
+        with only the given sections filled in.
+        """
+        ret = {}
+        for package_id, values in self._get_sections(packages, sections).items():
+            package = domain.Package(package_id)
+            for section in sections:
+                _unpack(package, section, values[section])
+            ret[package_id] = package
+        return ret
+
+    def set(self, package, last_modified):
+        self.set_many([(package, last_modified)])
+
+    def set_many(self, packages):
+        """ Store a list of (package, last_modified) tuples. """
+        self._set_sections([(package.id, last_modified,
+                             dict([(x, _pack(package, x)) for x in PACKAGE_SECTIONS]))
+                            for package, last_modified in packages])
+
+    def get_fragments(self, packages, fragment_names):
+        """
+        Load the XML fragments rendered for a list of (package_id,
+        last_modified) tuples.
+
+        Return a dict mapping the ids of the packages which have all the
+        fragments to the list of their fragments, in fragment_names order.
+        """
+        sections = [_fragment_section(x) for x in fragment_names]
+        ret = {}
+        for package_id, values in self._get_sections(packages, sections).items():
+            ret[package_id] = [values[x] for x in sections]
+        return ret
+
+    def set_fragments(self, items):
+        """
+        Store a list of (package_id, last_modified, fragments) tuples, with
+        fragments a dict mapping fragment names to fragments.
+
+        The fragments are kept along with the package, and whatever else
+        was stored for the package at the same last_modified date.
+        """
+        self._set_sections([(package_id, last_modified,
+                             dict([(_fragment_section(x), y) for x, y in fragments.items()]))
+                            for package_id, last_modified, fragments in items])
+
+    def prune(self, existing):
+        """
+        Drop the packages which no longer exist from the store.
+
+        existing is called with a list of the stored package ids and returns
+        those still in the db. This goes through every bucket, so it is done
+        at most once every PRUNE_INTERVAL seconds; return whether it was.
+        """
+        stamp_path = os.path.join(self.path, "pruned")
+        try:
+            if time.time() - os.stat(stamp_path).st_mtime < PRUNE_INTERVAL:
+                return False
+        except OSError:
+            if not os.path.isdir(self.path):
+                # Nothing stored yet
+                return False
+        # Claim this round before the slow part, so other processes skip it
+        open(stamp_path, 'w').close()
+
+        for number in range(self.num_buckets):
+            bucket = self._get_bucket(number)
+            package_ids = bucket.package_ids()
+            if not package_ids:
+                continue
+            gone = set(package_ids) - set([int(x) for x in existing(package_ids)])
+            if gone:
+                bucket.delete_many(gone)
+        return True
+
+    def _get_sections(self, packages, sections):
+        by_bucket = {}
+        for package_id, last_modified in packages:
+            by_bucket.setdefault(self._bucket(package_id), []).append(
+                (package_id, last_modified))
+
+        ret = {}
+        for bucket, items in by_bucket.items():
+            ret.update(bucket.get_many(items, sections))
+        return ret
+
+    def _set_sections(self, records):
+        by_bucket = {}
+        for record in records:
+            by_bucket.setdefault(self._bucket(record[0]), []).append(record)
+
+        for bucket, items in by_bucket.items():
+            bucket.set_many(items)
+
+
+class _Bucket:
+
+    """ A single data file and its index. """
+
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.index_path = os.path.join(path, "%03d.idx" % number)
+        self.lock_path = os.path.join(path, "%03d.lock" % number)
+        self.thread_lock = _bucket_lock(self.lock_path)
+
+        # The index is kept in memory until the file on disc changes
+        self._index_stat = None
+        self._index = self._empty_index()
+        self._data = None
+
+    @staticmethod
+    def _empty_index():
+        return {'generation': 0, 'garbage': 0, 'packages': {}}
+
+    def _data_path(self, generation):
+        return os.path.join(self.path, "%03d.%d.dat" % (self.number, generation))
+
+    def _refresh(self):
+        """ Reload the index if it was replaced since it was last read. """
+        try:
+            st = os.stat(self.index_path)
+        except OSError:
+            # Nothing stored yet, or the cache was wiped
+            self._index_stat = None
+            self._index = self._empty_index()
+            self._data = None
+            return
+        index_stat = (st.st_ino, st.st_mtime, st.st_size)
+        if index_stat == self._index_stat:
+            return
+
+        index_file = open(self.index_path, 'rb')
+        try:
+            self._index = marshal.load(index_file)
+        finally:
+            index_file.close()
+        self._index_stat = index_stat
+        self._data = None
+
+    def _get_data(self):
+        """ Return the memory-mapped data file, None if it is gone. """
+        if self._data is None:
+            try:
+                data_file = open(self._data_path(self._index['generation']), 'rb')
+            except IOError:
+                # Compacted meanwhile; a later _refresh picks up the new file
+                self._index_stat = None
+                return None
+            try:
+                if os.fstat(data_file.fileno()).st_size == 0:
+                    return None
+                self._data = mmap.mmap(data_file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            finally:
+                data_file.close()
+        return self._data
+
+    def package_ids(self):
+        """ Return the ids of the packages in the bucket. """
+        self._refresh()
+        return list(self._index['packages'].keys())
+
+    def get_many(self, items, sections):
+        """
+        Return a dict mapping the package ids of the (package_id,
+        last_modified) items which have all the sections stored for that
+        last_modified date to a dict of the sections' values.
+        """
+        self._refresh()
+
+        ret = {}
+        packages = self._index['packages']
+        for package_id, last_modified in items:
+            entry = packages.get(int(package_id))
+            if entry is None or entry[0] != last_modified:
+                continue
+            if [x for x in sections if x not in entry[1]]:
+                continue
+            data = self._get_data()
+            if data is None:
+                break
+
+            values = {}
+            for section in sections:
+                offset, length = entry[1][section]
+                values[section] = marshal.loads(data[offset:offset + length])
+            ret[package_id] = values
+        return ret
+
+    def set_many(self, items):
+        """
+        Store a list of (package_id, last_modified, sections) tuples, with
+        sections a dict mapping section names to their values.
+
+        Sections stored before for the same last_modified date are kept,
+        unless they are given again; all of them are dropped if the
+        last_modified date changed.
+        """
+        self._update(lambda index: self._append(index, items))
+
+    def delete_many(self, package_ids):
+        """ Drop the packages with the given ids. """
+        self._update(lambda index: self._delete(index, package_ids))
+
+    def _update(self, func):
+        """ Call func with the current index under the lock, then write it. """
+        if not os.path.isdir(self.path):
+            makedirs(self.path, int('0755', 8), 'root', 'root')
+
+        self.thread_lock.acquire()
+        try:
+            lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, int('0644', 8))
+            try:
+                fcntl.lockf(lock_fd, fcntl.LOCK_EX)
+                # Someone else may have written to the bucket meanwhile
+                self._refresh()
+                index = self._index
+
+                if index['garbage'] > MIN_GARBAGE and \
+                        index['garbage'] > self._data_size() - index['garbage'] and \
+                        self._get_data() is not None:
+                    index = self._compact()
+
+                # Readers in other threads may still be using the old index
+                index = {'generation': index['generation'],
+                         'garbage': index['garbage'],
+                         'packages': index['packages'].copy()}
+                func(index)
+                self._write_index(index)
+            finally:
+                fcntl.lockf(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+        finally:
+            self.thread_lock.release()
+
+    def _append(self, index, items):
+        data_file = open(self._data_path(index['generation']), 'ab')
+        try:
+            data_file.seek(0, 2)
+            offset = data_file.tell()
+            for package_id, last_modified, values in items:
+                try:
+                    blobs = [(x, marshal.dumps(y)) for x, y in values.items()]
+                except ValueError:
+                    # Not marshallable; just don't store it
+                    continue
+
+                old_entry = index['packages'].get(int(package_id))
+                sections = {}
+                if old_entry is not None:
+                    if old_entry[0] == last_modified:
+                        sections.update(old_entry[1])
+                    for section, (_offset, length) in old_entry[1].items():
+                        if section not in sections or section in values:
+                            index['garbage'] = index['garbage'] + length
+
+                for section, blob in blobs:
+                    data_file.write(blob)
+                    sections[section] = (offset, len(blob))
+                    offset = offset + len(blob)
+                index['packages'][int(package_id)] = (last_modified, sections)
+        finally:
+            data_file.close()
+
+    @staticmethod
+    def _delete(index, package_ids):
+        for package_id in package_ids:
+            entry = index['packages'].pop(int(package_id), None)
+            if entry is not None:
+                index['garbage'] = index['garbage'] + \
+                    sum([x[1] for x in entry[1].values()])
+
+    def _data_size(self):
+        try:
+            return os.stat(self._data_path(self._index['generation'])).st_size
+        except OSError:
+            return 0
+
+    def _compact(self):
+        """ Copy the live records into a new data file; return the new index. """
+        data = self._get_data()
+        generation = self._index['generation'] + 1
+        packages = {}
+
+        data_file = open(self._data_path(generation), 'wb')
+        try:
+            offset = 0
+            for package_id, (last_modified, sections) in self._index['packages'].items():
+                new_sections = {}
+                for section, (old_offset, length) in sections.items():
+                    data_file.write(data[old_offset:old_offset + length])
+                    new_sections[section] = (offset, length)
+                    offset = offset + length
+                packages[package_id] = (last_modified, new_sections)
+        finally:
+            data_file.close()
+
+        old_generation = self._index['generation']
+        index = {'generation': generation, 'garbage': 0, 'packages': packages}
+        self._write_index(index)
+        # Readers still mapping the old file keep it until they are done
+        os.unlink(self._data_path(old_generation))
+        return index
+
+    def _write_index(self, index):
+        tmp_path = "%s.%d.%d" % (self.index_path, os.getpid(),
+                                 threading.current_thread().ident)
+        index_file = open(tmp_path, 'wb')
+        try:
+            marshal.dump(index, index_file)
+        finally:
+            index_file.close()
+        os.rename(tmp_path, self.index_path)
+
+        self._index_stat = None
+        self._index = index
+        self._data = None
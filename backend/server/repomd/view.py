@@ -14,6 +14,8 @@
 #
 import re
 
+from domain import PACKAGE_DETAILS, PACKAGE_FILES, PACKAGE_CHANGELOG
+
 XML_ENCODING = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
 
 
@@ -89,24 +91,29 @@ class RepoView:
 
 class PrimaryView(object):
 
+    # Name under which rendered packages are stored in the fragment cache
+    fragment_name = "primary"
+
+    # Parts of the packages the view renders
+    package_sections = (PACKAGE_DETAILS, PACKAGE_FILES)
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
 
     def _get_deps(self, deps):
         output = []
-        for dep in deps:
-            if dep['flag']:
+        for name, flag, epoch, version, release in deps:
+            if flag:
                 line = "        <rpm:entry name=\"%s\" flags=\"%s\" \
-                        epoch=\"%s\" ver=\"%s\" " % (dep['name'], dep['flag'],
-                                                     dep['epoch'], dep['version'])
-                if dep['release']:
-                    line += "rel=\"%s\" " % dep['release']
+                        epoch=\"%s\" ver=\"%s\" " % (name, flag, epoch, version)
+                if release:
+                    line += "rel=\"%s\" " % release
                 line += "/>"
                 output.append(line)
             else:
                 output.append("         <rpm:entry name=\"%s\" />"
-                              % (text_filter(dep['name'])))
+                              % (text_filter(name)))
         return output
 
     def _get_files(self, files):
@@ -194,16 +201,22 @@ class PrimaryView(object):
 
         return output
 
-    def write_start(self):
+    def write_start(self, num_packages):
         output = XML_ENCODING + "\n" + \
             "<metadata xmlns=\"http://linux.duke.edu/metadata/common\" " + \
             "xmlns:rpm=\"http://linux.duke.edu/metadata/rpm\" " + \
-            "packages=\"%d\">" % self.channel.num_packages
+            "packages=\"%d\">" % num_packages
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</metadata>")
@@ -211,6 +224,12 @@ class PrimaryView(object):
 
 class FilelistsView(object):
 
+    # Name under which rendered packages are stored in the fragment cache
+    fragment_name = "filelists"
+
+    # Parts of the packages the view renders
+    package_sections = (PACKAGE_DETAILS, PACKAGE_FILES)
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
@@ -227,15 +246,21 @@ class FilelistsView(object):
         output.append("  </package>")
         return output
 
-    def write_start(self):
+    def write_start(self, num_packages):
         output = XML_ENCODING + "\n" + \
             "<filelists xmlns=\"http://linux.duke.edu/metadata/filelists\" " + \
-            "packages=\"%d\">" % self.channel.num_packages
+            "packages=\"%d\">" % num_packages
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</filelists>")
@@ -243,6 +268,12 @@ class FilelistsView(object):
 
 class OtherView(object):
 
+    # Name under which rendered packages are stored in the fragment cache
+    fragment_name = "other"
+
+    # Parts of the packages the view renders
+    package_sections = (PACKAGE_DETAILS, PACKAGE_CHANGELOG)
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
@@ -263,15 +294,21 @@ class OtherView(object):
         output.append("  </package>")
         return output
 
-    def write_start(self):
+    def write_start(self, num_packages):
         output = XML_ENCODING + "\n" + \
             "<otherdata xmlns=\"http://linux.duke.edu/metadata/other\" " + \
-            "packages=\"%d\">" % self.channel.num_packages
+            "packages=\"%d\">" % num_packages
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</otherdata>")
@@ -20,6 +20,7 @@ import sys
 
 # common module
 from spacewalk.common import rhnFlags
+from spacewalk.common.checksum import getStringChecksum
 from spacewalk.common.rhnLog import log_debug
 
 # local module
@@ -59,12 +60,30 @@ def get_client_capabilities():
     return rhnFlags.get('client-capabilities')
 
 
-def update_client_capabilities(server_id):
+def client_capabilities_digest(caps):
+    """ Digest of what update_client_capabilities() stores of caps: the names
+        and versions of the capabilities """
+    caps = ["%s(%s)" % (name, caps[name]['version']) for name in sorted(caps.keys())]
+    return getStringChecksum('sha256', string.join(caps, "\n"))
+
+
+def update_client_capabilities(server_id, known_digest=None):
+    """ Syncs the capabilities the client presented with the database.
+
+        known_digest is the capabilities_digest of the server as loaded with
+        the server; if the client presented the same capabilities as last
+        time, there is nothing to do.
+    """
     caps = get_client_capabilities()
 
     if caps is None:
         caps = {}
 
+    digest = client_capabilities_digest(caps)
+    if known_digest is not None and known_digest == digest:
+        log_debug(4, "Client capabilities unchanged", server_id)
+        return
+
     caps = caps.copy()
 
     h = rhnSQL.prepare("""
@@ -139,6 +158,13 @@ def update_client_capabilities(server_id):
         """)
         h.executemany(**inserts)
 
+    h = rhnSQL.prepare("""
+        update rhnServer
+        set capabilities_digest = :digest
+        where id = :server_id
+    """)
+    h.execute(server_id=server_id, digest=digest)
+
     # Commit work. This can be dangerous if there is previously uncommited
     # work
     rhnSQL.commit()
@@ -164,6 +190,7 @@ def _set_server_capabilities():
         'registration.remaining_subscriptions': {'version': 1, 'value': 1},
         'registration.update_contact_info': {'version': 1, 'value': 1},
         'registration.delta_packages': {'version': 1, 'value': 1},
+        'registration.sync_packages': {'version': 1, 'value': 1},
         'registration.extended_update_support': {'version': 1, 'value': 1},
         'registration.smbios': {'version': 1, 'value': 1},
         'registration.update_systemid': {'version': 1, 'value': 1},
@@ -1118,16 +1118,14 @@ _query_all_packages_from_channel_checksum = """
 
 def list_all_packages_checksum_sql(channel_id):
     log_debug(3, channel_id)
-    h = rhnSQL.prepare(_query_all_packages_from_channel_checksum)
+    h = rhnSQL.prepare(_query_all_packages_from_channel_checksum, streaming=1)
     h.execute(channel_id=str(channel_id))
-    ret = h.fetchall_dict()
-    if not ret:
-        return []
-    # process the results
-    ret = [(a["name"], a["version"], a["release"], a["epoch"],
-                         a["arch"], a["package_size"], a['checksum_type'],
-                         a['checksum']) for a in __stringify(ret)]
-    return ret
+    # process the results as they come
+    for a in h.iterate_dict():
+        a = __stringify(a)
+        yield (a["name"], a["version"], a["release"], a["epoch"],
+               a["arch"], a["package_size"], a['checksum_type'],
+               a['checksum'])
 
 # This function executes the SQL call for listing latest packages with
 # checksum info
@@ -1214,15 +1212,13 @@ def list_packages_checksum_sql(channel_id):
 
 
 def _list_packages_sql(query, channel_id):
-    h = rhnSQL.prepare(query)
+    h = rhnSQL.prepare(query, streaming=1)
     h.execute(channel_id=str(channel_id))
-    ret = h.fetchall_dict()
-    if not ret:
-        return []
-    # process the results
-    ret = [(a["name"], a["version"], a["release"], a["epoch"],
-                         a["arch"], a["package_size"]) for a in __stringify(ret)]
-    return ret
+    # process the results as they come
+    for a in h.iterate_dict():
+        a = __stringify(a)
+        yield (a["name"], a["version"], a["release"], a["epoch"],
+               a["arch"], a["package_size"])
 
 
 def list_packages_sql(channel_id):
@@ -1324,7 +1320,7 @@ def list_all_packages_sql(channel_id):
 def list_all_packages_complete_sql(channel_id):
     log_debug(3, channel_id)
     # return the latest packages from the specified channel
-    h = rhnSQL.prepare(_query_latest_packages_from_channel)
+    h = rhnSQL.prepare(_query_latest_packages_from_channel, streaming=1)
     # This gathers the provides, requires, conflicts, obsoletes info
     g = rhnSQL.prepare("""
     select
@@ -1473,10 +1469,7 @@ def list_all_packages_complete_sql(channel_id):
     # client was broken and was selecting the wrong architecture if athlons
     # are passed first. The rank ordering here should make sure that i386
     # kernels appear before athlons.
-    ret = h.fetchall_dict()
-    if not ret:
-        return []
-    for pkgi in ret:
+    for pkgi in h.iterate_dict():
         pkgi['provides'] = []
         pkgi['requires'] = []
         pkgi['conflicts'] = []
@@ -1506,11 +1499,11 @@ def list_all_packages_complete_sql(channel_id):
                     version = " " + version
             dep = item['name'] + relation + version
             pkgi[item['capability_type']].append(dep)
-    # process the results
-    ret = [(a["name"], a["version"], a["release"], a["epoch"],
-                         a["arch"], a["package_size"], a['provides'],
-                         a['requires'], a['conflicts'], a['obsoletes'], a['recommends'], a['suggests'], a['supplements'], a['enhances'], a['breaks'], a['predepends']) for a in __stringify(ret)]
-    return ret
+        # process the results as they come
+        a = __stringify(pkgi)
+        yield (a["name"], a["version"], a["release"], a["epoch"],
+               a["arch"], a["package_size"], a['provides'],
+               a['requires'], a['conflicts'], a['obsoletes'], a['recommends'], a['suggests'], a['supplements'], a['enhances'], a['breaks'], a['predepends'])
 
 
 def list_packages_path(channel_id):
@@ -1582,16 +1575,13 @@ def _list_packages(channel, cache_prefix, function):
         rhnFlags.set("XMLRPC-Encoded-Response", 1)
         return ret
 
-    ret = function(c_info["id"])
-    if not ret:
+    ret = _dump_packages(function(c_info["id"]), channel)
+    if ret is None:
         # we assume that channels with no packages are very fast to list,
         # so we don't bother caching...
         log_error("No packages found in channel",
                   c_info["id"], c_info["label"])
         return []
-    # we need to append the channel label to the list
-    ret = list(map(lambda a, c=channel: a + (c,), ret))
-    ret = xmlrpclib.dumps((ret, ), methodresponse=1)
     # Mark the response as being already XMLRPC-encoded
     rhnFlags.set("XMLRPC-Encoded-Response", 1)
     # set the cache
@@ -1599,6 +1589,26 @@ def _list_packages(channel, cache_prefix, function):
     return ret
 
 
+def _dump_packages(packages, channel):
+    """
+    Return the XML-RPC response listing packages, with the channel label
+    appended to each of them, or None if there are no packages.
+
+    Same as xmlrpclib.dumps, except the packages are marshalled one by one as
+    the generator yields them rather than being collected into a list first.
+    """
+    marshaller = xmlrpclib.Marshaller("utf-8")
+    data = []
+    for package in packages:
+        marshaller.dump_array(package + (channel,), data.append)
+    if not data:
+        return None
+    return "".join(["<?xml version='1.0'?>\n<methodResponse>\n<params>\n"
+                    "<param>\n<value><array><data>\n"] + data +
+                   ["</data></array></value>\n</param>\n</params>\n"
+                    "</methodResponse>\n"])
+
+
 def getChannelInfoForKickstart(kickstart):
     query = """
     select c.label,
@@ -47,6 +47,9 @@ class rhnHandler(RPC_Base):
         self.set_qos = CFG.QOS
         # do we update the checking counters
         self.update_checkin = 1
+        # if so, is it fine to write the update out later together with
+        # the checkins of other systems
+        self.queue_checkin = 0
 
     # Authenticate a system based on the certificate. There are a lot
     # of modifiers that can be set before this function is called (see
@@ -64,7 +67,10 @@ class rhnHandler(RPC_Base):
         self.server = server
         # update the latest checkin time
         if self.update_checkin:
-            server.checkin()
+            if self.queue_checkin:
+                server.queue_checkin()
+            else:
+                server.checkin()
 
         # is the server entitled?
         if self.check_entitlement:
@@ -246,6 +246,90 @@ def get_info_for_package(pkg, channel_id, org_id):
     return ret
 
 
+_query_info_for_packages = """
+    select pn.name, pe.version, pe.release, pa.label arch, p.id,
+           p.path, cp.channel_id,
+           cv.checksum_type, cv.checksum, pe.epoch
+      from rhnPackage p
+      join rhnPackageName pn
+        on p.name_id = pn.id
+      join rhnPackageEVR pe
+        on p.evr_id = pe.id
+      join rhnPackageArch pa
+        on p.package_arch_id = pa.id
+      left join rhnChannelPackage cp
+        on p.id = cp.package_id
+       and cp.channel_id = :channel_id
+      join rhnChecksumView cv
+        on p.checksum_id = cv.id
+     where (pn.name, pe.version, pe.release, pa.label) in (%s)
+       and %s
+"""
+
+
+def get_info_for_packages(pkgs, channel_id, org_id, chunk_size=500):
+    """
+    Bulk version of get_info_for_package.
+
+    pkgs is a list of [name, version, release, epoch, arch] lists. Returns a
+    list holding what get_info_for_package returns for each of them, in the
+    same order. Packages are looked up by name, version, release and arch,
+    chunk_size of them per query, and the epoch is matched here.
+    """
+    log_debug(3, len(pkgs))
+    pkgs = [list(map(str, pkg)) for pkg in pkgs]
+    if org_id:
+        orgStatement = "p.org_id = :org_id"
+    else:
+        orgStatement = "p.org_id is null"
+
+    # (name, version, release, arch) -> [(epoch, in channel, id, row), ...]
+    candidates = {}
+    keys = sorted(set([(pkg[0], pkg[1], pkg[2], pkg[4]) for pkg in pkgs]))
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        params = {'channel_id': channel_id}
+        if org_id:
+            params['org_id'] = org_id
+        binds = []
+        for i, (name, version, release, arch) in enumerate(chunk):
+            params['name_%d' % i] = name
+            params['ver_%d' % i] = version
+            params['rel_%d' % i] = release
+            params['arch_%d' % i] = arch
+            binds.append('(:name_%d, :ver_%d, :rel_%d, :arch_%d)' % (i, i, i, i))
+
+        h = rhnSQL.prepare(_query_info_for_packages % (', '.join(binds), orgStatement))
+        h.execute(**params)
+        for row in h.fetchall_dict() or []:
+            key = (row['name'], row['version'], row['release'], row['arch'])
+            candidates.setdefault(key, []).append(
+                (row['epoch'], row['channel_id'] is not None, row['id'], {
+                    'path': row['path'],
+                    'channel_id': row['channel_id'],
+                    'checksum_type': row['checksum_type'],
+                    'checksum': row['checksum'],
+                    'epoch': row['epoch'],
+                }))
+
+    ret = []
+    for name, version, release, epoch, arch in pkgs:
+        best = None
+        for db_epoch, in_channel, package_id, row in candidates.get((name, version, release, arch), []):
+            # yum repo has epoch="0" not only when epoch is "0" but also if it's NULL
+            if db_epoch != epoch and not (db_epoch is None and epoch in ('0', '')):
+                continue
+            # Same order as get_info_for_package: packages in the channel
+            # first, then the newest one
+            if best is None or (in_channel, package_id) > best[0]:
+                best = ((in_channel, package_id), row)
+        if best is None:
+            ret.append(None)
+        else:
+            ret.append(best[1])
+    return ret
+
+
 def _none2emptyString(foo):
     if foo is None:
         return ""
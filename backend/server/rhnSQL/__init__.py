@@ -29,6 +29,7 @@ import sql_row
 import sql_sequence
 import dbi
 import sql_types
+import sql_pool
 types = sql_types
 
 from const import ORACLE, POSTGRESQL, SUPPORTED_BACKENDS
@@ -42,7 +43,30 @@ from sql_base import SQLError, SQLSchemaError, SQLConnectError, \
 # EVER be exposed to the calling applications.
 
 
-def __init__DB(backend, host, port, username, password, database, sslmode, sslrootcert):
+def __new_DB(backend, host, port, username, password, database, sslmode,
+             sslrootcert, pool_size):
+    """
+    Return a new, not yet connected database object; a pool of up to
+    pool_size connections, one per thread, if pool_size is set.
+    """
+    db_class = dbi.get_database_class(backend=backend)
+    if not pool_size:
+        return db_class(host, port, username, password, database, sslmode, sslrootcert)
+
+    def factory():
+        return db_class(host, port, username, password, database, sslmode, sslrootcert)
+    idle_timeout = sql_pool.IDLE_TIMEOUT
+    checkout_timeout = sql_pool.CHECKOUT_TIMEOUT
+    if CFG.is_initialized():
+        if CFG.has_key('db_pool_idle_timeout'):
+            idle_timeout = int(CFG.DB_POOL_IDLE_TIMEOUT)
+        if CFG.has_key('db_pool_checkout_timeout'):
+            checkout_timeout = int(CFG.DB_POOL_CHECKOUT_TIMEOUT)
+    return sql_pool.PooledDatabase(factory, pool_size, idle_timeout, checkout_timeout)
+
+
+def __init__DB(backend, host, port, username, password, database, sslmode, sslrootcert,
+               pool_size=None):
     """
     Establish and check the connection so we can wrap it and handle
     exceptions.
@@ -52,8 +76,8 @@ def __init__DB(backend, host, port, username, password, database, sslmode, sslro
     try:
         my_db = __DB
     except NameError:  # __DB has not been set up
-        db_class = dbi.get_database_class(backend=backend)
-        __DB = db_class(host, port, username, password, database, sslmode, sslrootcert)
+        __DB = __new_DB(backend, host, port, username, password, database,
+                        sslmode, sslrootcert, pool_size)
         __DB.connect()
         return
     else:
@@ -67,8 +91,8 @@ def __init__DB(backend, host, port, username, password, database, sslmode, sslro
     __DB.commit()
     __DB.close()
     # now we have to get a different connection
-    __DB = dbi.get_database_class(backend=backend)(
-        host, port, username, password, database, sslmode, sslrootcert)
+    __DB = __new_DB(backend, host, port, username, password, database,
+                    sslmode, sslrootcert, pool_size)
     __DB.connect()
     return 0
 
@@ -105,7 +129,8 @@ def __init__DB2(backend, host, port, username, password, database, sslmode, sslr
 
 
 def initDB(backend=None, host=None, port=None, username=None,
-           password=None, database=None, sslmode=None, sslrootcert=None, initsecond=False):
+           password=None, database=None, sslmode=None, sslrootcert=None, initsecond=False,
+           pool_size=None):
     """
     Initialize the database.
 
@@ -115,6 +140,9 @@ def initDB(backend=None, host=None, port=None, username=None,
 
     initsecond: If set to True it initialize a second DB connection.
                 By default only one DB connection is needed.
+    pool_size:  If set, every thread gets a connection of its own out of
+                a pool of at most pool_size connections; see release().
+                Defaults to db_pool_size from the config file.
     """
 
     if backend is None:
@@ -138,11 +166,15 @@ def initDB(backend=None, host=None, port=None, username=None,
     if port:
         port = int(port)
 
+    if pool_size is None and CFG.is_initialized() and CFG.has_key('db_pool_size'):
+        pool_size = int(CFG.DB_POOL_SIZE or 0)
+
     # Hide the password
     add_to_seclist(password)
     try:
         if initsecond == False:
-            __init__DB(backend, host, port, username, password, database, sslmode, sslrootcert)
+            __init__DB(backend, host, port, username, password, database, sslmode, sslrootcert,
+                       pool_size)
         else:
             __init__DB2(backend, host, port, username, password, database, sslmode, sslrootcert)
 #    except (rhnException, SQLError):
@@ -200,6 +232,31 @@ def closeDB():
     return
 
 
+# Connections inherited from the parent process, see forgetDB()
+__inherited_DBs = []
+
+
+def forgetDB():
+    """
+    Drop the database connections without closing them, for a forked child
+    process to call initDB() and get connections of its own: the ones it
+    inherited are its parent's, closing them would end the parent's sessions
+    as well. They are kept referenced and never used again; the child should
+    exit through os._exit(), as multiprocessing children do.
+    """
+    global __DB, __DB2
+    try:
+        __inherited_DBs.append(__DB)
+        del __DB
+    except NameError:
+        pass
+    try:
+        __inherited_DBs.append(__DB2)
+        del __DB2
+    except NameError:
+        pass
+
+
 # common function for testing the connection state (ie, __DB defined
 def __test_DB():
     global __DB
@@ -263,11 +320,16 @@ def cursor():
     return db.cursor()
 
 
-def prepare(sql, blob_map=None):
+def prepare(sql, blob_map=None, streaming=0):
+    """
+    Prepare a statement. With streaming set, the rows of a query are kept
+    on the database server and fetched arraysize at a time, see
+    Cursor.iterate; the query must be done with before the transaction ends.
+    """
     db = __test_DB()
     if isinstance(sql, Statement):
         sql = sql.statement
-    return db.prepare(sql, blob_map=blob_map)
+    return db.prepare(sql, blob_map=blob_map, streaming=streaming)
 
 
 def prepare_secondary(sql, blob_map=None):
@@ -304,6 +366,20 @@ def commit():
     return db.commit()
 
 
+def release():
+    """
+    Give the connection of the calling thread back to the pool, rolling back
+    anything not committed. Does nothing unless connections are pooled, or
+    if not connected at all. The request handlers call it when they are done.
+    """
+    global __DB
+    try:
+        db = __DB
+    except NameError:
+        return None
+    return db.release()
+
+
 def commit_secondary():
     db = __test_DB2()
     return db.commit()
@@ -355,6 +431,11 @@ def set_log_auth_login(login):
         raise rhnException("No such log user", login)
 
 
+def statement_cache_stats():
+    db = __test_DB()
+    return db.statement_cache_stats()
+
+
 def read_lob(lob):
     if not lob:
         return None
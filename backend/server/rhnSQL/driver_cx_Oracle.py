@@ -373,6 +373,9 @@ class Database(sql_base.Database):
     _procedure_class = Procedure
     TimestampFromTicks = cx_Oracle.TimestampFromTicks
     OracleError = cx_Oracle.DatabaseError
+    _sequence_values_sql = """
+        select sequence_nextval('%s') as id from dual connect by level <= :count
+    """
 
     def __init__(self, host=None, port=None, username=None,
                  password=None, database=None, sslmode=None, sslrootcert=None):
@@ -470,7 +473,9 @@ class Database(sql_base.Database):
         return self._cursor_class(dbh=self.dbh)
 
     # pass-through functions for when you want to do SQL yourself
-    def prepare(self, sql, force=0, blob_map=None):
+    def prepare(self, sql, force=0, blob_map=None, streaming=0):
+        # cx_Oracle cursors always fetch arraysize rows at a time, so there
+        # is nothing special to do for streaming
         # Abuse the map calls to get rid of SQL comments and extra spaces
         sql = string.join([a for a in list(map(string.strip,
                                      [(a + " ")[:string.find(a, '--')] for a in string.split(sql, "\n")])) if len(a)],
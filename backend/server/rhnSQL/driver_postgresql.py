@@ -19,7 +19,9 @@
 
 import sys
 import string
+import itertools
 import re
+import threading
 import psycopg2
 
 # workaround for python-psycopg2 = 2.0.13 (RHEL6)
@@ -31,11 +33,28 @@ import sql_base
 from rhn.UserDictCase import UserDictCase
 from spacewalk.server import rhnSQL
 
+from spacewalk.common import rhnConfig
 from spacewalk.common.usix import BufferType, raise_with_tb
 from spacewalk.common.rhnLog import log_debug, log_error
 from spacewalk.common.rhnException import rhnException
 from const import POSTGRESQL
 
+# Number of converted queries the process keeps
+QUERY_CACHE_SIZE = 1000
+
+# Number of statements a single connection prepares at most
+MAX_PREPARED_STATEMENTS = 200
+
+# Plain "insert into ... values (...)" statements, which executemany() can
+# turn into a single multi-row insert
+_insert_values_re = re.compile(
+    r'^(\s*insert\s+into\s+[^(]+?\s*(?:\([^)]*\))?\s*values\s*)(\(.*\))\s*$',
+    re.IGNORECASE | re.DOTALL)
+_param_re = re.compile(r'%\((\w+)\)s')
+
+# Names of server-side cursors
+_stream_ids = itertools.count()
+
 
 def convert_named_query_params(query):
     """
@@ -54,6 +73,154 @@ def convert_named_query_params(query):
     return new_query
 
 
+def convert_to_positional_params(query):
+    """
+    Convert a query returned by convert_named_query_params into one using
+    PostgreSQL's own positional $1, $2 parameters, as needed by PREPARE.
+
+    RETURNS: the new query and the list of parameter names in position order
+    """
+    names = []
+
+    def replace(match):
+        if match.group(1) is None:
+            return '%'
+        name = match.group(1).lower()
+        if name not in names:
+            names.append(name)
+        return '$%d' % (names.index(name) + 1)
+
+    new_query = re.sub(r'%(?:\((\w+)\)s|%)', replace, query)
+    return new_query, names
+
+
+class QueryCache:
+
+    """
+    Process-wide cache of the queries converted for psycopg2.
+
+    Most handlers prepare the very same queries for every request; with
+    this cache each of them is converted only once. When full, the least
+    recently used half of the queries is dropped.
+    """
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._queries = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        """ Return query converted by convert_named_query_params. """
+        self._lock.acquire()
+        try:
+            self._tick = self._tick + 1
+            entry = self._queries.get(query)
+            if entry is not None:
+                self.hits = self.hits + 1
+                entry[1] = self._tick
+                return entry[0]
+
+            self.misses = self.misses + 1
+            if len(self._queries) >= self.size:
+                self._evict()
+            new_query = convert_named_query_params(query)
+            self._queries[query] = [new_query, self._tick]
+            return new_query
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        entries = sorted(self._queries.items(), key=lambda x: x[1][1])
+        for query, _entry in entries[:len(entries) // 2 + 1]:
+            del self._queries[query]
+
+    def __len__(self):
+        return len(self._queries)
+
+_query_cache = QueryCache()
+
+
+class PreparedStatements:
+
+    """
+    Server-side prepared statements of a single connection.
+
+    Once a query was executed threshold times on the connection, it is
+    PREPAREd and from then on run with EXECUTE, so PostgreSQL does not have
+    to parse and plan it again. Queries PostgreSQL refuses to prepare (e.g.
+    because it cannot infer the type of a parameter) are run as they are.
+    """
+
+    _savepoint = "rhn_sql_prepare"
+
+    def __init__(self, threshold, max_size=MAX_PREPARED_STATEMENTS):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.hits = 0
+        self.failures = 0
+        self._counts = {}
+        # query -> EXECUTE statement, or None if it cannot be prepared
+        self._statements = {}
+
+    def get(self, cursor, query):
+        """
+        Return the statement to execute instead of query, None to execute
+        query itself.
+        """
+        statement = self._statements.get(query, 0)
+        if statement != 0:
+            if statement is not None:
+                self.hits = self.hits + 1
+            return statement
+
+        count = self._counts.get(query, 0) + 1
+        if count < self.threshold:
+            if len(self._counts) >= 10 * self.max_size:
+                self._counts.clear()
+            self._counts[query] = count
+            return None
+        if len(self._statements) >= self.max_size:
+            return None
+
+        self._counts.pop(query, None)
+        statement = self._statements[query] = self._prepare(cursor, query)
+        return statement
+
+    def _prepare(self, cursor, query):
+        words = query.split(None, 1)
+        if not words or words[0].lower() not in ('select', 'insert', 'update',
+                                                 'delete', 'with'):
+            return None
+
+        name = "rhn_sql_%d" % len(self._statements)
+        body, params = convert_to_positional_params(query)
+        # A failed PREPARE must not abort the transaction of the caller
+        cursor.execute("SAVEPOINT %s" % self._savepoint)
+        try:
+            cursor.execute("PREPARE %s AS %s" % (name, body))
+        except psycopg2.Error:
+            e = sys.exc_info()[1]
+            log_debug(4, "Cannot prepare statement: %s" % e.pgerror, body)
+            cursor.execute("ROLLBACK TO SAVEPOINT %s" % self._savepoint)
+            self.failures = self.failures + 1
+            return None
+        cursor.execute("RELEASE SAVEPOINT %s" % self._savepoint)
+
+        if not params:
+            return "EXECUTE %s" % name
+        return "EXECUTE %s (%s)" % (name, ", ".join(["%%(%s)s" % x for x in params]))
+
+    def stats(self):
+        return {
+            'prepared': len([x for x in self._statements.values() if x is not None]),
+            'prepared_hits': self.hits,
+            'prepare_failures': self.failures,
+        }
+
+
 class Function(sql_base.Procedure):
 
     """
@@ -136,6 +303,10 @@ class Database(sql_base.Database):
 
     """ Class for PostgreSQL database operations. """
 
+    _sequence_values_sql = """
+        select sequence_nextval('%s') as id from generate_series(1, :count)
+    """
+
     def __init__(self, host=None, port=None, username=None,
                  password=None, database=None, sslmode=None, sslrootcert=None):
 
@@ -162,6 +333,13 @@ class Database(sql_base.Database):
 
         self.dbh = None
 
+        # Server-side prepared statements are opt-in
+        self.prepare_threshold = 0
+        if rhnConfig.CFG.is_initialized() and \
+                rhnConfig.CFG.has_key("db_prepare_threshold"):
+            self.prepare_threshold = int(rhnConfig.CFG.db_prepare_threshold or 0)
+        self.statements = None
+
         sql_base.Database.__init__(self)
 
     def connect(self, reconnect=1):
@@ -182,6 +360,10 @@ class Database(sql_base.Database):
                 raise AttributeError("Attribute sslrootcert needs to be set if sslmode is set.")
 
             self.dbh = psycopg2.connect(" ".join("%s=%s" % (k, re.escape(str(v))) for k, v in dsndata.items()))
+            # Statements prepared on the previous connection are gone
+            self.statements = None
+            if self.prepare_threshold > 0:
+                self.statements = PreparedStatements(self.prepare_threshold)
 
             # convert all DECIMAL types to float (let Python to choose one)
             DEC2INTFLOAT = psycopg2.extensions.new_type(psycopg2._psycopg.DECIMAL.values,
@@ -219,8 +401,9 @@ class Database(sql_base.Database):
                       "Exception information: %s" % sys.exc_info()[1])
             self.connect()  # only allow one try
 
-    def prepare(self, sql, force=0, blob_map=None):
-        return Cursor(dbh=self.dbh, sql=sql, force=force, blob_map=blob_map)
+    def prepare(self, sql, force=0, blob_map=None, streaming=0):
+        return Cursor(dbh=self.dbh, sql=sql, force=force, blob_map=blob_map,
+                      statements=self.statements, streaming=streaming)
 
     def execute(self, sql, *args, **kwargs):
         cursor = self.prepare(sql)
@@ -253,28 +436,69 @@ class Database(sql_base.Database):
         c = self.dbh.cursor()
         return Function(name, c, ret_type)
 
+    def close(self):
+        if self.dbh is not None:
+            try:
+                self.dbh.close()
+            except psycopg2.Error:
+                pass
+        # Drop the cached cursors; a new connection may get the same id
+        Cursor._cursor_cache.pop(id(self.dbh), None)
+        self.dbh = None
+        self.statements = None
+
+    def is_alive(self):
+        if self.dbh is None or self.dbh.closed:
+            return 0
+        # Without a round trip; a broken connection reports unknown status
+        return self.dbh.get_transaction_status() != \
+            psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
     def cursor(self):
-        return Cursor(dbh=self.dbh)
+        return Cursor(dbh=self.dbh, statements=self.statements)
 
     def _read_lob(self, lob):
         return str(lob)
 
+    def statement_cache_stats(self):
+        stats = {
+            'query_cache_size': len(_query_cache),
+            'query_cache_hits': _query_cache.hits,
+            'query_cache_misses': _query_cache.misses,
+        }
+        if self.statements is not None:
+            stats.update(self.statements.stats())
+        return stats
+
 
 class Cursor(sql_base.Cursor):
 
     """ PostgreSQL specific wrapper over sql_base.Cursor. """
 
-    def __init__(self, dbh=None, sql=None, force=None, blob_map=None):
+    # Every chunk is a single statement, so they can be bigger
+    bulk_chunk_size = 1000
+
+    def __init__(self, dbh=None, sql=None, force=None, blob_map=None,
+                 statements=None, streaming=0):
 
+        # A streaming cursor gets a new server-side cursor for every execute
+        self.streaming = streaming
         sql_base.Cursor.__init__(self, dbh, sql, force)
         self.blob_map = blob_map
+        self.statements = statements
 
         # Accept Oracle style named query params, but convert for python-pgsql
         # under the hood:
         temp_sql = ""
         if self.sql is not None:
             temp_sql = self.sql
-        self.sql = convert_named_query_params(temp_sql)
+        self.sql = _query_cache.get(temp_sql)
+
+    def _prepare(self, force=None):
+        if self.streaming:
+            # Named cursors can execute only once; nothing to cache
+            return None
+        return sql_base.Cursor._prepare(self, force=force)
 
     def _prepare_sql(self):
         cursor = self.dbh.cursor()
@@ -314,8 +538,20 @@ class Cursor(sql_base.Cursor):
         PostgreSQL specific execution of the query.
         """
         params = UserDictCase(kwargs)
+        sql = self.sql
+        if self.streaming:
+            # Rows stay on the server until fetched
+            if self._real_cursor is not None:
+                try:
+                    self._real_cursor.close()
+                except psycopg2.Error:
+                    pass
+            self._real_cursor = self.dbh.cursor("rhn_stream_%d" % next(_stream_ids))
+            self._real_cursor.arraysize = self.arraysize
+        elif self.statements is not None:
+            sql = self.statements.get(self._real_cursor, self.sql) or sql
         try:
-            self._real_cursor.execute(self.sql, params)
+            self._real_cursor.execute(sql, params)
         except psycopg2.OperationalError:
             e = sys.exc_info()[1]
             raise sql_base.SQLError("Cannot execute SQL statement: %s" % str(e))
@@ -323,6 +559,22 @@ class Cursor(sql_base.Cursor):
         self.description = self._real_cursor.description
         return self._real_cursor.rowcount
 
+    def _fetch(self, method, *args):
+        rows = method(*args)
+        if self.streaming:
+            # Named cursors know their description only once they fetched
+            self.description = self._real_cursor.description
+        return rows
+
+    def fetchone(self):
+        return self._fetch(self._real_cursor.fetchone)
+
+    def fetchall(self):
+        return self._fetch(self._real_cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._real_cursor.fetchmany, size or self.arraysize)
+
     def _executemany(self, *args, **kwargs):
         if not kwargs:
             return 0
@@ -342,11 +594,35 @@ class Cursor(sql_base.Cursor):
                 all_kwargs[i][key] = val
                 i = i + 1
 
+        if self.bulk and len(all_kwargs) > 1:
+            match = _insert_values_re.match(self.sql)
+            if match:
+                return self._execute_values(match.group(1), match.group(2),
+                                            all_kwargs)
+
         self._real_cursor.executemany(self.sql, all_kwargs)
         self.description = self._real_cursor.description
         rowcount = self._real_cursor.rowcount
         return rowcount
 
+    def _execute_values(self, prefix, template, rows):
+        """
+        Insert all the rows with one multi-row insert instead of sending a
+        statement per row. Parameters are renamed per row, i.e. :name
+        becomes :name_0, :name_1 etc.
+        """
+        values = []
+        all_params = {}
+        for i, row in enumerate(rows):
+            suffix = "_%d" % i
+            values.append(_param_re.sub(r'%(\1' + suffix + ')s', template))
+            for key, val in row.items():
+                all_params[key + suffix] = val
+
+        self._real_cursor.execute(prefix + ", ".join(values), all_params)
+        self.description = self._real_cursor.description
+        return self._real_cursor.rowcount
+
     def update_blob(self, table_name, column_name, where_clause, data,
                     **kwargs):
         """
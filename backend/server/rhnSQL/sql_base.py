@@ -96,10 +96,20 @@ class Cursor:
     #   hash with the sql statement as a key and the cursor as a value
     _cursor_cache = {}
 
+    # Default number of rows execute_bulk passes to executemany at once
+    bulk_chunk_size = 100
+
+    # Default number of rows fetchmany, iterate and iterate_dict fetch at once
+    arraysize = 1000
+
     def __init__(self, dbh=None, sql=None, force=None):
         self.sql = sql
         self.dbh = dbh
 
+        # Backends may send the rows of executemany() in batches instead of
+        # one by one; set to 0 to disable that for this statement
+        self.bulk = 1
+
         self.reparsed = 0
         self._real_cursor = None
         self._dbh_id = id(dbh)
@@ -159,7 +169,7 @@ class Cursor:
         """
         return self._execute_wrapper(self._executemany, *p, **kw)
 
-    def execute_bulk(self, dict, chunk_size=100):
+    def execute_bulk(self, dict, chunk_size=None):
         """
         Uses executemany but chops the incoming dict into chunks for each
         call.
@@ -172,6 +182,8 @@ class Cursor:
         dict is supposed to be the dictionary that we normally apply to
         statement.execute.
         """
+        if chunk_size is None:
+            chunk_size = self.bulk_chunk_size
         ret = 0
         start_chunk = 0
         while 1:
@@ -222,12 +234,37 @@ class Cursor:
         rows = self._real_cursor.fetchall()
         return rows
 
+    def fetchmany(self, size=None):
+        """
+        Fetch the next size rows, arraysize by default. Unlike the other
+        fetch methods, returns an empty list once there are no more rows.
+        """
+        return self._real_cursor.fetchmany(size or self.arraysize)
+
+    def iterate(self):
+        """
+        Generator over the rows, fetching arraysize of them at a time, so a
+        big result set never has to be held in memory at once.
+        """
+        while 1:
+            rows = self.fetchmany()
+            for row in rows:
+                yield row
+            if len(rows) < self.arraysize:
+                # That was the last of them
+                return
+
+    def iterate_dict(self):
+        """ Like iterate, but generating dictionaries as fetchone_dict. """
+        for row in self.iterate():
+            yield ociDict(self.description, row)
+
     def fetchone_dict(self):
         """
         Return a dictionary for the row returned mapping column name to
         it's value.
         """
-        ret = ociDict(self.description, self._real_cursor.fetchone())
+        ret = ociDict(self.description, self.fetchone())
 
         if len(ret) == 0:
             return None
@@ -237,7 +274,7 @@ class Cursor:
         """
         Fetch all rows as a list of dictionaries.
         """
-        rows = self._real_cursor.fetchall()
+        rows = self.fetchall()
 
         ret = []
         for x in rows:
@@ -284,6 +321,9 @@ class Database:
     """
     _procedure_class = Procedure
     TimestampFromTicks = None
+    # Query returning :count values of sequence %s, one per row; the
+    # backends which can do that in a single round trip define it
+    _sequence_values_sql = None
 
     def __init__(self):
         pass
@@ -344,6 +384,14 @@ class Database:
         "Close the connection"
         pass
 
+    def is_alive(self):
+        "Cheap check, without a round trip, that the connection is usable"
+        return 1
+
+    def release(self):
+        "Give back the connection of the calling thread (pooled databases)"
+        pass
+
     def cursor(self):
         "return an empty Cursor object"
         return Cursor()
@@ -356,6 +404,23 @@ class Database:
         "Reads a lob's contents"
         return None
 
+    def statement_cache_stats(self):
+        "Returns a dict of statement cache counters"
+        return {}
+
+    def sequence_values(self, seq, count):
+        "Returns a list of count new values of sequence seq"
+        if self._sequence_values_sql is None:
+            h = self.prepare("select sequence_nextval('%s') as id from dual" % seq)
+            values = []
+            for _i in range(count):
+                h.execute()
+                values.append(int(h.fetchone()[0]))
+            return values
+        h = self.prepare(self._sequence_values_sql % seq)
+        h.execute(count=count)
+        return sorted([int(row[0]) for row in h.fetchall()])
+
     def is_connected_to(self, backend, host, port, username, password,
                         database, sslmode):
         """
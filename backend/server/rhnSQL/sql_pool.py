@@ -0,0 +1,275 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+# A pool of database connections, handed out one per thread
+#
+
+import sys
+import threading
+import time
+
+from spacewalk.common.rhnLog import log_debug, log_error
+
+import sql_base
+
+# Seconds after which an idle connection is closed
+IDLE_TIMEOUT = 300
+# Seconds checkout() waits for a connection before giving up
+CHECKOUT_TIMEOUT = 30
+# Connections idle for longer than this many seconds are checked with a
+# round trip to the server before they are reused
+PROBE_AFTER = 30
+
+
+class Pool:
+
+    """
+    A bounded pool of connections to the same database.
+
+    Connections are created on demand by calling factory, up to max_size of
+    them. Connections given back are reused, most recently used first; the
+    ones idle for longer than probe_after seconds only if check_connection
+    succeeds on them, which costs a round trip, and the ones idle for longer
+    than idle_timeout seconds are closed. Connections checked out by threads
+    which exited meanwhile are reclaimed. A checkout waits for a connection
+    for checkout_timeout seconds at most.
+    """
+
+    def __init__(self, factory, max_size, idle_timeout=IDLE_TIMEOUT,
+                 checkout_timeout=CHECKOUT_TIMEOUT, probe_after=PROBE_AFTER):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.probe_after = probe_after
+        # Connections not in use, with the time they were given back
+        self._idle = []
+        # Connections in use, with the thread using them
+        self._in_use = {}
+        self._condition = threading.Condition()
+
+    def checkout(self):
+        """
+        Return a connected database, waiting for one if needed; raises
+        SQLConnectError if none is given back within checkout_timeout.
+        """
+        deadline = time.time() + self.checkout_timeout
+        while 1:
+            db, idle_since = self._reserve(deadline)
+            try:
+                if idle_since is None:
+                    db.connect()
+                elif time.time() - idle_since > self.probe_after:
+                    # The server may have closed it meanwhile
+                    db.check_connection()
+            except Exception:
+                self._discard(db)
+                if idle_since is None:
+                    raise
+                log_debug(3, "Dropping dead pooled connection")
+                continue
+            return db
+
+    def _reserve(self, deadline):
+        # Mark an idle connection, or a new unconnected one, as used by the
+        # calling thread; returns it and since when it was idle, None if new
+        self._condition.acquire()
+        try:
+            while 1:
+                self._reap()
+                while self._idle:
+                    idle_since, db = self._idle.pop()
+                    if db.is_alive():
+                        self._in_use[db] = threading.currentThread()
+                        return db, idle_since
+                    log_debug(3, "Dropping dead pooled connection")
+                    self._close(db)
+
+                if len(self._in_use) < self.max_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise sql_base.SQLConnectError(
+                        "pool", -1, "Timed out waiting for a database connection",
+                        "%s connections in use" % len(self._in_use))
+                # Wake up now and then to reclaim connections of dead threads
+                self._condition.wait(min(remaining, 1))
+
+            db = self.factory()
+            self._in_use[db] = threading.currentThread()
+            return db, None
+        finally:
+            self._condition.release()
+
+    def _discard(self, db):
+        # Forget a reserved connection which could not be used
+        self._condition.acquire()
+        try:
+            del self._in_use[db]
+            self._close(db)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def checkin(self, db):
+        """ Give back a database returned by checkout(). """
+        try:
+            db.rollback()
+        except Exception:
+            # Broken; the next checkout will tell
+            pass
+        self._condition.acquire()
+        try:
+            if self._in_use.pop(db, None) is not None:
+                self._idle.append((time.time(), db))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def close(self):
+        """ Close all the idle connections and forget the ones in use. """
+        self._condition.acquire()
+        try:
+            for _when, db in self._idle:
+                self._close(db)
+            self._idle = []
+            self._in_use = {}
+        finally:
+            self._condition.release()
+
+    def size(self):
+        return len(self._idle) + len(self._in_use)
+
+    def _reap(self):
+        # Called with the condition held
+        if self._idle:
+            limit = time.time() - self.idle_timeout
+            while self._idle and self._idle[0][0] < limit:
+                self._close(self._idle.pop(0)[1])
+
+        for db, thread in list(self._in_use.items()):
+            if not thread.isAlive():
+                log_debug(3, "Reclaiming connection of exited thread", thread.getName())
+                del self._in_use[db]
+                try:
+                    db.rollback()
+                except Exception:
+                    self._close(db)
+                    continue
+                self._idle.append((time.time(), db))
+
+    @staticmethod
+    def _close(db):
+        try:
+            db.close()
+        except Exception:
+            e = sys.exc_info()[1]
+            log_error("Error closing pooled connection", e)
+
+
+class PooledDatabase(sql_base.Database):
+
+    """
+    Database which gives every thread a connection of its own, out of a Pool.
+
+    A thread gets its connection on first use and keeps it until it calls
+    release(), so transactions work as they do with a plain Database. Used
+    as the rhnSQL module database, it lets the threads of one process talk
+    to the database in parallel through the usual rhnSQL functions.
+    """
+
+    def __init__(self, factory, max_size, idle_timeout=IDLE_TIMEOUT,
+                 checkout_timeout=CHECKOUT_TIMEOUT):
+        sql_base.Database.__init__(self)
+        self.pool = Pool(factory, max_size, idle_timeout, checkout_timeout)
+        self._local = threading.local()
+        # Used to answer is_connected_to
+        self._template = factory()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self.pool.checkout()
+        return db
+
+    def release(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            self._local.db = None
+            self.pool.checkin(db)
+
+    def connect(self, reconnect=1):
+        self._db()
+
+    def close(self):
+        self.release()
+        self.pool.close()
+
+    def is_connected_to(self, *args):
+        return self._template.is_connected_to(*args)
+
+    def check_connection(self):
+        return self._db().check_connection()
+
+    def prepare(self, sql, force=0, blob_map=None, streaming=0):
+        return self._db().prepare(sql, force=force, blob_map=blob_map,
+                                  streaming=streaming)
+
+    def execute(self, sql, *args, **kwargs):
+        return self._db().execute(sql, *args, **kwargs)
+
+    def commit(self):
+        return self._db().commit()
+
+    def rollback(self, name=None):
+        return self._db().rollback(name)
+
+    def transaction(self, name):
+        return self._db().transaction(name)
+
+    def procedure(self, name):
+        return self._db().procedure(name)
+
+    def function(self, name, ret_type):
+        return self._db().function(name, ret_type)
+
+    def cursor(self):
+        return self._db().cursor()
+
+    def is_alive(self):
+        return self._db().is_alive()
+
+    def statement_cache_stats(self):
+        return self._db().statement_cache_stats()
+
+    def sequence_values(self, seq, count):
+        return self._db().sequence_values(seq, count)
+
+    def _read_lob(self, lob):
+        return self._db()._read_lob(lob)
+
+    def Date(self, year, month, day):
+        return self._db().Date(year, month, day)
+
+    def DateFromTicks(self, ticks):
+        return self._db().DateFromTicks(ticks)
+
+    def TimestampFromTicks(self, *args, **kwargs):
+        return self._db().TimestampFromTicks(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Anything else the driver's Database has
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._db(), name)
@@ -31,8 +31,12 @@ class Sequence:
         if not isinstance(db, sql_base.Database):
             raise rhnException("Argument db is not a database instance", db)
         self.__db = db
+        # Values fetched ahead by preallocate(), the next one last
+        self.__values = []
 
     def next(self):
+        if self.__values:
+            return self.__values.pop()
         sql = "select sequence_nextval('%s') as ID from dual" % self.__seq
         cursor = self.__db.prepare(sql)
         cursor.execute()
@@ -41,6 +45,21 @@ class Sequence:
             return ret
         return int(ret['id'])
 
+    def next_block(self, count):
+        """ Return a list of count new values, fetched in a single round trip. """
+        if count <= 0:
+            return []
+        return self.__db.sequence_values(self.__seq, count)
+
+    def preallocate(self, count):
+        """
+        Fetch the values for the next count calls of next() in one go.
+        Values fetched but never used are lost, like with any sequence cache.
+        """
+        needed = count - len(self.__values)
+        if needed > 0:
+            self.__values = sorted(self.__values + self.next_block(needed), reverse=True)
+
     def __call__(self):
         return self.next()
 
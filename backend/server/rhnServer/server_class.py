@@ -678,6 +678,12 @@ class Server(ServerWrapper):
             return 0  # meaningless if rhnFault not raised
         return server_lib.checkin(self.server["id"], commit)
 
+    def queue_checkin(self):
+        """ same as checkin(), but written out later with other checkins """
+        if not self.server.has_key("id"):
+            return 0
+        return server_lib.queue_checkin(self.server["id"])
+
     def throttle(self):
         """ convenient wrapper for these thing until we clean the code up """
         if not self.server.has_key("id"):
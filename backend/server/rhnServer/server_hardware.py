@@ -21,7 +21,7 @@ import string
 import sys
 
 from rhn.UserDictCase import UserDictCase
-from spacewalk.common.usix import raise_with_tb
+from spacewalk.common.usix import raise_with_tb, UnicodeType
 from spacewalk.common.rhnLog import log_debug, log_error
 from spacewalk.common.rhnException import rhnFault
 from spacewalk.common.rhnTB import Traceback
@@ -238,6 +238,16 @@ class GenericDevice:
         self.status = 0
         return 0
 
+    def load_row(self, row):
+        """ load from a row selected from the table, like reload() does """
+        self.data = UserDictCase(row)
+        for k in ["created", "modified"]:
+            if self.data.has_key(k):
+                del self.data[k]
+        self.id = self.data["id"]
+        self.status = 0
+        return 0
+
     def _null_columns(self, params, names=()):
         """ Method searches for empty string in params dict with names
             defined in names list and replaces them with None value which
@@ -418,6 +428,7 @@ class NetIfaceInformation(Device):
         log_debug(4, dict)
         self.ifaces = {}
         self.db_ifaces = []
+        self.status = 1  # just added
         # parameters which are not allowed to be empty and set to NULL
         self._autonull = ('hw_addr', 'module')
         if not dict:
@@ -780,6 +791,101 @@ class NetIfaceAddress4(NetIfaceAddress):
         return cleanse_ip_addr(val)
 
 
+def _device_key(data, fields):
+    """ Returns what a device is compared on: the values of the given fields,
+        with empty strings and NULLs alike and everything else as a string,
+        the way it comes back from the database """
+    key = []
+    for field in fields:
+        value = data.get(field)
+        if value is None or value == '':
+            value = None
+        elif isinstance(value, UnicodeType):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        key.append(value)
+    return tuple(key)
+
+
+def _save_devices(devices, sysid):
+    """ Saves a list of devices of the same class.
+
+        Deleted devices identical to a newly added one are left in place
+        instead of being deleted and inserted again; the other deleted devices
+        are deleted and the other new ones inserted, with one statement for
+        all the rows. Returns the devices which are still there.
+    """
+    if not devices:
+        return []
+    dev_class = devices[0].__class__
+    added = [dev for dev in devices if dev.status == 1 and not dev.id]
+    # Fields as the new devices have them, without what the database sets
+    fields = {}
+    for dev in added:
+        for k in dev.data.keys():
+            fields[string.lower(k)] = None
+    for k in ["id", "server_id", "created", "modified"]:
+        fields.pop(k, None)
+    fields = sorted(fields.keys())
+
+    deleted = {}
+    for dev in devices:
+        if dev.status == 2 and dev.id:
+            deleted.setdefault(_device_key(dev.data, fields), []).append(dev)
+
+    kept = []
+    inserts = []
+    for dev in devices:
+        if dev.status == 2:
+            continue
+        if dev.status != 1 or dev.id:
+            # Unchanged, or an update of a single device
+            dev.save(sysid)
+            kept.append(dev)
+            continue
+        same = deleted.get(_device_key(dev.data, fields))
+        if same:
+            old_dev = same.pop()
+            old_dev.status = 0
+            kept.append(old_dev)
+            continue
+        inserts.append(dev)
+
+    deletes = []
+    for devs in deleted.values():
+        deletes.extend([{'id': dev.id} for dev in devs])
+    log_debug(4, dev_class.table, "unchanged: %s" % len(kept),
+              "deleted: %s" % len(deletes), "inserted: %s" % len(inserts))
+    if deletes:
+        h = rhnSQL.prepare("delete from %s where id = :id" % dev_class.table)
+        _dml(h, deletes)
+
+    if inserts:
+        ids = rhnSQL.Sequence(inserts[0].sequence).next_block(len(inserts))
+        # Devices with the same columns are inserted together
+        by_columns = {}
+        for dev, devid in zip(inserts, ids):
+            dev._null_columns([dev.data], dev._autonull)
+            for k in dev.data.keys():
+                if dev.data[k] is None:
+                    del dev.data[k]
+            dev.data["server_id"] = sysid
+            dev.id = devid
+            dev.status = 0
+            row = {"id": devid}
+            for k, v in dev.data.items():
+                row[string.lower(k)] = v
+            columns = sorted(row.keys())
+            by_columns.setdefault(tuple(columns), []).append(row)
+        for columns, rows in by_columns.items():
+            h = rhnSQL.prepare("insert into %s (%s) values (%s)" % (
+                dev_class.table, string.join(columns, ", "),
+                string.join([':' + x for x in columns], ", ")))
+            _dml(h, rows)
+    return kept + inserts
+
+
 def _hash_eq(h1, h2):
     """ Compares two hashes and return 1 if the first is a subset of the second """
     log_debug(5, h1, h2)
@@ -983,8 +1089,15 @@ class Hardware:
         if not self.__changed:
             return 0
         for device_type, hw_list in hardware.items():
-            for hw in hw_list:
-                hw.save(sysid)
+            if device_type is NetIfaceInformation:
+                # Interfaces are compared with the database when saved; the
+                # ones being replaced only matter if no new ones came along
+                hw_list = [hw for hw in hw_list if hw.status != 2] or hw_list
+                for hw in hw_list:
+                    hw.save(sysid)
+                hardware[device_type] = hw_list
+                continue
+            hardware[device_type] = _save_devices(hw_list, sysid)
         self.__changed = 0
         return 0
 
@@ -993,14 +1106,13 @@ class Hardware:
         if DevClass not in self.__hardware:
             self.__hardware[DevClass] = []
 
-        h = rhnSQL.prepare("select id from %s where server_id = :sysid" % DevClass.table)
+        h = rhnSQL.prepare("select * from %s where server_id = :sysid" % DevClass.table)
         h.execute(sysid=sysid)
         rows = h.fetchall_dict() or []
 
-        for device in rows:
-            dev_id = device['id']
+        for row in rows:
             dev = DevClass()
-            dev.reload(dev_id)
+            dev.load_row(row)
             self.__hardware[DevClass].append(dev)
 
     def reload_hardware_byid(self, sysid):
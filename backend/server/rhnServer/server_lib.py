@@ -15,11 +15,13 @@
 # implements a bunch of functions needed by rhnServer modules
 #
 
+import atexit
 import os
 import hashlib
 import time
 import string
 import sys
+import threading
 
 if sys.version_info[0] == 3:
     from functools import reduce
@@ -209,6 +211,121 @@ def checkin(server_id, commit=1):
     return 1
 
 
+# Checkins not written to the database yet: server id -> [number of
+# checkins, time of the last one]
+_queued_checkins = {}
+_queued_checkins_lock = threading.Lock()
+# Writes out the queued checkins after checkin_write_interval seconds
+_checkin_timer = None
+# Only one write of the queued checkins at a time
+_checkin_write_lock = threading.Lock()
+
+
+def queue_checkin(server_id):
+    """ queue_checkin - record a checkin; the checkins are written out
+        together checkin_write_interval seconds later, whether more requests
+        come in or not, in a transaction of their own (written and committed
+        right away if the interval is 0).
+    """
+    global _checkin_timer
+    log_debug(3, server_id)
+    interval = 0
+    if CFG.has_key('checkin_write_interval'):
+        interval = int(CFG.checkin_write_interval or 0)
+    if interval <= 0:
+        return checkin(server_id)
+
+    _queued_checkins_lock.acquire()
+    try:
+        entry = _queued_checkins.get(server_id)
+        if entry is None:
+            _queued_checkins[server_id] = [1, time.time()]
+        else:
+            entry[0] = entry[0] + 1
+            entry[1] = time.time()
+        if _checkin_timer is None:
+            _checkin_timer = threading.Timer(interval, _flush_queued_checkins)
+            _checkin_timer.setDaemon(True)
+            _checkin_timer.start()
+    finally:
+        _queued_checkins_lock.release()
+    return 1
+
+
+def flush_checkins():
+    """ flush_checkins - write out the queued checkins, with the time of the
+        last checkin of each server, using the secondary connection so that
+        the write is committed independently of any request's transaction.
+        The checkins are queued again if the write fails.
+    """
+    global _queued_checkins
+    _checkin_write_lock.acquire()
+    try:
+        _queued_checkins_lock.acquire()
+        try:
+            queued = _queued_checkins
+            _queued_checkins = {}
+        finally:
+            _queued_checkins_lock.release()
+        if not queued:
+            return 0
+
+        # Always the same order, so that concurrent writers don't deadlock
+        server_ids = sorted(queued.keys())
+        log_debug(3, "Writing %s queued checkins" % len(server_ids))
+        now = time.time()
+        h = rhnSQL.prepare_secondary("""
+        update rhnServerInfo
+        set checkin = current_timestamp - numtodsinterval(:age, 'second'),
+            checkin_counter = checkin_counter + :count
+        where server_id = :server_id
+        """)
+        try:
+            h.executemany(server_id=server_ids,
+                          count=[queued[server_id][0] for server_id in server_ids],
+                          age=[max(int(now - queued[server_id][1]), 0) for server_id in server_ids])
+            rhnSQL.commit_secondary()
+        except Exception:
+            rhnSQL.execute_secondary("rollback")
+            _requeue_checkins(queued)
+            raise
+        return len(server_ids)
+    finally:
+        _checkin_write_lock.release()
+
+
+def _requeue_checkins(queued):
+    _queued_checkins_lock.acquire()
+    try:
+        for server_id, (count, last) in queued.items():
+            entry = _queued_checkins.get(server_id)
+            if entry is None:
+                _queued_checkins[server_id] = [count, last]
+            else:
+                entry[0] = entry[0] + count
+                entry[1] = max(entry[1], last)
+    finally:
+        _queued_checkins_lock.release()
+
+
+def _flush_queued_checkins():
+    # Timer and exit hook: errors are logged, there is nobody to pass them to
+    global _checkin_timer
+    _queued_checkins_lock.acquire()
+    try:
+        _checkin_timer = None
+    finally:
+        _queued_checkins_lock.release()
+    try:
+        flush_checkins()
+    except Exception:
+        e = sys.exc_info()[1]
+        log_error("Could not write the queued checkins", e)
+
+
+atexit.register(_flush_queued_checkins)
+
+
 def set_qos(server_id):
     pass
 
@@ -176,8 +176,13 @@ class Packages:
         else:
             return None
 
-    def save_packages_byid(self, sysid, schedule=1):
-        """ save the package list """
+    def save_packages_byid(self, sysid, schedule=1, digest=None):
+        """ save the package list
+
+            digest is the digest the client computed of the profile as it is
+            now. Clients which don't compute one don't get to send deltas
+            against it; any change without a digest invalidates it.
+        """
         log_debug(3, sysid, "Errata cache to run:", schedule,
                   "Changed:", self.__changed, "%d total packages" % len(self.__p))
 
@@ -207,6 +212,9 @@ class Packages:
             commits = commits + len(dlist)
             del dlist
 
+        h = rhnSQL.prepare(self._query_update_profile_digest)
+        h.execute(sysid=sysid, digest=digest)
+
         # And now add packages
         alist = [a for a in list(self.__p.values()) if a.status in (ADDED, UPDATED)]
         if alist:
@@ -261,6 +269,13 @@ class Packages:
         self.__changed = 0
         return 0
 
+    _query_update_profile_digest = rhnSQL.Statement("""
+        update rhnServer
+           set package_profile_digest = :digest
+         where id = :sysid
+           and (package_profile_digest is not null or :digest is not null)
+    """)
+
     _query_get_package_arches = rhnSQL.Statement("""
         select id, label
           from rhnPackageArch
@@ -336,12 +351,34 @@ def update_errata_cache(server_id):
 
 
 def processPackageKeyAssociations(header, checksum_type, checksum):
-    provider_sql = rhnSQL.prepare("""
-        insert into rhnPackageKeyAssociation
-            (package_id, key_id) values
-            (:package_id, :key_id)
-    """)
+    pkg_ids = _lookup_package_ids(checksum_type, checksum)
+    if not pkg_ids:
+        # No package to associate, continue with next
+        return
+
+    key_id = get_package_key_id(header)
+    if not key_id:
+        # package is not signed, skip gpg key insertion
+        return
+
+    _associate_package_key(pkg_ids, lookup_package_key(key_id))
+
+
+def get_package_key_id(header):
+    """ Returns the id of the gpg key which signed the package, if any """
+    sigkeys = rhn_rpm.RPM_Header(header).signatures
+    key_id = None  # _key_ids(sigkeys)[0]
+    for sig in sigkeys:
+        if sig['signature_type'] in ['gpg', 'pgp']:
+            key_id = sig['key_id']
+    return key_id
+
 
+def lookup_package_key(key_id):
+    """ Returns the rhnPackageKey id of a gpg key id, inserting the key if
+        it is new. Processes which may insert the same key at the same time
+        should serialize the calls, see importLib.set_lookup_lock().
+    """
     insert_keyid_sql = rhnSQL.prepare("""
         insert into rhnPackagekey
             (id, key_id, key_type_id) values
@@ -360,6 +397,28 @@ def processPackageKeyAssociations(header, checksum_type, checksum):
         where LABEL in ('gpg', 'pgp')
     """)
 
+    lookup_keyid_sql.execute(key_id=key_id)
+    keyid = lookup_keyid_sql.fetchall_dict()
+
+    if not keyid:
+        lookup_keytype_id.execute()
+        key_type_id = lookup_keytype_id.fetchone_dict()
+        insert_keyid_sql.execute(key_id=key_id, key_type_id=key_type_id['id'])
+        lookup_keyid_sql.execute(key_id=key_id)
+        keyid = lookup_keyid_sql.fetchall_dict()
+    return keyid[0]['id']
+
+
+def associate_package_key(package_key_id, checksum_type, checksum):
+    """ Associates the packages with the checksum with a key returned by
+        lookup_package_key()
+    """
+    pkg_ids = _lookup_package_ids(checksum_type, checksum)
+    if pkg_ids:
+        _associate_package_key(pkg_ids, package_key_id)
+
+
+def _lookup_package_ids(checksum_type, checksum):
     lookup_pkgid_sql = rhnSQL.prepare("""
         select p.id
           from rhnPackage p,
@@ -368,6 +427,16 @@ def processPackageKeyAssociations(header, checksum_type, checksum):
            and c.checksum_type = :ctype
            and p.checksum_id = c.id
     """)
+    lookup_pkgid_sql.execute(ctype=checksum_type, csum=checksum)
+    return lookup_pkgid_sql.fetchall_dict()
+
+
+def _associate_package_key(pkg_ids, package_key_id):
+    provider_sql = rhnSQL.prepare("""
+        insert into rhnPackageKeyAssociation
+            (package_id, key_id) values
+            (:package_id, :key_id)
+    """)
 
     lookup_pkgkey_sql = rhnSQL.prepare("""
         select 1
@@ -376,40 +445,13 @@ def processPackageKeyAssociations(header, checksum_type, checksum):
            and key_id = :key_id
     """)
 
-    lookup_pkgid_sql.execute(ctype=checksum_type, csum=checksum)
-    pkg_ids = lookup_pkgid_sql.fetchall_dict()
-
-    if not pkg_ids:
-        # No package to associate, continue with next
-        return
-
-    sigkeys = rhn_rpm.RPM_Header(header).signatures
-    key_id = None  # _key_ids(sigkeys)[0]
-    for sig in sigkeys:
-        if sig['signature_type'] in ['gpg', 'pgp']:
-            key_id = sig['key_id']
-
-    if not key_id:
-        # package is not signed, skip gpg key insertion
-        return
-
-    lookup_keyid_sql.execute(key_id=key_id)
-    keyid = lookup_keyid_sql.fetchall_dict()
-
-    if not keyid:
-        lookup_keytype_id.execute()
-        key_type_id = lookup_keytype_id.fetchone_dict()
-        insert_keyid_sql.execute(key_id=key_id, key_type_id=key_type_id['id'])
-        lookup_keyid_sql.execute(key_id=key_id)
-        keyid = lookup_keyid_sql.fetchall_dict()
-
     for pkg_id in pkg_ids:
-        lookup_pkgkey_sql.execute(key_id=keyid[0]['id'],
+        lookup_pkgkey_sql.execute(key_id=package_key_id,
                                   package_id=pkg_id['id'])
         exists_check = lookup_pkgkey_sql.fetchall_dict()
 
         if not exists_check:
-            provider_sql.execute(key_id=keyid[0]['id'], package_id=pkg_id['id'])
+            provider_sql.execute(key_id=package_key_id, package_id=pkg_id['id'])
 
 
 def package_delta(list1, list2):
@@ -459,32 +501,20 @@ def _package_list_to_hash(package_list, package_registry):
         for instance, version 51 and 0051 are indentical, but that would break the
         list comparison in Python. package_registry is storing representatives for
         each equivalence class (where the equivalence relationship is rpm's version
-        comparison algorigthm
+        comparison algorigthm), keyed on rhn_rpm.nvre_key()
         Side effect: Modifies second argument!
     """
     hash = {}
     for e in package_list:
         e = tuple(e)
-        pn = e[0]
-        if pn not in package_registry:
-            # Definitely new equivalence class
-            _add_to_hash(package_registry, pn, e)
-            _add_to_hash(hash, pn, e)
-            continue
-
-        # Look for a match for this package name in the registry
-        plist = list(package_registry[pn].keys())
-        for p in plist:
-            if rhn_rpm.nvre_compare(p, e) == 0:
-                # Packages are identical
-                e = p
-                break
+        key = rhn_rpm.nvre_key(e)
+        if key in package_registry:
+            # Packages are identical
+            e = package_registry[key]
         else:
-            # Package not found in the global registry - add it
-            _add_to_hash(package_registry, pn, e)
-
-        # Add it to the hash too
-        _add_to_hash(hash, pn, e)
+            # Definitely new equivalence class
+            package_registry[key] = e
+        _add_to_hash(hash, e[0], e)
 
     return hash
 
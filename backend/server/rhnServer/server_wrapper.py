@@ -67,9 +67,10 @@ class ServerWrapper(Packages, Hardware, History):
     def dispose_packages(self):
         return Packages.dispose_packages(self, self.server["id"])
 
-    def save_packages(self, schedule=1):
+    def save_packages(self, schedule=1, digest=None):
         """ wrapper for the Packages.save_packages_byid() which requires the sysid """
-        ret = self.save_packages_byid(self.server["id"], schedule=schedule)
+        ret = self.save_packages_byid(self.server["id"], schedule=schedule,
+                                      digest=digest)
         # this function is primarily called from outside
         # so we have to commit here
         rhnSQL.commit()
@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# Benchmark of the checksum verification done by a no-op reposync, i.e. one
+# where all the packages are on disk already, with and without the checksum
+# index. Files are generated in a temporary directory; no database is needed.
+# The files are in the page cache, so reading them costs less than it does
+# on a real, much bigger repository.
+#
+#   python bench_checksum_index.py [num_files] [file_size_kb]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from spacewalk.common.checksum import getFileChecksum
+from spacewalk.common.checksum_index import ChecksumIndex
+
+
+def make_files(directory, num_files, size):
+    paths = []
+    block = os.urandom(size)
+    for i in range(num_files):
+        path = os.path.join(directory, "package%d.rpm" % i)
+        f = open(path, "wb")
+        # Different content for every file
+        f.write(str(i))
+        f.write(block)
+        f.close()
+        paths.append(path)
+    return paths
+
+
+def resync_without_index(paths, checksums):
+    for path in paths:
+        assert getFileChecksum('sha256', filename=path) == checksums[path]
+
+
+def resync_with_index(paths, checksums, index_file):
+    index = ChecksumIndex(index_file)
+    for path in paths:
+        assert index.getFileChecksum('sha256', path) == checksums[path]
+    index.close()
+    return index.hits, index.misses
+
+
+def timed(function, *args):
+    start = time.time()
+    ret = function(*args)
+    return time.time() - start, ret
+
+
+def main():
+    num_files = 2000
+    size_kb = 1024
+    if len(sys.argv) > 1:
+        num_files = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        size_kb = int(sys.argv[2])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        paths = make_files(tmpdir, num_files, size_kb * 1024)
+        checksums = dict((path, getFileChecksum('sha256', filename=path)) for path in paths)
+        index_file = os.path.join(tmpdir, "checksum_index.db")
+        print("%d files of %d kB" % (num_files, size_kb))
+
+        elapsed, _ret = timed(resync_without_index, paths, checksums)
+        print("no-op resync, no index:        %8.3fs" % elapsed)
+        elapsed, (hits, misses) = timed(resync_with_index, paths, checksums, index_file)
+        print("no-op resync, empty index:     %8.3fs (%d hits, %d misses)" % (elapsed, hits, misses))
+        elapsed, (hits, misses) = timed(resync_with_index, paths, checksums, index_file)
+        print("no-op resync, populated index: %8.3fs (%d hits, %d misses)" % (elapsed, hits, misses))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
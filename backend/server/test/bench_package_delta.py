@@ -0,0 +1,122 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# Benchmark of server_packages.package_delta() on two synthetic package
+# profiles, against the previous implementation comparing every package
+# with the other versions of the same name through rpm.labelCompare().
+# Some names come in many versions, like kernel on a long-lived system.
+# No database is needed.
+#
+#   python bench_package_delta.py [num_packages]
+#
+
+import random
+import sys
+import time
+
+from spacewalk.common import rhn_rpm
+from spacewalk.server.rhnServer import server_packages
+
+
+def make_profiles(num_packages):
+    rnd = random.Random(1)
+    profile1 = []
+    profile2 = []
+    i = 0
+    while len(profile1) < num_packages:
+        name = "package%d" % i
+        # One name out of 50 has many versions installed
+        versions = 1
+        if i % 50 == 0:
+            versions = 30
+        for j in range(versions):
+            package = (name, "%d.%d.%d" % (j, rnd.randint(0, 20), rnd.randint(0, 9)),
+                       "%d.el7" % rnd.randint(1, 30), rnd.choice(['', '', '1']))
+            profile1.append(package)
+            choice = rnd.random()
+            if choice < 0.1:
+                # Updated
+                package = (name, package[1] + ".1", package[2], package[3])
+            elif choice < 0.2:
+                # Same version, written differently
+                package = (name, package[1].replace('.', '.0'), package[2], package[3])
+            profile2.append(package)
+        i = i + 1
+    return profile1, profile2
+
+
+def old_package_list_to_hash(package_list, package_registry):
+    hash = {}
+    for e in package_list:
+        e = tuple(e)
+        pn = e[0]
+        if pn not in package_registry:
+            package_registry[pn] = {e: None}
+            hash.setdefault(pn, {})[e] = None
+            continue
+        for p in list(package_registry[pn].keys()):
+            if rhn_rpm.nvre_compare(p, e) == 0:
+                e = p
+                break
+        else:
+            package_registry[pn][e] = None
+        hash.setdefault(pn, {})[e] = None
+    return hash
+
+
+def old_package_delta(list1, list2):
+    package_registry = {}
+    hash1 = old_package_list_to_hash(list1, package_registry)
+    hash2 = old_package_list_to_hash(list2, package_registry)
+    installs = []
+    removes = []
+    for pn, ph1 in hash1.items():
+        ph2 = hash2.pop(pn, {})
+        for p in ph1.keys():
+            if p not in ph2:
+                removes.append(p)
+            else:
+                del ph2[p]
+        installs.extend(ph2.keys())
+    for ph2 in hash2.values():
+        installs.extend(ph2.keys())
+    installs.sort()
+    removes.sort()
+    return installs, removes
+
+
+def timed(function, *args):
+    start = time.time()
+    ret = function(*args)
+    return time.time() - start, ret
+
+
+def main():
+    num_packages = 5000
+    if len(sys.argv) > 1:
+        num_packages = int(sys.argv[1])
+
+    profile1, profile2 = make_profiles(num_packages)
+    print("%d and %d packages" % (len(profile1), len(profile2)))
+    elapsed_old, delta_old = timed(old_package_delta, profile1, profile2)
+    print("labelCompare per pair: %8.3fs" % elapsed_old)
+    elapsed, delta = timed(server_packages.package_delta, profile1, profile2)
+    print("nvre_key:              %8.3fs (%d installs, %d removes)" % (
+        elapsed, len(delta[0]), len(delta[1])))
+    assert delta == delta_old
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# Load test of queue.get, the call every registered client polls: replays
+# the polls of the systems registered in the database the server is
+# configured for (/etc/rhn/rhn.conf), typically a local PostgreSQL filled
+# up with test registrations. Each system polls once per round; the polls
+# run in a number of threads, each with a database connection of its own.
+#
+#   python bench_queue_get.py [-n clients] [-r rounds] [-t threads]
+#                             [-i checkin_write_interval]
+#
+# Checkins are written to the database; don't run this against a
+# production server.
+#
+
+import sys
+import threading
+import time
+from optparse import OptionParser
+try:
+    #  python 2
+    from Queue import Queue, Empty
+except ImportError:
+    #  python3
+    from queue import Queue, Empty
+
+from spacewalk.common.rhnConfig import CFG, initCFG
+from spacewalk.common.rhnLog import initLOG
+from spacewalk.server import rhnSQL, rhnServer, rhnCapability
+from spacewalk.server.handlers.xmlrpc import queue
+
+# What a registered rhn-client-tools client sends along with every call
+CLIENT_CAPABILITIES = [
+    "caneatCheese(1)=1",
+    "packages.runTransaction(1)=1",
+    "packages.rollBack(1)=1",
+    "packages.verify(1)=1",
+    "packages.extended_profile(2)=1",
+    "packages.update(2)=2",
+    "reboot.reboot(1)=1",
+]
+
+
+class StatementCounter:
+
+    """ Counts the statements the polls prepare, and the commits. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.commits = 0
+        self._prepare = rhnSQL.prepare
+        self._commit = rhnSQL.commit
+
+    def install(self):
+        rhnSQL.prepare = self.prepare
+        rhnSQL.commit = self.commit
+
+    def prepare(self, *args, **kwargs):
+        self.lock.acquire()
+        self.statements += 1
+        self.lock.release()
+        return self._prepare(*args, **kwargs)
+
+    def commit(self):
+        self.lock.acquire()
+        self.commits += 1
+        self.lock.release()
+        return self._commit()
+
+
+def load_clients(num_clients):
+    h = rhnSQL.prepare("""
+        select id
+          from rhnServer
+         order by id
+    """)
+    h.execute()
+    clients = []
+    while len(clients) < num_clients:
+        row = h.fetchone_dict()
+        if not row:
+            break
+        server = rhnServer.search(row['id'])
+        clients.append(server.system_id())
+    return clients
+
+
+def poll(clients, latencies, errors):
+    while 1:
+        try:
+            systemid = clients.get_nowait()
+        except Empty:
+            return
+        start = time.time()
+        try:
+            queue.Queue().get(systemid, version=2)
+        except Exception:
+            errors.append(sys.exc_info()[1])
+            rhnSQL.rollback()
+        latencies.append(time.time() - start)
+
+
+def run_round(clients, num_threads):
+    todo = Queue()
+    for systemid in clients:
+        todo.put(systemid)
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=poll, args=(todo, latencies, errors))
+               for _i in range(num_threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, latencies, errors
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--clients", type="int", default=2000,
+                      help="number of simulated clients")
+    parser.add_option("-r", "--rounds", type="int", default=3,
+                      help="number of polls of every client")
+    parser.add_option("-t", "--threads", type="int", default=8,
+                      help="number of concurrent polls")
+    parser.add_option("-i", "--checkin-write-interval", type="int",
+                      help="override checkin_write_interval")
+    (options, _args) = parser.parse_args()
+
+    initCFG('server.xmlrpc')
+    initLOG("stderr", 0)
+    if options.checkin_write_interval is not None:
+        CFG.set('checkin_write_interval', options.checkin_write_interval)
+    rhnSQL.initDB(pool_size=options.threads)
+
+    clients = load_clients(options.clients)
+    rhnSQL.commit()
+    if not clients:
+        print("No registered systems in the database")
+        sys.exit(1)
+    print("%d clients, %d threads, checkin_write_interval = %s" % (
+        len(clients), options.threads, CFG.checkin_write_interval))
+
+    rhnCapability.set_client_capabilities(CLIENT_CAPABILITIES)
+    counter = StatementCounter()
+    counter.install()
+    for i in range(options.rounds):
+        statements, commits = counter.statements, counter.commits
+        elapsed, latencies, errors = run_round(clients, options.threads)
+        print("round %d: %8.3fs, %7.1f polls/s, latency median %6.1fms "
+              "p99 %6.1fms, %4.1f statements and %4.1f commits per poll, %d errors" % (
+                  i + 1, elapsed, len(latencies) / elapsed,
+                  1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.99),
+                  float(counter.statements - statements) / len(latencies),
+                  float(counter.commits - commits) / len(latencies), len(errors)))
+        if errors:
+            print("  first error: %s" % errors[0])
+
+
+if __name__ == '__main__':
+    main()
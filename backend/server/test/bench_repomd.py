@@ -0,0 +1,239 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# Benchmarks for repomd generation over a synthetic channel.
+# No database is needed; packages are generated in memory.
+#
+#   python bench_repomd.py [num_packages]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+try:
+    #  python 2
+    from StringIO import StringIO
+except ImportError:
+    #  python3
+    from io import StringIO
+
+from spacewalk.common import rhnCache
+from spacewalk.server.repomd import domain, mapper, repository, store, view
+
+LAST_MODIFIED = "20180101000000"
+
+
+def make_package(package_id):
+    """ Build a package of a realistic size with a few dozen deps and files. """
+    package = domain.Package(package_id)
+    package.name = "package%d" % package_id
+    package.version = "1.%d" % (package_id % 100)
+    package.release = "%d.el7" % (package_id % 7)
+    package.arch = "x86_64"
+    package.checksum_type = "sha256"
+    package.checksum = "%064x" % package_id
+    package.summary = "Summary of package %d" % package_id
+    package.description = "A longer description of package %d & co.\n" % package_id * 4
+    package.vendor = "Red Hat, Inc."
+    package.build_time = 1500000000 + package_id
+    package.package_size = 100000 + package_id
+    package.payload_size = 90000 + package_id
+    package.installed_size = 300000 + package_id
+    package.header_start = 1000
+    package.header_end = 20000
+    package.package_group = "System Environment/Base"
+    package.build_host = "builder.example.com"
+    package.copyright = "GPLv2+"
+    package.filename = "%s-%s-%s.%s.rpm" % (package.name, package.version,
+                                            package.release, package.arch)
+    package.source_rpm = "%s-%s-%s.src.rpm" % (package.name, package.version,
+                                               package.release)
+    for i in range(20):
+        package.provides.append(("lib%d-%d.so" % (package_id, i), "EQ", 0,
+                                 package.version, package.release))
+        package.requires.append(("lib%d.so" % i, "", 0, "", None))
+    for i in range(40):
+        package.files.append("/usr/%s/%s/file%d" % (i % 2 and "bin" or "share",
+                                                    package.name, i))
+    for i in range(10):
+        package.changelog.append({'author': "Dev <dev@example.com> - 1.%d" % i,
+                                  'date': 1400000000 + i,
+                                  'text': "- Fixed bug #%d" % i})
+    return package
+
+
+class FakePackageMapper:
+
+    """ Package mapper which renders synthetic packages instead of db rows. """
+
+    def __init__(self, package_ids):
+        self.last_modified = dict([(x, LAST_MODIFIED) for x in package_ids])
+        self.loaded = 0
+
+    def last_modified_bulk(self, package_ids):
+        return dict([(x, self.last_modified[x]) for x in package_ids
+                     if x in self.last_modified])
+
+    def get_packages(self, package_ids, _sections=None):
+        for package_id in package_ids:
+            self.loaded += 1
+            yield make_package(package_id)
+
+
+def get_repository(num_packages):
+    package_ids = list(range(1, num_packages + 1))
+
+    channel = domain.Channel(1)
+    channel.label = channel.name = "bench-channel"
+    channel.checksum_type = "sha256"
+    channel.package_ids = package_ids
+
+    repo = repository.Repository({'id': 1, 'last_modified': LAST_MODIFIED})
+    repo._channel = channel
+    repo._package_mapper = FakePackageMapper(package_ids)
+    return repo
+
+
+def generate(repo):
+    """ Render primary, filelists and other; return the time and output. """
+    views = [view.PrimaryView(repo.channel, StringIO()),
+             view.FilelistsView(repo.channel, StringIO()),
+             view.OtherView(repo.channel, StringIO())]
+    outputs = []
+    for viewobj in views:
+        # generate_files closes the files
+        viewobj.fileobj.close = lambda o=viewobj.fileobj: outputs.append(o.getvalue())
+    start = time.time()
+    repo.generate_files(views)
+    return time.time() - start, outputs
+
+
+def bench_incremental(num_packages):
+    repo = get_repository(num_packages)
+
+    elapsed, _ = generate(repo)
+    print("full regeneration:        %8.3fs, %d packages rendered"
+          % (elapsed, repo.package_mapper.loaded))
+
+    # One package changes
+    repo.package_mapper.loaded = 0
+    repo.package_mapper.last_modified[num_packages // 2] = "20180102000000"
+    elapsed, incremental = generate(repo)
+    print("incremental regeneration: %8.3fs, %d packages rendered"
+          % (elapsed, repo.package_mapper.loaded))
+
+    # Output has to match a fresh full regeneration
+    repo.fragment_store = store.PackageStore(tempfile.mkdtemp(dir=rhnCache.CACHEDIR))
+    _, full = generate(repo)
+    assert incremental == full, "incremental output differs from full output"
+
+    # A package removed from the channel meanwhile is neither written nor
+    # counted in the headers
+    del repo.package_mapper.last_modified[1]
+    _, outputs = generate(repo)
+    for output in outputs:
+        assert output.count("<package ") == num_packages - 1
+        assert 'packages="%d"' % (num_packages - 1) in output
+
+
+def prco_rows(package_id):
+    """ Return the prco query rows of a package: (type, sense, name, version). """
+    rows = []
+    for i in range(10):
+        # Every package provides itself and a few things of its own ...
+        rows.append(("provides", 8, "package%d-lib%d.so()(64bit)" % (package_id, i),
+                     "0:1.%d-%d.el7" % (package_id % 100, package_id % 7)))
+    for i in range(30):
+        # ... but mostly requires the same few hundred common things
+        rows.append(("requires", 12, "lib%d.so()(64bit)" % ((package_id + i * 7) % 300),
+                     "0:2.%d-1.el7" % (i % 5)))
+        rows.append(("requires", 0, "/usr/bin/tool%d" % (i % 20), None))
+    return rows
+
+
+def load_dict_deps(num_packages):
+    """ Dependencies the way the mapper used to keep them: a dict per row. """
+    packages = []
+    for package_id in range(1, num_packages + 1):
+        deps = []
+        for _kind, sense, name, version in prco_rows(package_id):
+            epoch, version, release = 0, version or "", None
+            if version:
+                epoch, version = version.split(':')
+                version, release = version.split('-')
+            deps.append({'name': mapper.string_to_unicode(name),
+                         'flag': sense and mapper._get_relation(sense) or "",
+                         'version': version, 'release': release, 'epoch': epoch})
+        packages.append(deps)
+    return packages
+
+
+def load_pooled_deps(num_packages):
+    """ Dependencies as shared tuples out of a DependencyPool. """
+    pool = mapper.DependencyPool()
+    packages = []
+    for package_id in range(1, num_packages + 1):
+        packages.append([pool.get(sense, name, version)
+                         for _kind, sense, name, version in prco_rows(package_id)])
+    return packages
+
+
+def _rss_kb():
+    status = open("/proc/self/status")
+    try:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    finally:
+        status.close()
+    return 0
+
+
+def bench_memory(num_packages):
+    """ Load the deps of a channel in a child process; report time and RSS. """
+    for label, load in (("dicts", load_dict_deps), ("pooled tuples", load_pooled_deps)):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            before = _rss_kb()
+            start = time.time()
+            packages = load(num_packages)
+            elapsed = time.time() - start
+            os.write(write_fd, ("%f %d" % (elapsed, _rss_kb() - before)).encode())
+            del packages
+            os._exit(0)
+        os.close(write_fd)
+        result = os.read(read_fd, 100).decode().split()
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        print("deps as %-14s %8.3fs, %8d kB" % (label + ":", float(result[0]),
+                                                int(result[1])))
+
+
+if __name__ == '__main__':
+    packages = 40000
+    if len(sys.argv) > 1:
+        packages = int(sys.argv[1])
+
+    cache_dir = tempfile.mkdtemp()
+    rhnCache.CACHEDIR = cache_dir
+    try:
+        bench_incremental(packages)
+        bench_memory(packages)
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,198 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# Benchmark of the parsers of xmlSource over a synthetic package dump, as
+# satellite-sync downloads it: packages of a realistic size with a few
+# dozen deps, files and changelog entries. The dump is written to a
+# temporary file first. No database is needed; the configuration is read
+# from /etc/rhn/rhn.conf for the checksum priorities.
+#
+#   python bench_xml_parse.py [num_packages]
+#
+
+import os
+import sys
+import tempfile
+import time
+
+from spacewalk.common.rhnConfig import initCFG
+from spacewalk.satellite_tools import xmlSource
+from spacewalk.satellite_tools.exporter.xmlWriter import XMLWriter
+
+
+def write_package(writer, package_id):
+    writer.open_tag('rhn-package', attributes={
+        'id': "rhn-package-%d" % package_id,
+        'org-id': "",
+        'name': "package%d" % package_id,
+        'version': "1.%d" % (package_id % 100),
+        'release': "%d.el7" % (package_id % 7),
+        'epoch': "",
+        'package-arch': "x86_64",
+        'package-group': "System Environment/Base",
+        'rpm-version': "4.11.3",
+        'package-size': 100000 + package_id,
+        'payload-size': 90000 + package_id,
+        'installed-size': 300000 + package_id,
+        'build-host': "builder.example.com",
+        'source-rpm': "package%d-1.0-1.el7.src.rpm" % package_id,
+        'payload-format': "cpio",
+        'compat': 0,
+        'cookie': "builder.example.com 1500000000",
+        'build-time': 1500000000 + package_id,
+        'last-modified': 1500000000 + package_id,
+    })
+    fields = [
+        ('rhn-package-summary', "Summary of package %d" % package_id),
+        ('rhn-package-description', "A longer description of package %d & co.\n" % package_id * 4),
+        ('rhn-package-vendor', "Red Hat, Inc."),
+        ('rhn-package-copyright', "GPLv2+"),
+        ('rhn-package-header-sig', None),
+        ('rhn-package-header-start', 1000),
+        ('rhn-package-header-end', 20000),
+    ]
+    for tag, value in fields:
+        write_field(writer, tag, value)
+
+    writer.open_tag('checksums')
+    writer.empty_tag('checksum', attributes={'type': "sha256", 'value': "%064x" % package_id})
+    writer.close_tag('checksums')
+
+    writer.open_tag('rhn-package-changelog')
+    for i in range(10):
+        writer.open_tag('rhn-package-changelog-entry')
+        write_field(writer, 'rhn-package-changelog-entry-name', "Dev <dev@example.com> - 1.%d" % i)
+        write_field(writer, 'rhn-package-changelog-entry-text', "- Fixed bug #%d\n- Rebuilt" % i)
+        write_field(writer, 'rhn-package-changelog-entry-time', 1400000000 + i)
+        writer.close_tag('rhn-package-changelog-entry')
+    writer.close_tag('rhn-package-changelog')
+
+    deps = [
+        ('rhn-package-requires', "lib%d.so()(64bit)", 20),
+        ('rhn-package-provides', "lib%d-%%d.so()(64bit)" % package_id, 20),
+        ('rhn-package-conflicts', None, 0),
+        ('rhn-package-obsoletes', "package%d-old", 1),
+    ]
+    for tag, name, count in deps:
+        if not count:
+            writer.empty_tag(tag)
+            continue
+        writer.open_tag(tag)
+        for i in range(count):
+            dep_name = name % i
+            if tag == 'rhn-package-requires' and i == 0:
+                dep_name = "rpmlib(FileDigests)"
+            writer.empty_tag(tag + '-entry', attributes={
+                'name': dep_name, 'version': "", 'sense': 16384})
+        writer.close_tag(tag)
+
+    writer.open_tag('rhn-package-files')
+    for i in range(40):
+        writer.empty_tag('rhn-package-file', attributes={
+            'name': "/usr/share/package%d/file%d" % (package_id, i),
+            'device': 64769,
+            'inode': package_id * 100 + i,
+            'file-mode': 33188,
+            'username': "root",
+            'groupname': "root",
+            'rdev': 0,
+            'file-size': 1000 + i,
+            'mtime': 1500000000,
+            'checksum-type': "sha256",
+            'checksum': "%064x" % i,
+            'linkto': "",
+            'flags': 0,
+            'verifyflags': -1,
+            'lang': "",
+        })
+    writer.close_tag('rhn-package-files')
+    writer.close_tag('rhn-package')
+
+
+def write_field(writer, tag, value):
+    writer.open_tag(tag)
+    if value is None:
+        writer.empty_tag('rhn-null')
+    else:
+        writer.data(str(value))
+    writer.close_tag(tag)
+
+
+def write_dump(filename, num_packages):
+    stream = open(filename, "w")
+    writer = XMLWriter(stream)
+    writer.open_tag('rhn-satellite', attributes={'version': "3.10", 'generation': 2})
+    writer.open_tag('rhn-packages')
+    for package_id in range(1, num_packages + 1):
+        write_package(writer, package_id)
+    writer.close_tag('rhn-packages')
+    writer.close_tag('rhn-satellite')
+    stream.close()
+
+
+class PackageContainer(xmlSource.PackageContainer):
+
+    """ Keeps the packages parsed, but not their batch. """
+
+    def __init__(self):
+        xmlSource.PackageContainer.__init__(self)
+        self.packages = []
+
+    def endItemCallback(self):
+        xmlSource.PackageContainer.endItemCallback(self)
+        self.packages.extend(self.batch)
+        del self.batch[:]
+
+
+def parse(filename, parser):
+    container = PackageContainer()
+    handler = xmlSource.SatelliteDispatchHandler(parser)
+    handler.set_container(container)
+    stream = open(filename, "r")
+    start = time.time()
+    handler.process(stream)
+    elapsed = time.time() - start
+    stream.close()
+    handler.close()
+    return elapsed, container.packages
+
+
+def main():
+    num_packages = 2000
+    if len(sys.argv) > 1:
+        num_packages = int(sys.argv[1])
+
+    initCFG('server.satellite')
+    fd, filename = tempfile.mkstemp(prefix="bench_xml_parse-", suffix=".xml")
+    os.close(fd)
+    try:
+        write_dump(filename, num_packages)
+        print("%d packages, %.1f MB" % (num_packages, os.path.getsize(filename) / 1048576.0))
+        results = {}
+        for parser in xmlSource.PARSERS:
+            elapsed, packages = parse(filename, parser)
+            results[parser] = packages
+            print("%-6s %8.3fs, %7.1f packages/s" % (parser, elapsed, len(packages) / elapsed))
+        # Both parsers have to create the same items
+        expected = [package.data for package in results['sax']]
+        assert len(expected) == num_packages
+        for parser in xmlSource.PARSERS:
+            assert [package.data for package in results[parser]] == expected
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from spacewalk.common import checksum_index
+from spacewalk.common.checksum import getFileChecksum
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index_file = os.path.join(self.tmpdir, "index", "checksums.db")
+        self.path = os.path.join(self.tmpdir, "package.rpm")
+        self._write(self.path, "first content")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def _write(path, content, mtime=1500000000):
+        f = open(path, "w")
+        f.write(content)
+        f.close()
+        os.utime(path, (mtime, mtime))
+
+    def test_remembered_across_instances(self):
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.getFileChecksum('sha256', self.path),
+                         getFileChecksum('sha256', filename=self.path))
+        self.assertEqual(index.misses, 1)
+        index.close()
+
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.get(self.path, 'sha256'),
+                         getFileChecksum('sha256', filename=self.path))
+        index.getFileChecksum('sha256', self.path)
+        self.assertEqual((index.hits, index.misses), (1, 0))
+        # Other checksum types are computed on demand
+        self.assertEqual(index.get(self.path, 'md5'), None)
+        index.close()
+
+    def test_changed_file_is_read_again(self):
+        index = checksum_index.ChecksumIndex(self.index_file)
+        index.getFileChecksum('sha256', self.path)
+        index.close()
+
+        # Same size, different mtime
+        self._write(self.path, "other content", mtime=1500000001)
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.get(self.path, 'sha256'), None)
+        self.assertEqual(index.getFileChecksum('sha256', self.path),
+                         getFileChecksum('sha256', filename=self.path))
+        self.assertEqual(index.misses, 1)
+        index.close()
+
+        # Replaced by another file with the same size and mtime
+        other = os.path.join(self.tmpdir, "other.rpm")
+        self._write(other, "other content", mtime=1500000001)
+        os.rename(other, self.path)
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.get(self.path, 'sha256'), None)
+        index.close()
+
+    def test_checksums_kept_per_type(self):
+        index = checksum_index.ChecksumIndex(self.index_file)
+        index.set(self.path, {'sha256': 'a' * 64})
+        index.flush()
+        index.set(self.path, {'md5': 'b' * 32})
+        index.close()
+
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.get(self.path, 'sha256'), 'a' * 64)
+        self.assertEqual(index.get(self.path, 'md5'), 'b' * 32)
+        index.remove(self.path)
+        self.assertEqual(index.get(self.path, 'md5'), None)
+        index.close()
+
+    def test_concurrent_reader(self):
+        writer = checksum_index.ChecksumIndex(self.index_file)
+        writer.getFileChecksum('sha256', self.path)
+        writer.flush()
+        # A reader sees what was written out while the writer is still open
+        reader = checksum_index.ChecksumIndex(self.index_file, timeout=0)
+        self.assertEqual(reader.get(self.path, 'sha256'),
+                         getFileChecksum('sha256', filename=self.path))
+        reader.close()
+        writer.close()
+
+    def test_unusable_index(self):
+        # A directory where the index file should be
+        os.makedirs(self.index_file)
+        index = checksum_index.ChecksumIndex(self.index_file)
+        self.assertEqual(index.getFileChecksum('sha256', self.path),
+                         getFileChecksum('sha256', filename=self.path))
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import sqlite3
+import unittest
+
+from spacewalk.server.importlib import backend
+from spacewalk.server.importlib.backendOracle import OracleBackend
+from spacewalk.server.importlib.importLib import Erratum
+
+ERRATA_TABLES = ['rhnErrata', 'rhnChannelErrata', 'rhnErrataBugList', 'rhnErrataFile',
+                 'rhnErrataKeyword', 'rhnErrataPackage', 'rhnErrataCVE', 'rhnCVE',
+                 'rhnErrataFilePackage']
+
+
+class Cursor:
+
+    def __init__(self, db, sql):
+        self.db = db
+        self.sql = sql
+        self.cursor = None
+
+    def execute(self, **kwargs):
+        self.db.queries.append(self.sql)
+        self.cursor = self.db.dbh.execute(self.sql, kwargs)
+
+    def executemany(self, **kwargs):
+        self.db.queries.append(self.sql)
+        keys = list(kwargs.keys())
+        rows = [dict(zip(keys, values)) for values in zip(*[kwargs[k] for k in keys])]
+        self.db.dbh.executemany(self.sql, rows)
+        return len(rows)
+
+    def _dict(self, row):
+        return dict(zip([d[0] for d in self.cursor.description], row))
+
+    def fetchone_dict(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return self._dict(row)
+
+    def fetchall_dict(self):
+        return [self._dict(row) for row in self.cursor.fetchall()] or None
+
+
+class Sequence:
+
+    def __init__(self):
+        self.value = 0
+
+    def next(self):
+        self.value = self.value + 1
+        return self.value
+
+    def next_block(self, count):
+        return [self.next() for _i in range(count)]
+
+    def preallocate(self, count):
+        pass
+
+
+class Database:
+
+    """ Enough of rhnSQL to import errata into SQLite. """
+
+    def __init__(self):
+        self.dbh = sqlite3.connect(":memory:")
+        self.dbh.text_factory = str
+        for name in ERRATA_TABLES:
+            fields = OracleBackend.tables[name].getFields().keys()
+            self.dbh.execute("create table %s (%s)" % (name, ", ".join(fields)))
+        self.dbh.execute("create table rhnChannel (id integer, label text)")
+        self.dbh.executemany("insert into rhnChannel values (?, ?)",
+                             [(1, 'base-channel'), (2, 'child-channel'), (3, 'other-channel')])
+        self.queries = []
+        self.procedures = []
+
+    def prepare(self, sql, blob_map=None):
+        # SQLite locks the whole database anyway
+        return Cursor(self, sql.replace("for update", ""))
+
+    def Procedure(self, name):
+        return lambda *args: self.procedures.append((name,) + args)
+
+    def rows(self, sql):
+        return sorted(self.dbh.execute(sql).fetchall())
+
+    def count(self, prefix):
+        return len([sql for sql in self.queries if sql.strip().startswith(prefix)])
+
+
+def erratum(i, channels=(1, ), keywords=('reboot_suggested', ), cves=(1, 2)):
+    e = Erratum()
+    e.populate({
+        'advisory': "RHSA-2018:%04d" % i,
+        'advisory_name': "RHSA-2018:%04d" % i,
+        'advisory_rel': 1,
+        'advisory_type': 'Security Advisory',
+        'synopsis': "Update %d" % i,
+        'issue_date': '2018-01-01 00:00:00',
+        'update_date': '2018-01-02 00:00:00',
+        'org_id': None,
+        'channels': [{'channel_id': c} for c in channels],
+        'packages': [{'package_id': 100 + i}],
+        'files': [],
+        'keywords': [{'keyword': k} for k in keywords],
+        'bugs': [{'bug_id': 1000 + i, 'summary': "Bug %d" % i, 'href': None}],
+        'cve': [{'cve_id': c} for c in cves],
+    })
+    return e
+
+
+class ErrataBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Database()
+        self.backend = OracleBackend()
+        self.backend.dbmodule = self.db
+        self.backend.lookupChunkSize = 2
+        for name in backend.sequences:
+            self.backend.sequences[name] = Sequence()
+        self.taskomatic = backend.taskomatic
+        backend.taskomatic = self
+        self.repodata = []
+
+    def tearDown(self):
+        backend.taskomatic = self.taskomatic
+
+    def add_to_repodata_queue(self, channel, client, reason):
+        self.repodata.append((channel, client, reason))
+
+    def _import(self, errata):
+        dml = self.backend.processErrata(errata)
+        return self.backend.update_channels_affected_by_errata(dml)
+
+    def test_process_errata(self):
+        self.assertEqual(self._import([erratum(i) for i in range(5)]), ['base-channel'])
+        self.assertEqual(len(self.db.rows("select * from rhnErrata")), 5)
+        self.assertEqual(self.db.rows("select errata_id, keyword from rhnErrataKeyword"),
+                         [(i, 'reboot_suggested') for i in range(1, 6)])
+        self.assertEqual(self.db.procedures, [('rhn_channel.update_channel', 1, 0)])
+        self.assertEqual(self.db.count("select id"), 1)
+        self.assertEqual(len(self.repodata), 1)
+
+        # Same errata again, two of them changed
+        del self.db.queries[:]
+        del self.db.procedures[:]
+        errata = [erratum(i) for i in range(5)]
+        errata[1] = erratum(1, channels=(1, 2), keywords=())
+        errata[3] = erratum(3, cves=(2, 3))
+        self.assertEqual(self._import(errata), ['base-channel', 'child-channel'])
+        self.assertEqual([e.diff_result.level for e in errata], [0, 4, 0, 4, 0])
+        self.assertEqual(self.db.rows("select errata_id, channel_id from rhnChannelErrata"),
+                         [(1, 1), (2, 1), (2, 2), (3, 1), (4, 1), (5, 1)])
+        self.assertEqual(self.db.rows("select errata_id from rhnErrataKeyword"),
+                         [(1, ), (3, ), (4, ), (5, )])
+        self.assertEqual(self.db.rows("select errata_id, cve_id from rhnErrataCVE where errata_id = 4"),
+                         [(4, 2), (4, 3)])
+        # A query per child table and chunk of errata
+        self.assertEqual(self.db.count("select * from rhnErrataKeyword"), 3)
+        self.assertEqual(self.db.count("select * from rhnChannelErrata"), 3)
+        # The channel rows are locked and updated in the order of their ids
+        self.assertEqual(self.db.procedures,
+                         [('rhn_channel.update_channel', 1, 0), ('rhn_channel.update_channel', 2, 0)])
+
+    def test_process_cves(self):
+        self.db.dbh.execute("insert into rhnCVE values (42, 'CVE-2018-0001')")
+        self.backend.sequences['rhnCVE'].value = 100
+        cves = dict([("CVE-2018-%04d" % i, None) for i in range(1, 6)])
+        self.backend.processCVEs(cves)
+        self.assertEqual(cves['CVE-2018-0001'], 42)
+        self.assertEqual(sorted(cves.values()), [42, 101, 102, 103, 104])
+        self.assertEqual(len(self.db.rows("select * from rhnCVE")), 5)
+        self.assertEqual(self.db.count("select id, name from rhnCVE"), 3)
+
+    def test_do_diff(self):
+        self.db.dbh.executemany("insert into rhnErrataFilePackage values (?, ?)",
+                                [(1, 10), (1, 11), (2, 20), (3, 30)])
+        data = [{'errata_file_id': 1, 'package_id': 10},
+                {'errata_file_id': 2, 'package_id': 21},
+                {'errata_file_id': 4, 'package_id': 40}]
+        self.backend._do_diff(data, 'rhnErrataFilePackage', ['errata_file_id', 'package_id'], [])
+        self.assertEqual(self.db.rows("select * from rhnErrataFilePackage"),
+                         [(1, 10), (2, 21), (3, 30), (4, 40)])
+        self.assertEqual(self.db.count("select errata_file_id"), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
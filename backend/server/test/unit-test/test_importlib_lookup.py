@@ -0,0 +1,118 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import sqlite3
+import unittest
+
+from spacewalk.server.importlib.backendLib import Table, TableLookup, DBint, DBstring
+
+
+class Cursor:
+
+    def __init__(self, dbh, sql):
+        self.dbh = dbh
+        self.sql = sql
+        self.cursor = None
+
+    def execute(self, **kwargs):
+        self.cursor = self.dbh.execute(self.sql, kwargs)
+
+    def _dict(self, row):
+        return dict(zip([d[0] for d in self.cursor.description], row))
+
+    def fetchone_dict(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return self._dict(row)
+
+    def fetchall_dict(self):
+        return [self._dict(row) for row in self.cursor.fetchall()] or None
+
+
+class Database:
+
+    """ Enough of rhnSQL to run the lookups against SQLite. """
+
+    def __init__(self):
+        self.dbh = sqlite3.connect(":memory:")
+        self.dbh.text_factory = str
+        self.dbh.execute("""
+            create table rhnTest (id integer, name_id integer, label text, org_id integer)
+        """)
+
+    def prepare(self, sql, blob_map=None):
+        return Cursor(self.dbh, sql)
+
+
+class TableLookupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Database()
+        table = Table('rhnTest',
+                      fields={
+                          'id': DBint(),
+                          'name_id': DBint(),
+                          'label': DBstring(64),
+                          'org_id': DBint(),
+                      },
+                      pk=['name_id', 'label', 'org_id'],
+                      nullable=['org_id'])
+        self.lookup = TableLookup(table, self.db)
+        rows = [(1, 1, 'a', None), (2, 1, 'a', 1), (3, 2, 'b', 1), (4, 3, u'\xe9', None)]
+        self.db.dbh.executemany("insert into rhnTest values (?, ?, ?, ?)", rows)
+
+    def _objects(self):
+        return [
+            {'name_id': 1, 'label': 'a', 'org_id': None},
+            {'name_id': 1, 'label': 'a', 'org_id': 1},
+            {'name_id': 1, 'label': 'a', 'org_id': 2},
+            {'name_id': 2, 'label': 'b', 'org_id': ''},
+            {'name_id': '2', 'label': 'b', 'org_id': 1},
+            {'name_id': 3, 'label': u'\xe9', 'org_id': None},
+        ]
+
+    def test_same_rows_as_query(self):
+        expected = [self.lookup.query(o).fetchone_dict() for o in self._objects()]
+        lookup = TableLookup(self.lookup.table, self.db)
+        lookup.prefetch(self._objects())
+        self.assertEqual([lookup.fetch(o) for o in self._objects()], expected)
+        self.assertEqual([row and row['id'] for row in expected], [1, 2, None, None, 3, 4])
+        # One query per null pattern of the primary key
+        self.assertEqual(lookup.queryCount, 2)
+        self.assertEqual(lookup.objectCount, 6)
+
+    def test_chunks(self):
+        self.lookup.chunkSize = 2
+        objects = [{'name_id': i, 'label': 'a', 'org_id': 1} for i in range(5)]
+        self.lookup.prefetch(objects)
+        self.assertEqual(self.lookup.queryCount, 3)
+        self.assertEqual([self.lookup.fetch(o) and 1 for o in objects], [None, 1, None, None, None])
+        self.assertEqual(self.lookup.queryCount, 3)
+
+    def test_prefetched_once(self):
+        obj = {'name_id': 5, 'label': 'new', 'org_id': None}
+        self.lookup.prefetch([obj, obj])
+        self.assertEqual(self.lookup.fetch(obj), None)
+        self.assertEqual(self.lookup.queryCount, 1)
+        # Inserted since; the second lookup has to see it
+        self.db.dbh.execute("insert into rhnTest values (5, 5, 'new', null)")
+        self.assertEqual(self.lookup.fetch(obj)['id'], 5)
+        self.assertEqual(self.lookup.queryCount, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from spacewalk.server.repomd import domain, store
+
+
+def _package(package_id, name):
+    package = domain.Package(str(package_id))
+    package.name = name
+    package.version = "1.0"
+    package.release = "1"
+    package.build_time = 1500000000.0
+    package.provides.append((name, "EQ", 0, "1.0", "1"))
+    package.files.append("/usr/bin/" + name)
+    package.changelog.append({'author': "dev", 'date': 1400000000.0,
+                              'text': "- initial"})
+    return package
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = store.PackageStore(self.path, num_buckets=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_roundtrip(self):
+        self.store.set(_package(1, "foo"), "20180101000000")
+        package = self.store.get("1", "20180101000000")
+        self.assertEqual(package.name, "foo")
+        self.assertEqual(package.provides, [("foo", "EQ", 0, "1.0", "1")])
+        self.assertEqual(package.files, ["/usr/bin/foo"])
+        self.assertEqual(package.changelog[0]['text'], "- initial")
+
+    def test_stale(self):
+        self.store.set(_package(1, "foo"), "20180101000000")
+        self.assertEqual(self.store.get("1", "20180102000000"), None)
+        self.assertEqual(self.store.get("2", "20180101000000"), None)
+
+    def test_sections(self):
+        self.store.set(_package(1, "foo"), "20180101000000")
+        package = self.store.get("1", "20180101000000",
+                                 (domain.PACKAGE_DETAILS, domain.PACKAGE_FILES))
+        self.assertEqual(package.files, ["/usr/bin/foo"])
+        self.assertEqual(package.changelog, [])
+
+    def test_other_process(self):
+        # A second store on the same files sees what the first one wrote
+        self.store.set_many([(_package(x, "foo%d" % x), "20180101000000")
+                             for x in range(10)])
+        other = store.PackageStore(self.path, num_buckets=4)
+        self.assertEqual(other.get("7", "20180101000000").name, "foo7")
+
+        self.store.set(_package(7, "bar"), "20180102000000")
+        self.assertEqual(other.get("7", "20180102000000").name, "bar")
+
+    def test_compact(self):
+        old_min_garbage = store.MIN_GARBAGE
+        store.MIN_GARBAGE = 0
+        try:
+            for i in range(5):
+                self.store.set_many([(_package(x, "foo%d-%d" % (x, i)), str(i))
+                                     for x in range(10)])
+        finally:
+            store.MIN_GARBAGE = old_min_garbage
+        for x in range(10):
+            self.assertEqual(self.store.get(str(x), "4").name, "foo%d-4" % x)
+
+    def test_threads(self):
+        # Stores in threads of the same process write the same buckets
+        def write(first):
+            writer = store.PackageStore(self.path, num_buckets=4)
+            for x in range(first, first + 40):
+                writer.set(_package(x, "foo%d" % x), "1")
+        threads = [threading.Thread(target=write, args=(x * 40, )) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for x in range(160):
+            self.assertEqual(self.store.get(str(x), "1").name, "foo%d" % x)
+
+    def test_fragments(self):
+        self.store.set_fragments([(1, "1", {'primary': "<p1/>", 'other': "<o1/>"})])
+        self.store.set(_package(1, "foo"), "1")
+        self.assertEqual(self.store.get_fragments([(1, "1")], ['other', 'primary']),
+                         {1: ["<o1/>", "<p1/>"]})
+        self.assertEqual(self.store.get_fragments([(1, "1")], ['filelists']), {})
+        self.assertEqual(self.store.get("1", "1").name, "foo")
+
+        # A changed package loses all its fragments
+        self.store.set(_package(1, "bar"), "2")
+        self.assertEqual(self.store.get_fragments([(1, "2")], ['primary']), {})
+
+    def test_prune(self):
+        self.store.set_many([(_package(x, "foo%d" % x), "1") for x in range(10)])
+        self.assertTrue(self.store.prune(lambda ids: [x for x in ids if x % 3]))
+        self.assertEqual(self.store.get("3", "1"), None)
+        self.assertEqual(self.store.get("4", "1").name, "foo4")
+        # Not again before PRUNE_INTERVAL is over
+        self.assertFalse(self.store.prune(lambda ids: []))
+        self.assertEqual(self.store.get("4", "1").name, "foo4")
+
+if __name__ == '__main__':
+    sys.exit(unittest.main() or 0)
@@ -0,0 +1,98 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+from spacewalk.common import rhnFlags
+from spacewalk.server import rhnCapability
+
+
+class FakeCursor:
+
+    def __init__(self, db, sql):
+        self.db = db
+        self.sql = sql
+
+    def execute(self, **kwargs):
+        self.db.executed.append((self.sql, kwargs))
+
+    def executemany(self, **kwargs):
+        self.db.executed.append((self.sql, kwargs))
+
+    def fetchone_dict(self):
+        return None
+
+
+class FakeRhnSQL:
+
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+
+    def prepare(self, sql):
+        return FakeCursor(self, sql)
+
+    def commit(self):
+        self.commits = self.commits + 1
+
+
+class CapabilityDigestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rhnSQL = rhnCapability.rhnSQL
+        rhnCapability.rhnSQL = self.db = FakeRhnSQL()
+        rhnFlags.reset()
+        rhnCapability.set_client_capabilities([
+            "packages.runTransaction(1)=1",
+            "packages.update(2)=2",
+        ])
+
+    def tearDown(self):
+        rhnCapability.rhnSQL = self.rhnSQL
+        rhnFlags.reset()
+
+    def test_digest(self):
+        caps = rhnCapability.get_client_capabilities()
+        digest = rhnCapability.client_capabilities_digest(caps)
+        # Only the names and versions are stored
+        rhnCapability.set_client_capabilities([
+            "packages.update(2)=1",
+            "packages.runTransaction(1)=1",
+        ])
+        self.assertEqual(rhnCapability.client_capabilities_digest(
+            rhnCapability.get_client_capabilities()), digest)
+        rhnCapability.set_client_capabilities(["packages.update(3)=2"])
+        self.assertNotEqual(rhnCapability.client_capabilities_digest(
+            rhnCapability.get_client_capabilities()), digest)
+
+    def test_unchanged_capabilities_skipped(self):
+        rhnCapability.update_client_capabilities(1000010000)
+        self.assertEqual(self.db.commits, 1)
+        sql, params = self.db.executed[-1]
+        self.assertTrue("capabilities_digest" in sql)
+
+        self.db.executed = []
+        rhnCapability.update_client_capabilities(1000010000, params['digest'])
+        self.assertEqual(self.db.executed, [])
+        self.assertEqual(self.db.commits, 1)
+
+        rhnCapability.set_client_capabilities(["packages.update(3)=2"])
+        rhnCapability.update_client_capabilities(1000010000, params['digest'])
+        self.assertEqual(self.db.commits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+from spacewalk.server.rhnSQL import driver_postgresql
+
+
+class FakeRealCursor:
+
+    """ Records what psycopg2 would be asked to run. """
+
+    description = None
+
+    def __init__(self):
+        self.statements = []
+        self.rowcount = 0
+
+    def execute(self, sql, params):
+        self.statements.append((sql, params))
+        self.rowcount = sql.count("), (") + 1
+
+    def executemany(self, sql, rows):
+        for row in rows:
+            self.statements.append((sql, row))
+        self.rowcount = 1
+
+
+class FakeConnection:
+
+    def cursor(self):
+        return FakeRealCursor()
+
+
+class BulkTests(unittest.TestCase):
+
+    def _cursor(self, sql):
+        return driver_postgresql.Cursor(dbh=FakeConnection(), sql=sql, force=1)
+
+    def test_multi_row_insert(self):
+        h = self._cursor("insert into rhnServerPackage (server_id, name_id) "
+                         "values (:sysid, LOOKUP_PACKAGE_NAME(:n))")
+        rowcount = h.execute_bulk({'sysid': [1, 1, 1], 'n': ['a', 'b', 'c']})
+        self.assertEqual(rowcount, 3)
+        self.assertEqual(len(h._real_cursor.statements), 1)
+        sql, params = h._real_cursor.statements[0]
+        self.assertEqual(sql, "insert into rhnServerPackage (server_id, name_id) values "
+                         "(%(sysid_0)s, LOOKUP_PACKAGE_NAME(%(n_0)s)), "
+                         "(%(sysid_1)s, LOOKUP_PACKAGE_NAME(%(n_1)s)), "
+                         "(%(sysid_2)s, LOOKUP_PACKAGE_NAME(%(n_2)s))")
+        self.assertEqual(params, {'sysid_0': 1, 'sysid_1': 1, 'sysid_2': 1,
+                                  'n_0': 'a', 'n_1': 'b', 'n_2': 'c'})
+
+    def test_chunks(self):
+        h = self._cursor("insert into t (id) values (:id)")
+        h.execute_bulk({'id': list(range(5))}, chunk_size=2)
+        self.assertEqual(len(h._real_cursor.statements), 3)
+
+    def test_other_statements(self):
+        h = self._cursor("delete from t where id = :id")
+        h.execute_bulk({'id': [1, 2]})
+        self.assertEqual(h._real_cursor.statements,
+                         [("delete from t where id = %(id)s", {'id': 1}),
+                          ("delete from t where id = %(id)s", {'id': 2})])
+
+    def test_disabled(self):
+        h = self._cursor("insert into t (id) values (:id)")
+        h.bulk = 0
+        h.execute_bulk({'id': [1, 2]})
+        self.assertEqual(len(h._real_cursor.statements), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import threading
+import time
+import unittest
+
+from spacewalk.server.rhnSQL import sql_base, sql_pool
+
+
+class FakeDatabase(sql_base.Database):
+
+    """ Counts connects and rollbacks instead of talking to a database. """
+
+    connections = 0
+
+    def __init__(self):
+        sql_base.Database.__init__(self)
+        self.alive = 0
+        self.rollbacks = 0
+        # Closed by the server: is_alive can't tell, a round trip fails
+        self.broken = 0
+        self.checks = 0
+
+    def connect(self, reconnect=1):
+        FakeDatabase.connections = FakeDatabase.connections + 1
+        self.alive = 1
+
+    def is_alive(self):
+        return self.alive
+
+    def check_connection(self):
+        self.checks = self.checks + 1
+        if self.broken:
+            raise sql_base.SQLError("server closed the connection")
+
+    def rollback(self, name=None):
+        self.rollbacks = self.rollbacks + 1
+
+    def close(self):
+        self.alive = 0
+
+    def prepare(self, sql, force=0, blob_map=None, streaming=0):
+        return (self, sql)
+
+
+class PoolTests(unittest.TestCase):
+
+    def setUp(self):
+        FakeDatabase.connections = 0
+
+    def test_reuse(self):
+        pool = sql_pool.Pool(FakeDatabase, 2)
+        db = pool.checkout()
+        pool.checkin(db)
+        self.assertTrue(pool.checkout() is db)
+        self.assertEqual(db.rollbacks, 1)
+        self.assertEqual(FakeDatabase.connections, 1)
+        # Not idle for long, so no round trip to check it
+        self.assertEqual(db.checks, 0)
+
+    def test_dead(self):
+        pool = sql_pool.Pool(FakeDatabase, 2)
+        db = pool.checkout()
+        pool.checkin(db)
+        db.alive = 0
+        self.assertFalse(pool.checkout() is db)
+        self.assertEqual(pool.size(), 1)
+
+    def test_closed_by_server(self):
+        pool = sql_pool.Pool(FakeDatabase, 2, probe_after=0)
+        db = pool.checkout()
+        pool.checkin(db)
+        db.broken = 1
+        time.sleep(0.01)
+        self.assertFalse(pool.checkout() is db)
+        self.assertFalse(db.alive)
+        self.assertEqual(pool.size(), 1)
+
+    def test_checkout_timeout(self):
+        pool = sql_pool.Pool(FakeDatabase, 1, checkout_timeout=0.2)
+        pool.checkout()
+        failed = []
+
+        def checkout():
+            try:
+                pool.checkout()
+            except sql_base.SQLConnectError:
+                failed.append(1)
+        waiter = threading.Thread(target=checkout)
+        waiter.start()
+        waiter.join(5)
+        self.assertEqual(failed, [1])
+
+    def test_idle_timeout(self):
+        pool = sql_pool.Pool(FakeDatabase, 2, idle_timeout=0)
+        db = pool.checkout()
+        pool.checkin(db)
+        time.sleep(0.01)
+        pool.checkout()
+        self.assertFalse(db.alive)
+        self.assertEqual(pool.size(), 1)
+
+    def test_max_size(self):
+        pool = sql_pool.Pool(FakeDatabase, 1)
+        db = pool.checkout()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.checkout()))
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(got, [])
+        pool.checkin(db)
+        waiter.join(5)
+        self.assertEqual(got, [db])
+
+    def test_exited_thread(self):
+        pool = sql_pool.Pool(FakeDatabase, 1)
+        thread = threading.Thread(target=pool.checkout)
+        thread.start()
+        thread.join()
+        # The connection of the exited thread is reclaimed
+        pool.checkout()
+        self.assertEqual(FakeDatabase.connections, 1)
+
+
+class PooledDatabaseTests(unittest.TestCase):
+
+    def test_per_thread(self):
+        db = sql_pool.PooledDatabase(FakeDatabase, 2)
+        mine = db.prepare("select 1")[0]
+        self.assertTrue(db.prepare("select 1")[0] is mine)
+
+        theirs = []
+        thread = threading.Thread(
+            target=lambda: theirs.append(db.prepare("select 1")[0]) or db.release())
+        thread.start()
+        thread.join()
+        self.assertFalse(theirs[0] is mine)
+
+        db.release()
+        self.assertEqual(db.pool.size(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
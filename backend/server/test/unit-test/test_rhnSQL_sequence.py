@@ -0,0 +1,98 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+from spacewalk.server.rhnSQL import sql_base, sql_sequence
+
+
+class FakeCursor:
+
+    def __init__(self, db, sql):
+        self.db = db
+        self.sql = sql
+        self.rows = []
+
+    def execute(self, count=None):
+        self.db.round_trips = self.db.round_trips + 1
+        if count is None:
+            count = 1
+        self.rows = []
+        for _i in range(count):
+            self.db.value = self.db.value + 1
+            self.rows.append((self.db.value, ))
+
+    def fetchone(self):
+        return self.rows.pop(0)
+
+    def fetchone_dict(self):
+        return {'id': self.rows.pop(0)[0]}
+
+    def fetchall(self):
+        # Rows don't have to come in order
+        rows, self.rows = self.rows[::-1], []
+        return rows
+
+
+class FakeDatabase(sql_base.Database):
+
+    """ A sequence counting round trips instead of a database. """
+
+    def __init__(self, block_sql=None):
+        sql_base.Database.__init__(self)
+        self._sequence_values_sql = block_sql
+        self.round_trips = 0
+        self.value = 0
+
+    def prepare(self, sql, force=0, blob_map=None, streaming=0):
+        return FakeCursor(self, sql)
+
+
+class SequenceTests(unittest.TestCase):
+
+    def test_next_block(self):
+        db = FakeDatabase("select ... from generate_series(1, :count) -- %s")
+        seq = sql_sequence.Sequence(db, 'rhn_package_id_seq')
+        self.assertEqual(seq.next_block(5), [1, 2, 3, 4, 5])
+        self.assertEqual(db.round_trips, 1)
+        self.assertEqual(seq.next_block(0), [])
+        self.assertEqual(db.round_trips, 1)
+
+    def test_next_block_fallback(self):
+        # Backends without a block query get the values one by one
+        db = FakeDatabase()
+        seq = sql_sequence.Sequence(db, 'rhn_package_id_seq')
+        self.assertEqual(seq.next_block(3), [1, 2, 3])
+        self.assertEqual(db.round_trips, 3)
+
+    def test_preallocate(self):
+        db = FakeDatabase("select ... from generate_series(1, :count) -- %s")
+        seq = sql_sequence.Sequence(db, 'rhn_package_id_seq')
+        seq.preallocate(3)
+        self.assertEqual(db.round_trips, 1)
+        self.assertEqual([seq.next(), seq.next()], [1, 2])
+        # Only what is missing is fetched
+        seq.preallocate(3)
+        self.assertEqual(db.round_trips, 2)
+        self.assertEqual([seq.next(), seq.next(), seq.next()], [3, 4, 5])
+        self.assertEqual(db.round_trips, 2)
+        # Back to one value per round trip
+        self.assertEqual(seq.next(), 6)
+        self.assertEqual(db.round_trips, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
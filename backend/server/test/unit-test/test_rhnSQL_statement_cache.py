@@ -0,0 +1,105 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+import psycopg2
+
+from spacewalk.server.rhnSQL import driver_postgresql
+
+
+class FakeCursor:
+
+    """ Records the statements executed; fails PREPAREs containing 'bad'. """
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        self.executed.append(statement)
+        if statement.startswith("PREPARE") and "bad" in statement:
+            raise psycopg2.ProgrammingError("could not determine data type")
+
+
+class QueryCacheTests(unittest.TestCase):
+
+    def test_hits(self):
+        cache = driver_postgresql.QueryCache()
+        query = "select 1 from dual where id = :id and name like 'a%'"
+        self.assertEqual(cache.get(query),
+                         "select 1 from dual where id = %(id)s and name like 'a%%'")
+        cache.get(query)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict(self):
+        cache = driver_postgresql.QueryCache(size=4)
+        for i in range(4):
+            cache.get("select %d" % i)
+        # Keep the first one recently used
+        cache.get("select 0")
+        cache.get("select 4")
+        self.assertTrue(len(cache) <= 4)
+        cache.get("select 0")
+        self.assertEqual(cache.hits, 2)
+
+
+class PreparedStatementsTests(unittest.TestCase):
+
+    def test_positional(self):
+        query = driver_postgresql.convert_named_query_params(
+            "select :b, :a from t where b = :B and c like '%x'")
+        self.assertEqual(driver_postgresql.convert_to_positional_params(query),
+                         ("select $1, $2 from t where b = $1 and c like '%x'",
+                          ['b', 'a']))
+
+    def test_threshold(self):
+        statements = driver_postgresql.PreparedStatements(threshold=3)
+        cursor = FakeCursor()
+        query = "select id from t where id = %(id)s"
+        self.assertEqual(statements.get(cursor, query), None)
+        self.assertEqual(statements.get(cursor, query), None)
+        self.assertEqual(cursor.executed, [])
+
+        statement = statements.get(cursor, query)
+        self.assertEqual(statement, "EXECUTE rhn_sql_0 (%(id)s)")
+        self.assertTrue("PREPARE rhn_sql_0 AS select id from t where id = $1"
+                        in cursor.executed)
+        self.assertEqual(statements.get(cursor, query), statement)
+        self.assertEqual(statements.stats(), {'prepared': 1, 'prepared_hits': 1,
+                                              'prepare_failures': 0})
+
+    def test_failure(self):
+        statements = driver_postgresql.PreparedStatements(threshold=1)
+        cursor = FakeCursor()
+        query = "select bad from t where %(x)s is null"
+        self.assertEqual(statements.get(cursor, query), None)
+        self.assertEqual(cursor.executed[-1],
+                         "ROLLBACK TO SAVEPOINT rhn_sql_prepare")
+        # Not attempted again
+        del cursor.executed[:]
+        self.assertEqual(statements.get(cursor, query), None)
+        self.assertEqual(cursor.executed, [])
+        self.assertEqual(statements.stats()['prepare_failures'], 1)
+
+    def test_not_preparable(self):
+        statements = driver_postgresql.PreparedStatements(threshold=1)
+        cursor = FakeCursor()
+        self.assertEqual(statements.get(cursor, "savepoint foo"), None)
+        self.assertEqual(cursor.executed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
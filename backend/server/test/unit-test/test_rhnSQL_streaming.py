@@ -0,0 +1,90 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+from spacewalk.server.rhnSQL import driver_postgresql
+
+ROWS = [(i, "package%d" % i) for i in range(25)]
+DESCRIPTION = (('ID', None, None, None, None, None, None),
+               ('NAME', None, None, None, None, None, None))
+
+
+class FakeNamedCursor:
+
+    """ Like a psycopg2 named cursor: describes the rows once it fetched. """
+
+    def __init__(self, name):
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self.fetches = []
+        self.closed = 0
+
+    def execute(self, sql, params):
+        self._rows = list(ROWS)
+
+    def fetchmany(self, size):
+        self.description = DESCRIPTION
+        self.fetches.append(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self, name=None):
+        assert name, "streaming cursors have to be named"
+        self.cursors.append(FakeNamedCursor(name))
+        return self.cursors[-1]
+
+
+class StreamingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dbh = FakeConnection()
+        self.h = driver_postgresql.Cursor(dbh=self.dbh, sql="select id, name from t",
+                                          streaming=1)
+        self.h.arraysize = 10
+
+    def test_iterate(self):
+        self.h.execute()
+        self.assertEqual(list(self.h.iterate()), ROWS)
+        self.assertEqual(self.dbh.cursors[0].fetches, [10, 10, 10])
+
+    def test_iterate_dict(self):
+        self.h.execute()
+        rows = list(self.h.iterate_dict())
+        self.assertEqual(rows[3], {'id': 3, 'name': "package3"})
+        self.assertEqual(len(rows), 25)
+
+    def test_execute_again(self):
+        self.h.execute()
+        self.h.fetchmany()
+        self.h.execute()
+        self.assertEqual(len(list(self.h.iterate())), 25)
+        self.assertTrue(self.dbh.cursors[0].closed)
+        self.assertNotEqual(self.dbh.cursors[0].name, self.dbh.cursors[1].name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+#
+# rhn_rpm.nvre_key() has to agree with rpm.labelCompare(); random versions
+# are checked against the rpm module installed.
+#
+
+import random
+import unittest
+
+from spacewalk.common import rhn_rpm
+from spacewalk.server.rhnServer import server_packages
+
+SEPARATORS = ['.', '.', '.', '_', '+', '%', '']
+
+
+def random_segment(rnd):
+    kind = rnd.random()
+    if kind < 0.5:
+        return str(rnd.randint(0, 20))
+    if kind < 0.8:
+        return rnd.choice(['a', 'b', 'rc', 'el', 'Z', 'git'])
+    return rnd.choice(['~', '^'])
+
+
+def random_version(rnd):
+    segments = [random_segment(rnd) for _i in range(rnd.randint(0, 4))]
+    return string_join(rnd, segments)
+
+
+def string_join(rnd, segments):
+    ret = ''
+    for segment in segments:
+        ret = ret + segment + rnd.choice(SEPARATORS)
+    return ret
+
+
+def variant(rnd, version):
+    """ A version rpm most likely finds equal to version """
+    ret = ''
+    for c in version:
+        if c.isdigit() and rnd.random() < 0.2:
+            c = '0' * rnd.randint(1, 2) + c
+        elif not c.isalnum() and c not in '~^':
+            c = rnd.choice(SEPARATORS[:-1])
+        ret = ret + c
+    if rnd.random() < 0.2:
+        ret = ret + rnd.choice(SEPARATORS)
+    return ret
+
+
+def random_epoch(rnd):
+    return rnd.choice(['', None, '0', '00', '1', '01', '2'])
+
+
+class NvreKeyTests(unittest.TestCase):
+
+    def check(self, p1, p2):
+        same_key = rhn_rpm.nvre_key(p1) == rhn_rpm.nvre_key(p2)
+        identical = rhn_rpm.nvre_compare(p1, p2) == 0
+        self.assertEqual(same_key, identical, "%s %s: nvre_compare() %s, nvre_key() %s" % (
+            p1, p2, rhn_rpm.nvre_compare(p1, p2), same_key))
+
+    def test_known(self):
+        self.check(('perl', '1.01', '1', ''), ('perl', '1.1', '1', ''))
+        self.check(('perl', '1.10', '1', ''), ('perl', '1.1', '1', ''))
+        self.check(('perl', '1.0', '1', ''), ('perl', '1_0', '1', None))
+        self.check(('perl', '1.0', '1', ''), ('perl', '1.0', '1', '0'))
+        self.check(('perl', '1.0', '1', ''), ('perl', '10', '1', '0'))
+        self.check(('perl', '1.0', '1', ''), ('perl', '1.0~rc1', '1', ''))
+
+    def test_random(self):
+        rnd = random.Random(42)
+        for _i in range(20000):
+            v1, r1 = random_version(rnd), random_version(rnd)
+            if rnd.random() < 0.5:
+                v2, r2 = variant(rnd, v1), variant(rnd, r1)
+            else:
+                v2, r2 = random_version(rnd), random_version(rnd)
+            self.check(('foo', v1, r1, random_epoch(rnd)),
+                       ('foo', v2, r2, random_epoch(rnd)))
+
+    def test_package_delta(self):
+        list1 = [('perl', '1.1', '1', ''), ('kernel', '2.4', '1', ''),
+                 ('kernel', '2.4', '2', '1'), ('unzip', '1.1', '2', '')]
+        list2 = [('perl', '1.01', '1', ''), ('kernel', '2.4', '3', '1'),
+                 ('kernel', '2.4', '1', '0'), ('aalib', '1.0', '1', '')]
+        installs, removes = server_packages.package_delta(list1, list2)
+        self.assertEqual(installs, [('aalib', '1.0', '1', ''), ('kernel', '2.4', '3', '1')])
+        self.assertEqual(removes, [('kernel', '2.4', '2', '1'), ('unzip', '1.1', '2', '')])
+
+
+if __name__ == '__main__':
+    unittest.main()
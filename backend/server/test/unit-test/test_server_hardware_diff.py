@@ -0,0 +1,197 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import sqlite3
+import unittest
+
+from spacewalk.server.rhnServer import server_hardware
+
+
+class Cursor:
+
+    def __init__(self, db, sql):
+        self.db = db
+        self.sql = sql
+        self.cursor = None
+
+    def execute(self, **kwargs):
+        self.db.statements.append(self.sql)
+        self.cursor = self.db.dbh.execute(self.sql, kwargs)
+
+    def executemany(self, **kwargs):
+        self.db.statements.append(self.sql)
+        keys = list(kwargs.keys())
+        rows = [dict(zip(keys, values)) for values in zip(*[kwargs[k] for k in keys])]
+        return self.db.dbh.executemany(self.sql, rows).rowcount
+
+    def _dict(self, row):
+        return dict(zip([d[0] for d in self.cursor.description], row))
+
+    def fetchone_dict(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return self._dict(row)
+
+    def fetchall_dict(self):
+        return [self._dict(row) for row in self.cursor.fetchall()] or None
+
+
+class Sequence:
+
+    def __init__(self, db, seq):
+        self.db = db
+        self.seq = seq
+
+    def next_block(self, count):
+        self.db.statements.append("sequence")
+        last = self.db.sequences.get(self.seq, 100)
+        self.db.sequences[self.seq] = last + count
+        return list(range(last + 1, last + count + 1))
+
+
+class FakeRhnSQL:
+
+    """ Enough of rhnSQL to save hardware profiles to SQLite. """
+
+    def __init__(self):
+        self.dbh = sqlite3.connect(":memory:")
+        self.dbh.text_factory = str
+        self.statements = []
+        self.sequences = {}
+        self.dbh.execute("""
+            create table rhnDevice (id integer, server_id integer, class text,
+                bus text, device text, driver text, detached text, description text,
+                pcitype integer, prop1 text, prop2 text, prop3 text, prop4 text)
+        """)
+        self.dbh.execute("create table rhnRAM (id integer, server_id integer, ram integer, swap integer)")
+        for table in ["rhnCPU", "rhnServerDMI", "rhnServerNetwork", "rhnServerInstallInfo"]:
+            self.dbh.execute("create table %s (id integer, server_id integer)" % table)
+        self.dbh.execute("""
+            create table rhnServerNetInterface (id integer primary key, server_id integer,
+                name text, hw_addr text, module text)
+        """)
+        self.dbh.execute("""
+            create table rhnServerNetAddress4 (interface_id integer,
+                address text, netmask text, broadcast text)
+        """)
+        self.dbh.execute("""
+            create table rhnServerNetAddress6 (interface_id integer,
+                address text, netmask text, scope text)
+        """)
+
+    def prepare(self, sql):
+        return Cursor(self, sql)
+
+    def Sequence(self, seq):
+        return Sequence(self, seq)
+
+    def rows(self, table, order_by="id"):
+        return self.dbh.execute("select * from %s order by %s" % (table, order_by)).fetchall()
+
+
+def _profile(disk_description):
+    return [
+        {'class': 'MEMORY', 'ram': '2048', 'swap': 1024},
+        {'class': 'HD', 'bus': 'SCSI', 'desc': disk_description, 'driver': 'sd',
+         'device': 'sda', 'detached': 0, 'pcitype': -1, 'host': 0, 'id': 0,
+         'channel': 0, 'lun': 0},
+        {'class': 'USB', 'bus': 'USB', 'desc': '', 'driver': 'usb',
+         'vendorid': '1d6b', 'deviceid': '0002', 'detached': 0, 'pcitype': -1},
+        {'class': 'USB', 'bus': 'USB', 'desc': '', 'driver': 'usb',
+         'vendorid': '1d6b', 'deviceid': '0002', 'detached': 0, 'pcitype': -1},
+    ]
+
+
+def _interfaces(ipaddr):
+    return {'class': 'NETINTERFACES',
+            'eth0': {'hwaddr': '52:54:00:12:34:56', 'module': 'virtio_net',
+                     'ipaddr': ipaddr, 'netmask': '255.255.255.0',
+                     'broadcast': '10.0.0.255'}}
+
+
+class HardwareDiffTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rhnSQL = server_hardware.rhnSQL
+        server_hardware.rhnSQL = self.db = FakeRhnSQL()
+
+    def tearDown(self):
+        server_hardware.rhnSQL = self.rhnSQL
+
+    def _save(self, profile, refresh=False):
+        hardware = server_hardware.Hardware()
+        if refresh:
+            hardware.delete_hardware(1)
+        for device in profile:
+            hardware.add_hardware(device)
+        self.db.statements = []
+        hardware.save_hardware_byid(1)
+        return hardware
+
+    def test_bulk_insert(self):
+        self._save(_profile('disk'))
+        self.assertEqual(self.db.rows("rhnRAM"), [(101, 1, 2048, 1024)])
+        rows = self.db.rows("rhnDevice")
+        self.assertEqual([row[0] for row in rows], [101, 102, 103])
+        self.assertEqual(sorted([row[7] for row in rows]), [None, None, 'disk'])
+        # One sequence call per table, one insert per table and set of
+        # columns: NULLs are left out for the column defaults to apply
+        self.assertEqual(self.db.statements.count("sequence"), 2)
+        self.assertEqual(len([sql for sql in self.db.statements if sql.startswith("insert")]), 3)
+
+    def test_refresh_unchanged(self):
+        self._save(_profile('disk'))
+        before = self.db.rows("rhnDevice") + self.db.rows("rhnRAM")
+        self._save(_profile('disk'), refresh=True)
+        self.assertEqual(self.db.rows("rhnDevice") + self.db.rows("rhnRAM"), before)
+        self.assertEqual([sql for sql in self.db.statements
+                          if sql.startswith("insert") or sql.startswith("delete")], [])
+
+    def test_refresh_changed(self):
+        self._save(_profile('disk'))
+        profile = _profile('bigger disk')
+        # One of the two identical devices is gone
+        del profile[3]
+        hardware = self._save(profile, refresh=True)
+        rows = self.db.rows("rhnDevice")
+        # The disk is replaced, the remaining USB device kept
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[0][0] in (102, 103))
+        self.assertEqual(rows[1][0], 104)
+        self.assertEqual(rows[1][7], 'bigger disk')
+        self.assertEqual(self.db.rows("rhnRAM"), [(101, 1, 2048, 1024)])
+        devices = hardware.hardware_by_class(server_hardware.HardwareDevice)
+        self.assertEqual(sorted([dev.id for dev in devices]), [row[0] for row in rows])
+        self.assertEqual([dev.status for dev in devices], [0, 0])
+
+    def test_net_interfaces(self):
+        profile = _profile('disk') + [_interfaces('10.0.0.1')]
+        self._save(profile)
+        self.assertEqual(self.db.rows("rhnServerNetInterface"),
+                         [(1, 1, 'eth0', '52:54:00:12:34:56', 'virtio_net')])
+        self.assertEqual(self.db.rows("rhnServerNetAddress4", "address"),
+                         [(1, '10.0.0.1', '255.255.255.0', '10.0.0.255')])
+
+        # The interfaces loaded from the db are replaced by the new ones
+        self._save(_profile('disk') + [_interfaces('10.0.0.2')], refresh=True)
+        self.assertEqual(len(self.db.rows("rhnServerNetInterface")), 1)
+        self.assertEqual(self.db.rows("rhnServerNetAddress4", "address"),
+                         [(1, '10.0.0.2', '255.255.255.0', '10.0.0.255')])
+
+
+if __name__ == '__main__':
+    unittest.main()
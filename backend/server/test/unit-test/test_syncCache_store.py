@@ -0,0 +1,107 @@
+#!/usr/bin/python2
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from spacewalk.satellite_tools import syncCache
+
+KEY = "satsync/packages/12/rhn-package-12345"
+PACKAGE = {'package_id': 'rhn-package-12345', 'name': 'bash', 'files': ['/bin/bash'] * 10}
+
+
+class StoreTests:
+
+    """ The same checks, run against both stores. """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = self._store()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        self.assertEqual(self.store.get(KEY), None)
+        self.assertFalse(self.store.has_key(KEY))
+        self.store.set(KEY, PACKAGE, compressed=1)
+        self.assertEqual(self.store.get(KEY, compressed=1), PACKAGE)
+        self.assertTrue(self.store.has_key(KEY))
+
+    def test_timestamps(self):
+        self.store.set(KEY, PACKAGE, modified="20180102030405")
+        self.assertEqual(self.store.get(KEY, modified="20180102030405"), PACKAGE)
+        self.assertEqual(self.store.get(KEY), PACKAGE)
+        self.assertEqual(self.store.get(KEY, modified="20180102030406"), None)
+        self.assertTrue(self.store.has_key(KEY, modified="20180102030405"))
+        self.assertFalse(self.store.has_key(KEY, modified="20180102030406"))
+
+    def test_many(self):
+        keys = ["satsync/short-packages/%s/rhn-package-%s" % (i % 10, i) for i in range(30)]
+        self.store.set_many([(key, {'key': key}, None) for key in keys[:20]])
+        values = self.store.get_many(keys)
+        self.assertEqual(sorted(values.keys()), sorted(keys))
+        for key in keys:
+            if key in keys[:20]:
+                self.assertEqual(values[key], {'key': key})
+            else:
+                self.assertEqual(values[key], None)
+
+
+class FileStoreTests(StoreTests, unittest.TestCase):
+
+    def _store(self):
+        return syncCache.FileStore(self.tmpdir)
+
+
+class SQLiteStoreTests(StoreTests, unittest.TestCase):
+
+    def _store(self):
+        return syncCache.SQLiteStore(os.path.join(self.tmpdir, syncCache.STORE_FILE))
+
+    def tearDown(self):
+        self.store.close()
+        StoreTests.tearDown(self)
+
+    def test_batch_commits(self):
+        filename = os.path.join(self.tmpdir, syncCache.STORE_FILE)
+        self.store.set_many([("key%d" % i, i, None) for i in range(syncCache.FLUSH_INTERVAL - 1)])
+        # Not written out yet, but seen by the process which wrote it
+        other = syncCache.SQLiteStore(filename)
+        self.assertEqual(other.get("key0"), None)
+        self.assertEqual(self.store.get("key0"), 0)
+        self.store.set("key%d" % syncCache.FLUSH_INTERVAL, 1)
+        self.assertEqual(other.get("key0"), 0)
+        self.store.set("last", 1)
+        self.store.close()
+        self.assertEqual(other.get("last"), 1)
+        other.close()
+
+    def test_single_file(self):
+        self.store.set_many([("satsync/packages/%s/package%s" % (i % 10, i), i, None)
+                             for i in range(100)])
+        self.store.flush()
+        files = []
+        for _dirpath, _dirnames, filenames in os.walk(self.tmpdir):
+            files.extend(filenames)
+        self.assertEqual(sorted(files)[0], "cache.db")
+        self.assertTrue(len(files) <= 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
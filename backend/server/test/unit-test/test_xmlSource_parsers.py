@@ -0,0 +1,186 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2018 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+try:
+    #  python 2
+    from StringIO import StringIO
+except ImportError:
+    #  python3
+    from io import StringIO
+
+from spacewalk.satellite_tools import xmlSource
+from spacewalk.server.importlib import importLib
+
+DUMP = """<?xml version="1.0" encoding="UTF-8"?>
+<rhn-satellite version="3.10" generation="2">
+  <rhn-channels>
+    <rhn-channel label="base-channel" channel-arch="channel-x86_64" org-id="">
+      <rhn-channel-name>Base channel</rhn-channel-name>
+      <rhn-channel-checksum-type><rhn-null/></rhn-channel-checksum-type>
+      <rhn-channel-families>
+        <rhn-channel-family label="family" id="rhn-channel-family-1"/>
+      </rhn-channel-families>
+      <rhn-dists>
+        <rhn-dist channel-arch="channel-x86_64" os="Red Hat" release="7"/>
+      </rhn-dists>
+    </rhn-channel>
+  </rhn-channels>
+  <rhn-unknown-container><rhn-unknown-item name="ignored"/></rhn-unknown-container>
+  <rhn-packages>
+    <rhn-package id="rhn-package-1" org-id="" name="bash" version="4.2.46"
+        release="30.el7" epoch="" package-arch="x86_64" package-size="1037976"
+        build-time="1506080400" last-modified="1514764800" md5sum="0123">
+      <rhn-package-summary>The GNU Bourne Again shell</rhn-package-summary>
+      <rhn-package-description>Söme ünicode &amp; &lt;markup&gt;
+in a description</rhn-package-description>
+      <rhn-package-header-sig><rhn-null/></rhn-package-header-sig>
+      <rhn-package-header-start>1384</rhn-package-header-start>
+      <checksums>
+        <checksum type="sha256" value="4567"/>
+      </checksums>
+      <rhn-package-changelog>
+        <rhn-package-changelog-entry>
+          <rhn-package-changelog-entry-name>Jöe Developer</rhn-package-changelog-entry-name>
+          <rhn-package-changelog-entry-text>- Fixed a bug</rhn-package-changelog-entry-text>
+          <rhn-package-changelog-entry-time>1400000000</rhn-package-changelog-entry-time>
+        </rhn-package-changelog-entry>
+      </rhn-package-changelog>
+      <rhn-package-requires>
+        <rhn-package-requires-entry name="rpmlib(FileDigests)" version="4.6.0-1" sense="16777226"/>
+        <rhn-package-requires-entry name="libc.so.6()(64bit)" version="" sense="16384"/>
+      </rhn-package-requires>
+      <rhn-package-conflicts/>
+      <rhn-package-files>
+        <rhn-package-file name="/usr/bin/bash" file-size="960632" mtime="1506080400"
+            checksum-type="sha256" checksum="89ab" linkto="" flags="0" lang=""/>
+        <rhn-package-file name="/usr/bin/sh" file-size="4" mtime="1506080400"
+            checksum-type="" checksum="" md5="" linkto="bash" flags="0" lang=""/>
+      </rhn-package-files>
+    </rhn-package>
+  </rhn-packages>
+  <rhn-errata>
+    <rhn-erratum id="rhn-erratum-1" advisory="RHSA-2018:0001" channels="base-channel"
+        packages="rhn-package-1" cve-names="CVE-2018-0001 CVE-2018-0002">
+      <rhn-erratum-advisory-name>RHSA-2018:0001</rhn-erratum-advisory-name>
+      <rhn-erratum-synopsis>Important: bash security update</rhn-erratum-synopsis>
+      <rhn-erratum-issue-date>1514764800</rhn-erratum-issue-date>
+      <rhn-erratum-keywords>
+        <rhn-erratum-keyword>reboot_suggested</rhn-erratum-keyword>
+      </rhn-erratum-keywords>
+      <rhn-erratum-bugs>
+        <rhn-erratum-bug>
+          <rhn-erratum-bug-id>1</rhn-erratum-bug-id>
+          <rhn-erratum-bug-summary>A bug</rhn-erratum-bug-summary>
+        </rhn-erratum-bug>
+      </rhn-erratum-bugs>
+      <rhn-erratum-files>
+        <rhn-erratum-file filename="bash.rpm" type="RPM" channels="base-channel"
+            package="rhn-package-1" md5sum="0123"/>
+      </rhn-erratum-files>
+    </rhn-erratum>
+  </rhn-errata>
+</rhn-satellite>
+"""
+
+
+class FakeCFG:
+
+    """ Enough of CFG for the items and the parser selection. """
+
+    def __init__(self, **options):
+        self.options = options
+        self.options['checksum_priority_list'] = ['sha256', 'sha1', 'md5']
+
+    def is_initialized(self):
+        return 1
+
+    def has_key(self, key):
+        return key in self.options
+
+    def __getattr__(self, key):
+        return self.options[key.lower()]
+
+
+def _normalize(obj):
+    # Items compare on their class and data
+    if isinstance(obj, list):
+        return [_normalize(x) for x in obj]
+    if isinstance(obj, dict):
+        return dict([(k, _normalize(v)) for k, v in obj.items()])
+    if isinstance(obj, importLib.Item):
+        return (obj.__class__.__name__, _normalize(obj.data))
+    return obj
+
+
+class ParserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.CFG = xmlSource.CFG
+        xmlSource.CFG = FakeCFG()
+
+    def tearDown(self):
+        xmlSource.CFG = self.CFG
+
+    def _parse(self, parser):
+        containers = [xmlSource.ChannelContainer(), xmlSource.PackageContainer(),
+                      xmlSource.ErrataContainer()]
+        handler = xmlSource.SatelliteDispatchHandler(parser)
+        for container in containers:
+            handler.set_container(container)
+        handler.process(StringIO(DUMP))
+        handler.close()
+        return [container.batch for container in containers]
+
+    def test_same_items(self):
+        self.assertEqual(_normalize(self._parse('expat')), _normalize(self._parse('sax')))
+
+    def test_items(self):
+        channels, packages, errata = self._parse('expat')
+        self.assertEqual(len(channels), 1)
+        self.assertEqual(channels[0]['checksum_type'], None)
+        self.assertEqual([f['label'] for f in channels[0]['families']], ['family'])
+        package = packages[0]
+        self.assertEqual(package['description'],
+                         'S\xc3\xb6me \xc3\xbcnicode & <markup>\nin a description')
+        self.assertEqual(package['header_start'], 1384)
+        self.assertEqual(package['checksum_type'], 'sha256')
+        self.assertEqual([d['name'] for d in package['requires']],
+                         ['rpmlib(FileDigests)', 'libc.so.6()(64bit)'])
+        self.assertEqual(package['conflicts'], [])
+        self.assertEqual([f['name'] for f in package['files']], ['/usr/bin/bash', '/usr/bin/sh'])
+        self.assertTrue(isinstance(package['files'][0], importLib.File))
+        self.assertEqual(package['files'][0]['checksum'], '89ab')
+        self.assertEqual(package['changelog'][0]['name'], 'J\xc3\xb6e Developer')
+        erratum = errata[0]
+        self.assertEqual(erratum['cve'], ['CVE-2018-0001', 'CVE-2018-0002'])
+        self.assertEqual([k['keyword'] for k in erratum['keywords']], ['reboot_suggested'])
+        self.assertEqual(erratum['bugs'][0]['summary'], 'A bug')
+        self.assertEqual([c['label'] for c in erratum['channels']], ['base-channel'])
+
+    def test_get_parser(self):
+        self.assertEqual(xmlSource.get_parser(), 'sax')
+        xmlSource.CFG = FakeCFG(sync_xml_parser='expat')
+        self.assertEqual(xmlSource.get_parser(), 'expat')
+        self.assertEqual(xmlSource.SatelliteDispatchHandler().parser, 'expat')
+        xmlSource.CFG = FakeCFG(sync_xml_parser='lxml')
+        self.assertEqual(xmlSource.get_parser(), 'sax')
+        self.assertRaises(xmlSource.ParseException, xmlSource.SatelliteDispatchHandler, 'lxml')
+
+
+if __name__ == '__main__':
+    unittest.main()
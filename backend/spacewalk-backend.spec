@@ -461,6 +461,7 @@ rm -f %{rhnconf}/rhnSecret.py*
 %{pythonrhnroot}/common/apache.py*
 %{pythonrhnroot}/common/byterange.py*
 %{pythonrhnroot}/common/rhnApache.py*
+%{pythonrhnroot}/common/checksum_index.py*
 %{pythonrhnroot}/common/rhnCache.py*
 %{pythonrhnroot}/common/rhnConfig.py*
 %{pythonrhnroot}/common/rhnException.py*
@@ -561,6 +562,7 @@ rm -f %{rhnconf}/rhnSecret.py*
 %{pythonrhnroot}/server/repomd/domain.py*
 %{pythonrhnroot}/server/repomd/mapper.py*
 %{pythonrhnroot}/server/repomd/repository.py*
+%{pythonrhnroot}/server/repomd/store.py*
 %{pythonrhnroot}/server/repomd/view.py*
 
 # the cache
@@ -15,9 +15,18 @@
 #
 
 from wsgi import wsgiRequest
+from spacewalk.server import rhnSQL
 
 
 def handle(environ, start_response, server, component_type, servertype="spacewalk.server.apacheServer"):
+    try:
+        return _handle(environ, start_response, server, component_type, servertype)
+    finally:
+        # The threads live on; give a pooled database connection back
+        rhnSQL.release()
+
+
+def _handle(environ, start_response, server, component_type, servertype):
     # wsgi seems to capitalize incoming headers and add HTTP- to the front :/
     # so we strip out the first 5 letters, and transform it into what we want.
     replacements = {'_': '-', 'Rhn': 'RHN', 'Md5Sum': 'MD5sum', 'Xml': 'XML', 'Actualuri': 'ActualURI'}
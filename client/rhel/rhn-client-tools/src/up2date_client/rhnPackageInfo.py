@@ -2,12 +2,20 @@
 # all the crap that is stored on the rhn side of stuff
 # updating/fetching package lists, channels, etc
 
+import os
+import pickle
+import hashlib
 
+from rhn import rpclib
+from rhn.i18n import bstr
 from up2date_client import up2dateAuth
 from up2date_client import up2dateLog
 from up2date_client import rhnserver
 from up2date_client import pkgUtils
 
+# The package profile last sent to the server, to send deltas against
+pcklProfileFileName = "/var/spool/up2date/packageProfile.pkl"
+
 
 def logDeltaPackages(pkgs):
     log = up2dateLog.initLog()
@@ -22,10 +30,95 @@ def updatePackageProfile(timeout=None):
     log.log_me("Updating package profile")
     packages = pkgUtils.getInstalledPackageList(getArch=1)
     s = rhnserver.RhnServer(timeout=timeout)
+    systemid = up2dateAuth.getSystemId()
     if not s.capabilities.hasCapability('xmlrpc.packages.extended_profile', 2):
         # for older satellites and hosted - convert to old format
         packages = convertPackagesFromHashToList(packages)
-    s.registration.update_packages(up2dateAuth.getSystemId(), packages)
+        s.registration.update_packages(systemid, packages)
+        return
+    if not s.capabilities.hasCapability('registration.sync_packages', 1):
+        s.registration.update_packages(systemid, packages)
+        return
+
+    digest = profileDigest(packages)
+    state = readProfileState(systemid)
+    if state is not None:
+        added, deleted = profileDelta(state['packages'], packages)
+        log.log_debug("Sending package profile delta: %d added, %d deleted"
+                      % (len(added), len(deleted)))
+        if s.registration.sync_packages(systemid, {'base': state['digest'],
+                                                   'digest': digest,
+                                                   'added': added,
+                                                   'deleted': deleted}):
+            writeProfileState(systemid, digest, packages)
+            return
+        log.log_me("Package profile on the server differs, sending all of it")
+    s.registration.update_packages(systemid, packages, digest)
+    writeProfileState(systemid, digest, packages)
+
+def _packageKey(package):
+    return (package['name'], package['epoch'], package['version'],
+            package['release'], package.get('arch', ''),
+            package.get('installtime'))
+
+def profileDigest(packages):
+    """ digest of a package profile; the server keeps the one of the profile
+        it has, so that deltas get applied to the right profile only
+    """
+    keys = ["%s|%s|%s|%s|%s|%s" % _packageKey(p) for p in packages]
+    keys.sort()
+    return hashlib.sha256(bstr("\n".join(keys))).hexdigest()
+
+def profileDelta(old_packages, new_packages):
+    """ returns the lists of packages added and deleted """
+    old = dict([(_packageKey(p), p) for p in old_packages])
+    new = dict([(_packageKey(p), p) for p in new_packages])
+    added = [new[k] for k in new if k not in old]
+    deleted = [old[k] for k in old if k not in new]
+    return added, deleted
+
+def _systemIdNumber(systemid):
+    try:
+        return rpclib.xmlrpclib.loads(systemid)[0][0]['system_id']
+    except:
+        return None
+
+def readProfileState(systemid):
+    """ the profile last sent to the server for this system id, or None """
+    log = up2dateLog.initLog()
+    if not os.access(pcklProfileFileName, os.R_OK):
+        return None
+    f = open(pcklProfileFileName, 'rb')
+    try:
+        try:
+            state = pickle.load(f)
+        except (EOFError, ValueError, pickle.UnpicklingError):
+            log.log_debug("Unable to read %s" % pcklProfileFileName)
+            return None
+    finally:
+        f.close()
+    # Registered again since
+    if state.get('system_id') != _systemIdNumber(systemid):
+        return None
+    return state
+
+def writeProfileState(systemid, digest, packages):
+    log = up2dateLog.initLog()
+    data = {'system_id': _systemIdNumber(systemid),
+            'digest': digest,
+            'packages': packages}
+    try:
+        pcklDir = os.path.dirname(pcklProfileFileName)
+        if not os.access(pcklDir, os.W_OK):
+            os.mkdir(pcklDir)
+            os.chmod(pcklDir, int('0700', 8))
+        f = open(pcklProfileFileName + ".new", 'wb')
+        pickle.dump(data, f)
+        f.close()
+        os.rename(pcklProfileFileName + ".new", pcklProfileFileName)
+    except (IOError, OSError):
+        # The full profile is sent next time
+        log.log_me("Unable to write package profile to %s" % pcklProfileFileName)
 
 def pprint_pkglist(pkglist):
     if type(pkglist) == type([]):
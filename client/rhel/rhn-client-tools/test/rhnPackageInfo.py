@@ -44,9 +44,33 @@ class TestPprint_pkglist(unittest.TestCase):
         else:
             self.fail("expected a IndexError")
 
+class TestProfileDelta(unittest.TestCase):
+    def setUp(self):
+        self.foo = {'name': 'foo', 'epoch': '', 'version': '1.0',
+                    'release': '1', 'arch': 'x86_64', 'installtime': 1500000000}
+        self.bar = {'name': 'bar', 'epoch': '9', 'version': '2.0',
+                    'release': '2', 'arch': 'noarch', 'installtime': 1500000000}
+        self.foo2 = dict(self.foo)
+        self.foo2['installtime'] = 1500000100
+
+    def testDigestIgnoresOrder(self):
+        """Verify that the profile digest doesn't depend on the package order"""
+        assert rhnPackageInfo.profileDigest([self.foo, self.bar]) == \
+            rhnPackageInfo.profileDigest([self.bar, self.foo])
+        assert rhnPackageInfo.profileDigest([self.foo, self.bar]) != \
+            rhnPackageInfo.profileDigest([self.foo2, self.bar])
+
+    def testDelta(self):
+        """Verify that a reinstalled package is deleted and added again"""
+        added, deleted = rhnPackageInfo.profileDelta([self.foo, self.bar],
+                                                     [self.foo2])
+        assert added == [self.foo2]
+        assert len(deleted) == 2
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestPprint_pkglist))
+    suite.addTest(unittest.makeSuite(TestProfileDelta))
     return suite
 
 if __name__ == "__main__":
@@ -49,6 +49,8 @@ CREATE TABLE rhnServer
                                 REFERENCES rhnProvisionState (id),
     channels_changed    timestamp with local time zone,
     cobbler_id          VARCHAR2(64),
+    capabilities_digest VARCHAR2(64),
+    package_profile_digest VARCHAR2(64),
     created             timestamp with local time zone
                             DEFAULT (current_timestamp) NOT NULL,
     modified            timestamp with local time zone
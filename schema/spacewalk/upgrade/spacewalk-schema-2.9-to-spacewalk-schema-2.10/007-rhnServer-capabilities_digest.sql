@@ -0,0 +1 @@
+ALTER TABLE rhnServer ADD capabilities_digest character varying(64);
@@ -0,0 +1 @@
+ALTER TABLE rhnServer ADD package_profile_digest character varying(64);